@@ -2,6 +2,8 @@ import joblib
 import pandas as pd
 import numpy as np
 
+from tree_votes import VoteAnalyzer
+
 # Carica i modelli
 try:
     rf_model = joblib.load("random_forest_model.pkl")
@@ -161,21 +163,21 @@ def check_model_trees_consistency():
     
     student_scaled = scaler.transform(student_df)
     
-    # Ottieni predizioni da ogni albero
-    tree_predictions = []
-    for tree in rf_model.estimators_:
-        pred = tree.predict(student_scaled)[0]
-        tree_predictions.append(pred)
+    # Voti di tutti gli alberi con una sola visita della foresta
+    stats = VoteAnalyzer.from_model(rf_model).analyze(np.asarray(student_scaled, dtype=np.float64))
+    votes = stats['votes'][0]
+    n_trees = votes.sum()
     
     # Analizza consenso tra alberi
-    unique_predictions = np.unique(tree_predictions)
+    unique_predictions = np.flatnonzero(votes)
     print(f"Numero di predizioni diverse tra gli alberi: {len(unique_predictions)}")
     
     for pred in unique_predictions:
-        count = np.sum(np.array(tree_predictions) == pred)
-        percentage = count / len(tree_predictions) * 100
-        class_name = label_encoders["Performance"].inverse_transform([pred])[0]
-        print(f"  {class_name}: {count}/{len(tree_predictions)} alberi ({percentage:.1f}%)")
+        count = votes[pred]
+        percentage = count / n_trees * 100
+        class_name = label_encoders["Performance"].inverse_transform([rf_model.classes_[pred]])[0]
+        print(f"  {class_name}: {count}/{n_trees} alberi ({percentage:.1f}%)")
+    print(f"Entropia dei voti: {stats['vote_entropy'][0]:.3f}")
     
     if len(unique_predictions) == 1:
         print("⚠️  TUTTI gli alberi concordano sulla stessa predizione!")
@@ -1,134 +1,873 @@
-from flask import Flask, request, jsonify, render_template
+import hmac
+import time
+_BOOT_STARTED = time.perf_counter()
+
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
-import joblib
-import pandas as pd
 import numpy as np
 import os
+import uuid
+
+from preprocessing import FEATURE_COLUMNS
+from explanations import format_explanation
+from tree_votes import format_uncertainty
+from whatif import closest_point, sensitivity
+from model_registry import ModelRegistry
+from prediction_cache import PredictionCache
+from microbatch import MicroBatcher
+from shadow import ShadowScorer
+from similar_students import ReferenceSet
+from memory_stats import process_memory
+from metrics import MetricsRegistry, StageTimer, STAGE_BUCKETS
+from request_log import RequestLogger
+from bulk_scoring import (CsvFormatter, NdjsonFormatter, iter_chunks, iter_csv_records,
+                          iter_ndjson_records, iter_text_lines, score_chunk)
 
 app = Flask(__name__)
 CORS(app)
 
-# Carica i modelli salvati - USANDO MODELLI MIGLIORATI
+# Tempi di avvio del worker (import, caricamento modello, warmup), in ms
+STARTUP_TIMINGS = {'import_ms': (time.perf_counter() - _BOOT_STARTED) * 1000}
+
+# Motore di inferenza: 'sklearn' (predict_proba di scikit-learn), 'compiled'
+# (foresta compilata in array NumPy, vedi tree_engine.py) oppure 'binned'
+# (foresta compilata che confronta indici di bin uint8)
+INFERENCE_ENGINE = os.environ.get('INFERENCE_ENGINE', 'sklearn')
+
+# Directory dei modelli storici esportati da export_model.py, una sottodirectory
+# per versione (usata dai motori 'compiled' e 'binned')
+COMPILED_MODEL_DIR = os.environ.get('COMPILED_MODEL_DIR', 'compiled_model')
+
+# Con MODEL_MMAP=1 (e motore 'compiled' o 'binned') gli array del modello esportato sono
+# mappati in memoria in sola lettura e condivisi tra tutti i worker gunicorn
+MODEL_MMAP = os.environ.get('MODEL_MMAP', '0') == '1'
+
+# Registro versionato dei modelli (directory models/<versione>/ + artefatti storici)
+MODEL_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR', 'models')
+
+# Ogni quanti secondi controllare models/ACTIVE per cambiare versione (0 = mai)
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', 0))
+
+# Token per gli endpoint di amministrazione (se non impostato sono disattivati)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+registry = ModelRegistry(
+    root=MODEL_REGISTRY_DIR,
+    engine=INFERENCE_ENGINE,
+    mmap=MODEL_MMAP,
+    compiled_root=COMPILED_MODEL_DIR
+)
+
+# Carica i modelli salvati - USANDO MODELLI MIGLIORATI (salvo versione diversa
+# in MODEL_VERSION o in models/ACTIVE)
 try:
-    # Prova prima i modelli migliorati, poi quelli originali come fallback
-    try:
-        rf_model = joblib.load("random_forest_model_improved.pkl")
-        scaler = joblib.load("scaler_improved.pkl")
-        label_encoders = joblib.load("label_encoders_improved.pkl")
+    initial_version = registry.initial_version(os.environ.get('MODEL_VERSION'))
+    runtime, _ = registry.activate(initial_version)
+    STARTUP_TIMINGS['load_ms'] = runtime.load_ms
+    STARTUP_TIMINGS['warmup_ms'] = runtime.warmup_ms
+    if initial_version == 'improved':
         print("✅ Modelli MIGLIORATI caricati con successo!")
         print("   - Confidenze più realistiche (no più 100%)")
-    except FileNotFoundError:
-        rf_model = joblib.load("random_forest_model.pkl")
-        scaler = joblib.load("scaler.pkl")
-        label_encoders = joblib.load("label_encoders.pkl")
+    elif initial_version == 'original':
         print("⚠️  Modelli ORIGINALI caricati (potrebbero dare confidenza 100%)")
         print("   - Esegui fix_confidence_problem.py per modelli migliorati")
+    else:
+        print(f"✅ Modello '{initial_version}' caricato con successo!")
 except FileNotFoundError as e:
     print(f"Errore nel caricamento dei modelli: {e}")
     print("Assicurati che i file .pkl siano nella stessa directory del server")
 
-# Definizione delle colonne del dataset (senza ID e Performance)
-FEATURE_COLUMNS = [
-    'Age', 'Gender', 'Grade_Level', 'Strength_Score', 'Endurance_Score',
-    'Flexibility_Score', 'Speed_Agility_Score', 'BMI', 
-    'Health_Fitness_Knowledge_Score', 'Skills_Score', 
-    'Class_Participation_Level', 'Attendance_Rate', 'Motivation_Level',
-    'Overall_PE_Performance_Score', 'Improvement_Rate', 'Final_Grade',
-    'Previous_Semester_PE_Grade', 'Hours_Physical_Activity_Per_Week'
-]
+# Studenti di riferimento per /api/similar (opzionale, es.
+# SIMILAR_REFERENCE_CSV=student_pe_performance.csv). CSV e indice KD-tree (o
+# ball-tree con SIMILAR_INDEX=ball_tree) sono costruiti in background alla
+# prima richiesta, non all'avvio: senza CSV l'endpoint è disattivato
+SIMILAR_REFERENCE_CSV = os.environ.get('SIMILAR_REFERENCE_CSV', '')
+reference_set = ReferenceSet(
+    SIMILAR_REFERENCE_CSV, algorithm=os.environ.get('SIMILAR_INDEX', 'kd_tree')
+) if SIMILAR_REFERENCE_CSV else None
+
+# Numero massimo di vicini per studente in /api/similar
+MAX_SIMILAR_K = int(os.environ.get('MAX_SIMILAR_K', 50))
+
+STARTUP_TIMINGS['total_ms'] = (time.perf_counter() - _BOOT_STARTED) * 1000
+print(f"⏱️  Avvio: {STARTUP_TIMINGS['total_ms']:.0f} ms "
+      f"(import {STARTUP_TIMINGS['import_ms']:.0f} ms, "
+      f"caricamento {STARTUP_TIMINGS.get('load_ms') or 0:.0f} ms, "
+      f"warmup {STARTUP_TIMINGS.get('warmup_ms') or 0:.0f} ms)")
+
+# Mappa delle classi predette in italiano
+ITALIAN_MAPPING = {
+    'Low Performer': 'Prestazione Bassa',
+    'Average Performer': 'Prestazione Media', 
+    'High Performer': 'Prestazione Alta'
+}
+
+# Etichette italiane -> classi del modello (per i parametri delle richieste)
+ITALIAN_TO_ENGLISH = {italian: english for english, italian in ITALIAN_MAPPING.items()}
+
+# Numero massimo di studenti accettati in una singola richiesta batch
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 5000))
+
+# Righe per blocco nello scoring in streaming (/api/predict/stream)
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 1024))
+
+# Cache dei risultati di /api/predict (PREDICTION_CACHE_SIZE=0 la disattiva)
+prediction_cache = PredictionCache(
+    maxsize=int(os.environ.get('PREDICTION_CACHE_SIZE', 4096)),
+    ttl=float(os.environ.get('PREDICTION_CACHE_TTL', 0)),
+    precision=int(os.environ.get('PREDICTION_CACHE_PRECISION', 6))
+)
+
+# Micro-batching opzionale delle predizioni singole concorrenti: utile con
+# worker multi-thread (es. gunicorn --threads 8)
+MICROBATCH_ENABLED = os.environ.get('MICROBATCH_ENABLED', '0') == '1'
+micro_batcher = MicroBatcher(
+    max_batch_size=int(os.environ.get('MICROBATCH_MAX_SIZE', 64)),
+    max_wait_ms=float(os.environ.get('MICROBATCH_WINDOW_MS', 2))
+) if MICROBATCH_ENABLED else None
+
+# Modelli ombra: versioni candidate (separate da virgola) che ricevono in
+# background una frazione degli input di /api/predict, senza toccare la risposta
+SHADOW_VERSIONS = [v.strip() for v in os.environ.get('SHADOW_VERSIONS', '').split(',') if v.strip()]
+shadow_scorer = ShadowScorer(
+    dict(root=MODEL_REGISTRY_DIR, engine=INFERENCE_ENGINE, mmap=MODEL_MMAP,
+         compiled_root=COMPILED_MODEL_DIR),
+    SHADOW_VERSIONS,
+    sample_rate=float(os.environ.get('SHADOW_SAMPLE_RATE', 0.1)),
+    max_queue=int(os.environ.get('SHADOW_QUEUE_SIZE', 1000)),
+    max_batch_size=int(os.environ.get('SHADOW_MAX_BATCH', 256))
+) if SHADOW_VERSIONS else None
+if shadow_scorer is not None and __name__ != '__mp_main__':
+    # All'avvio del worker, non dentro una richiesta campionata. Con
+    # `python app.py` il processo ombra (spawn) reimporta questo file come
+    # __mp_main__: lì non va avviato un altro processo
+    shadow_scorer.start()
+
+# Metriche del percorso di predizione, esposte su /metrics (formato Prometheus)
+metrics = MetricsRegistry()
+STAGE_SECONDS = metrics.histogram(
+    'pe_request_stage_seconds', 'Durata delle fasi di una richiesta di predizione',
+    ('endpoint', 'stage'), buckets=STAGE_BUCKETS
+)
+REQUEST_SECONDS = metrics.histogram(
+    'pe_request_duration_seconds', 'Durata complessiva delle richieste di predizione',
+    ('endpoint',)
+)
+REQUESTS_TOTAL = metrics.counter(
+    'pe_requests_total', 'Richieste di predizione per esito', ('endpoint', 'outcome')
+)
+BATCH_ROWS_TOTAL = metrics.counter(
+    'pe_batch_rows_total', 'Righe ricevute da /api/predict/batch per esito', ('outcome',)
+)
+STREAM_ROWS_TOTAL = metrics.counter(
+    'pe_stream_rows_total', 'Righe ricevute da /api/predict/stream per esito', ('outcome',)
+)
+UNCERTAINTY_ROWS_TOTAL = metrics.counter(
+    'pe_uncertainty_rows_total', 'Righe di /api/uncertainty per esito (review = consenso basso)',
+    ('outcome',)
+)
+
+# Log strutturato delle richieste: un record JSON compatto per richiesta, con
+# payload e probabilità solo per una frazione LOG_SAMPLE_RATE delle richieste
+request_log = RequestLogger(
+    sample_rate=float(os.environ.get('LOG_SAMPLE_RATE', 0.01)),
+    enabled=os.environ.get('REQUEST_LOG_ENABLED', '1') == '1'
+)
+
+def _request_id():
+    """Id della richiesta: header X-Request-ID del chiamante oppure generato"""
+    request_id = g.get('request_id')
+    if request_id is None:
+        request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+        g.request_id = request_id
+    return request_id
+
+@app.after_request
+def _add_request_id(response):
+    request_id = g.get('request_id')
+    if request_id is not None:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+@app.before_request
+def _start_model_watcher():
+    # Avviato nel processo worker (anche se gunicorn carica l'app prima del fork)
+    registry.ensure_watcher(MODEL_WATCH_INTERVAL)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/healthz', methods=['GET'])
+def liveness():
+    """Liveness: il processo risponde (nessun lavoro, nessun template)"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readiness():
+    """Readiness: modello caricato e riscaldato, con i tempi di avvio del worker"""
+    runtime = registry.active
+    ready = runtime is not None and runtime.warmup_ms is not None
+    return jsonify({
+        'status': 'ready' if ready else 'loading',
+        'model_loaded': runtime is not None,
+        'model_version': runtime.version if runtime else None,
+        'warmed_up': ready,
+        'startup': STARTUP_TIMINGS
+    }), 200 if ready else 503
+
 @app.route('/api/predict', methods=['POST'])
 def predict_performance():
+    timer = StageTimer(STAGE_SECONDS, 'predict')
+    outcome = 'error'
+    runtime = data = result = None
     try:
         data = request.json
-        print(f"[DEBUG] Ricevuta richiesta con dati: {data}")
+        explain = _explain_requested()
+        timer.mark('parse')
         
         # Validazione input
         if not data:
+            outcome = 'invalid'
             return jsonify({'error': 'Nessun dato fornito'}), 400
+        timer.mark('validation')
         
-        # Crea un DataFrame con i dati dell'input
-        student_data = []
-        for col in FEATURE_COLUMNS:
-            if col not in data:
-                return jsonify({'error': f'Campo mancante: {col}'}), 400
-            student_data.append(data[col])
-        
-        # Crea DataFrame
-        student_df = pd.DataFrame([student_data], columns=FEATURE_COLUMNS)
-        
-        # Applica Label Encoding alle variabili categoriche
-        for col in label_encoders:
-            if col != "Performance" and col in student_df.columns:
-                le = label_encoders[col]
-                try:
-                    # Se la categoria non esiste, usa la prima classe disponibile
-                    student_df[col] = student_df[col].apply(
-                        lambda x: x if x in le.classes_ else le.classes_[0]
-                    )
-                    student_df[col] = le.transform(student_df[col])
-                except Exception as e:
-                    return jsonify({'error': f'Errore nell\'encoding di {col}: {str(e)}'}), 400
-        
-        # Standardizzazione
-        student_scaled = scaler.transform(student_df)
+        # Il runtime viene letto una volta: un cambio di modello non tocca questa richiesta
+        runtime = registry.active
+        if explain and runtime.explainer is None:
+            outcome = 'invalid'
+            return jsonify({'error': f"Spiegazioni non disponibili per il modello '{runtime.version}'"}), 400
         
-        # Predizione
-        prediction = rf_model.predict(student_scaled)
-        prediction_proba = rf_model.predict_proba(student_scaled)
+        # Encoding nel buffer riutilizzato (con la validazione dei singoli campi)
+        try:
+            student_row = runtime.preprocessor.encode_one(data)
+        except ValueError as e:
+            outcome = 'invalid'
+            return jsonify({'error': str(e)}), 400
+        timer.mark('encoding')
         
-        print(f"[DEBUG] Predizione raw: {prediction}")
-        print(f"[DEBUG] Probabilità: {prediction_proba}")
+        # Payload già visto (a meno dell'arrotondamento): niente inferenza.
+        # Le spiegazioni non sono in cache: servono le foglie della riga
+        cache_key = prediction_cache.make_key(student_row)
+        cached = None if explain else prediction_cache.get(cache_key, runtime.token)
+        timer.mark('cache')
+        if cached is not None:
+            result = cached
+            response = jsonify(cached)
+            timer.mark('serialization')
+            outcome = 'cache_hit'
+            return response
         
-        # Decodifica il risultato
-        performance_label = label_encoders["Performance"].inverse_transform(prediction)[0]
-        print(f"[DEBUG] Label decodificata: {performance_label}")
+        # Standardizzazione (se serve) e predizione: una sola visita della foresta,
+        # eventualmente insieme alle altre richieste concorrenti
+        student_scaled = runtime.preprocessor.scale_inplace(student_row)
+        timer.mark('scaling')
+        if micro_batcher is not None and not explain:
+            prediction_proba = micro_batcher.predict(student_scaled, runtime.predict_proba)
+        else:
+            prediction_proba = runtime.predict_proba(student_scaled)[0]
+        timer.mark('inference')
         
-        # Prepara le probabilità per ogni classe
-        classes = label_encoders["Performance"].classes_
-        probabilities = {}
-        for i, class_name in enumerate(classes):
-            probabilities[class_name] = float(prediction_proba[0][i])
+        result = _format_prediction(prediction_proba, runtime.target_classes)
+        prediction_cache.put(cache_key, result, runtime.token)
+        if explain:
+            result = {**result, 'explanation': _explanations(
+                runtime, student_scaled, prediction_proba[np.newaxis])[0]}
+            timer.mark('explanation')
+        response = jsonify(result)
+        timer.mark('serialization')
         
-        # Mappa il risultato in italiano
-        italian_mapping = {
-            'Low Performer': 'Prestazione Bassa',
-            'Average Performer': 'Prestazione Media', 
-            'High Performer': 'Prestazione Alta'
-        }
+        outcome = 'ok'
+        return response
         
+    except Exception as e:
+        return jsonify({'error': f'Errore nella predizione: {str(e)}'}), 500
+    finally:
+        elapsed = timer.elapsed()
+        REQUESTS_TOTAL.inc('predict', outcome)
+        REQUEST_SECONDS.observe(elapsed, 'predict')
+        _log_prediction(outcome, elapsed, runtime, data, result)
+        if shadow_scorer is not None and result is not None:
+            shadow_scorer.submit(data, result, runtime.version, elapsed * 1000)
+
+def _log_prediction(outcome, elapsed, runtime, data, result):
+    """Record compatto della predizione; payload e probabilità solo se campionato"""
+    if not request_log.enabled:
+        return
+    record = {
+        'event': 'predict',
+        'request_id': _request_id(),
+        'outcome': outcome,
+        'latency_ms': round(elapsed * 1000, 3),
+        'model_version': runtime.version if runtime else None,
+        'prediction': result['prediction'] if result else None,
+    }
+    if request_log.sampled():
+        record['confidence'] = result['confidence'] if result else None
+        record['probabilities'] = result['probabilities'] if result else None
+        record['payload'] = data
+    request_log.log(**record)
+
+def _explain_requested():
+    return request.args.get('explain', '').lower() in ('1', 'true', 'yes')
+
+def _explanations(runtime, X, proba):
+    """Contributi delle feature alla classe predetta, una spiegazione per riga"""
+    predicted = proba.argmax(axis=1)
+    base, contributions = runtime.explainer.explain(X, predicted)
+    return [
+        format_explanation(base[i], contributions[i], runtime.target_classes[c])
+        for i, c in enumerate(predicted)
+    ]
+
+def _format_prediction(proba_row, classes):
+    """Costruisce il dizionario di risposta a partire da una riga di probabilità"""
+    best = int(np.argmax(proba_row))
+    performance_label = classes[best]
+    return {
+        'prediction': performance_label,
+        'prediction_italian': ITALIAN_MAPPING.get(performance_label, performance_label),
+        'probabilities': {
+            class_name: float(proba_row[i]) for i, class_name in enumerate(classes)
+        },
+        'confidence': float(proba_row[best])
+    }
+
+@app.route('/api/predict/batch', methods=['POST'])
+def predict_performance_batch():
+    """Predizione vettorizzata per una lista di studenti.
+
+    Accetta una lista JSON di studenti (oppure {"students": [...]}).
+    Le righe valide vengono codificate, standardizzate e passate al modello
+    con un'unica chiamata a predict_proba; le righe non valide ricevono un
+    errore nella propria posizione senza far fallire l'intero batch.
+    """
+    timer = StageTimer(STAGE_SECONDS, 'batch')
+    outcome = 'error'
+    runtime = None
+    n_rows = n_errors = 0
+    try:
+        data = request.get_json(silent=True)
+        explain = _explain_requested()
+        timer.mark('parse')
+        if isinstance(data, dict):
+            data = data.get('students')
+        if not isinstance(data, list) or not data:
+            outcome = 'invalid'
+            return jsonify({'error': 'Fornire una lista non vuota di studenti'}), 400
+        if len(data) > MAX_BATCH_SIZE:
+            outcome = 'too_large'
+            return jsonify({'error': f'Troppi studenti: massimo {MAX_BATCH_SIZE} per richiesta'}), 413
+        timer.mark('validation')
+
+        # Codifica di tutte le righe valide in un'unica matrice
+        runtime = registry.active
+        if explain and runtime.explainer is None:
+            outcome = 'invalid'
+            return jsonify({'error': f"Spiegazioni non disponibili per il modello '{runtime.version}'"}), 400
+        batch_encoded, valid_index, errors = runtime.preprocessor.encode_many(data)
+        timer.mark('encoding')
+        batch_scaled = runtime.preprocessor.scale_inplace(batch_encoded)
+        timer.mark('scaling')
+
+        results = [None] * len(data)
+        for i, message in errors.items():
+            results[i] = {'index': i, 'error': message}
+
+        if valid_index:
+            # Una sola predizione per tutto il batch
+            batch_proba = runtime.predict_proba(batch_scaled)
+            timer.mark('inference')
+            for i, proba_row in zip(valid_index, batch_proba):
+                results[i] = {'index': i, **_format_prediction(proba_row, runtime.target_classes)}
+            if explain:
+                # Contributi di tutte le righe con una sola visita della foresta
+                for i, explanation in zip(valid_index, _explanations(runtime, batch_scaled, batch_proba)):
+                    results[i]['explanation'] = explanation
+                timer.mark('explanation')
+
+        response = jsonify({
+            'results': results,
+            'n_predictions': len(valid_index),
+            'n_errors': len(data) - len(valid_index)
+        })
+        timer.mark('serialization')
+        BATCH_ROWS_TOTAL.inc('ok', amount=len(valid_index))
+        BATCH_ROWS_TOTAL.inc('invalid', amount=len(errors))
+        n_rows, n_errors = len(data), len(errors)
+        outcome = 'ok'
+        return response
+
+    except Exception as e:
+        return jsonify({'error': f'Errore nella predizione batch: {str(e)}'}), 500
+    finally:
+        elapsed = timer.elapsed()
+        REQUESTS_TOTAL.inc('batch', outcome)
+        REQUEST_SECONDS.observe(elapsed, 'batch')
+        request_log.log(
+            event='predict_batch', request_id=_request_id(), outcome=outcome,
+            latency_ms=round(elapsed * 1000, 3),
+            model_version=runtime.version if runtime else None,
+            n_rows=n_rows, n_errors=n_errors
+        )
+
+@app.route('/api/similar', methods=['POST'])
+def find_similar_students():
+    """Studenti di riferimento più simili, con la loro Performance reale.
+
+    Accetta gli stessi input di /api/predict/batch; ?k=5 (default) indica
+    quanti vicini restituire per studente. La distanza è quella euclidea
+    nello spazio standardizzato del modello attivo, e tutto il batch è una
+    sola ricerca sull'indice spaziale. L'indice viene costruito in background
+    alla prima richiesta (e dopo un cambio di scaler): nel frattempo 503.
+    """
+    timer = StageTimer(STAGE_SECONDS, 'similar')
+    outcome = 'error'
+    runtime = None
+    n_rows = n_errors = 0
+    try:
+        data = request.get_json(silent=True)
+        timer.mark('parse')
+        if reference_set is None:
+            outcome = 'unavailable'
+            return jsonify({'error': 'Dataset di riferimento non configurato (SIMILAR_REFERENCE_CSV)'}), 503
+        try:
+            k = int(request.args.get('k', 5))
+        except ValueError:
+            k = 0
+        if not 1 <= k <= MAX_SIMILAR_K:
+            outcome = 'invalid'
+            return jsonify({'error': f'"k" deve essere un intero tra 1 e {MAX_SIMILAR_K}'}), 400
+        if isinstance(data, dict):
+            data = data.get('students')
+        if not isinstance(data, list) or not data:
+            outcome = 'invalid'
+            return jsonify({'error': 'Fornire una lista non vuota di studenti'}), 400
+        if len(data) > MAX_BATCH_SIZE:
+            outcome = 'too_large'
+            return jsonify({'error': f'Troppi studenti: massimo {MAX_BATCH_SIZE} per richiesta'}), 413
+        timer.mark('validation')
+
+        # L'indice viene costruito in background: finché non è pronto 503
+        runtime = registry.active
+        index = reference_set.index_nowait(runtime.params)
+        if index is None:
+            outcome = 'unavailable'
+            response = jsonify({'error': reference_set.error
+                                or 'Indice degli studenti simili in costruzione, riprovare'})
+            return response, 503, {'Retry-After': '1'}
+        batch_encoded, valid_index, errors = runtime.preprocessor.encode_many(data)
+        timer.mark('encoding')
+
+        results = [None] * len(data)
+        for i, message in errors.items():
+            results[i] = {'index': i, 'error': message}
+
+        if valid_index:
+            # Vicini dal riferimento (l'indice standardizza una copia), poi predizione
+            distances, indices = index.query(batch_encoded, k)
+            timer.mark('search')
+            batch_proba = runtime.predict_proba(runtime.preprocessor.scale_inplace(batch_encoded))
+            timer.mark('inference')
+            neighbors = index.neighbors(distances, indices)
+            for row, i in enumerate(valid_index):
+                for neighbor in neighbors[row]:
+                    neighbor['performance_italian'] = ITALIAN_MAPPING.get(
+                        neighbor['performance'], neighbor['performance'])
+                results[i] = {
+                    'index': i,
+                    **_format_prediction(batch_proba[row], runtime.target_classes),
+                    'neighbors': neighbors[row],
+                }
+
+        response = jsonify({
+            'results': results,
+            'k': k,
+            'reference_size': len(index),
+            'n_predictions': len(valid_index),
+            'n_errors': len(data) - len(valid_index),
+        })
+        timer.mark('serialization')
+        n_rows, n_errors = len(data), len(errors)
+        outcome = 'ok'
+        return response
+
+    except Exception as e:
+        return jsonify({'error': f'Errore nella ricerca degli studenti simili: {str(e)}'}), 500
+    finally:
+        elapsed = timer.elapsed()
+        REQUESTS_TOTAL.inc('similar', outcome)
+        REQUEST_SECONDS.observe(elapsed, 'similar')
+        request_log.log(
+            event='similar', request_id=_request_id(), outcome=outcome,
+            latency_ms=round(elapsed * 1000, 3),
+            model_version=runtime.version if runtime else None,
+            n_rows=n_rows, n_errors=n_errors
+        )
+
+# Quota minima di alberi d'accordo sotto la quale uno studente va rivisto a mano
+REVIEW_MIN_AGREEMENT = float(os.environ.get('REVIEW_MIN_AGREEMENT', 0.6))
+
+@app.route('/api/uncertainty', methods=['POST'])
+def predict_uncertainty():
+    """Predizione con il consenso tra gli alberi, per una lista di studenti.
+
+    Accetta gli stessi input di /api/predict/batch. Per ogni studente, oltre
+    alla predizione, restituisce i voti dei singoli alberi per classe,
+    l'entropia dei voti, la dispersione delle probabilità tra gli alberi e
+    needs_review se la classe più votata ha meno di REVIEW_MIN_AGREEMENT dei
+    voti. Tutto il batch è analizzato con una sola visita della foresta.
+    """
+    timer = StageTimer(STAGE_SECONDS, 'uncertainty')
+    outcome = 'error'
+    runtime = None
+    n_rows = n_errors = n_review = 0
+    try:
+        data = request.get_json(silent=True)
+        timer.mark('parse')
+        if isinstance(data, dict):
+            data = data.get('students')
+        if not isinstance(data, list) or not data:
+            outcome = 'invalid'
+            return jsonify({'error': 'Fornire una lista non vuota di studenti'}), 400
+        if len(data) > MAX_BATCH_SIZE:
+            outcome = 'too_large'
+            return jsonify({'error': f'Troppi studenti: massimo {MAX_BATCH_SIZE} per richiesta'}), 413
+        timer.mark('validation')
+
+        runtime = registry.active
+        if runtime.vote_analyzer is None:
+            outcome = 'invalid'
+            return jsonify({'error': f"Voti degli alberi non disponibili per il modello '{runtime.version}'"}), 400
+        batch_encoded, valid_index, errors = runtime.preprocessor.encode_many(data)
+        timer.mark('encoding')
+        batch_scaled = runtime.preprocessor.scale_inplace(batch_encoded)
+        timer.mark('scaling')
+
+        results = [None] * len(data)
+        for i, message in errors.items():
+            results[i] = {'index': i, 'error': message}
+
+        if valid_index:
+            classes = runtime.target_classes
+            batch_proba = runtime.predict_proba(batch_scaled)
+            timer.mark('inference')
+            stats = runtime.vote_analyzer.analyze(batch_scaled)
+            timer.mark('votes')
+            for row, i in enumerate(valid_index):
+                results[i] = {
+                    'index': i,
+                    **_format_prediction(batch_proba[row], classes),
+                    'uncertainty': format_uncertainty(stats, row, classes, REVIEW_MIN_AGREEMENT),
+                }
+            n_review = int((stats['agreement'] < REVIEW_MIN_AGREEMENT).sum())
+
+        response = jsonify({
+            'results': results,
+            'n_predictions': len(valid_index),
+            'n_errors': len(data) - len(valid_index),
+            'n_review': n_review,
+        })
+        timer.mark('serialization')
+        UNCERTAINTY_ROWS_TOTAL.inc('review', amount=n_review)
+        UNCERTAINTY_ROWS_TOTAL.inc('confident', amount=len(valid_index) - n_review)
+        UNCERTAINTY_ROWS_TOTAL.inc('invalid', amount=len(errors))
+        n_rows, n_errors = len(data), len(errors)
+        outcome = 'ok'
+        return response
+
+    except Exception as e:
+        return jsonify({'error': f'Errore nell\'analisi del consenso: {str(e)}'}), 500
+    finally:
+        elapsed = timer.elapsed()
+        REQUESTS_TOTAL.inc('uncertainty', outcome)
+        REQUEST_SECONDS.observe(elapsed, 'uncertainty')
+        request_log.log(
+            event='uncertainty', request_id=_request_id(), outcome=outcome,
+            latency_ms=round(elapsed * 1000, 3),
+            model_version=runtime.version if runtime else None,
+            n_rows=n_rows, n_errors=n_errors, n_review=n_review
+        )
+
+# Formati accettati da /api/predict/stream (parametro o Content-Type)
+STREAM_FORMATS = {
+    'csv': 'csv', 'text/csv': 'csv',
+    'ndjson': 'ndjson', 'application/x-ndjson': 'ndjson', 'application/jsonl': 'ndjson',
+}
+
+@app.route('/api/predict/stream', methods=['POST'])
+def predict_performance_stream():
+    """Scoring in streaming di un file CSV o NDJSON di qualsiasi dimensione.
+
+    Il corpo della richiesta viene letto riga per riga a blocchi di
+    STREAM_CHUNK_SIZE studenti; ogni blocco è predetto con un'unica chiamata
+    al modello e i risultati vengono inviati subito (risposta chunked), mentre
+    il resto del file è ancora in arrivo. La memoria usata non dipende dalla
+    dimensione del file.
+
+    Formato di ingresso: ?format=csv|ndjson oppure Content-Type text/csv o
+    application/x-ndjson. Formato di uscita: ?output=csv|ndjson (default:
+    uguale all'ingresso). Le righe non valide ricevono un errore nella
+    propria posizione.
+    """
+    input_format = STREAM_FORMATS.get(request.args.get('format') or request.mimetype)
+    if input_format is None:
+        return jsonify({'error': 'Formato non supportato: usare CSV (text/csv) o NDJSON (application/x-ndjson)'}), 415
+    output_format = STREAM_FORMATS.get(request.args.get('output') or input_format)
+    if output_format is None:
+        return jsonify({'error': 'Formato di uscita non supportato: usare csv o ndjson'}), 400
+
+    runtime = registry.active
+    if runtime is None:
+        # Prima di iniziare la risposta: dopo, lo stato HTTP è già 200
+        return jsonify({'error': 'Nessun modello caricato'}), 503
+    request_id = _request_id()
+    lines = iter_text_lines(request.stream)
+    records = iter_csv_records(lines) if input_format == 'csv' else iter_ndjson_records(lines)
+    if output_format == 'csv':
+        formatter = CsvFormatter(runtime.target_classes)
+    else:
+        formatter = NdjsonFormatter(runtime.target_classes, _format_prediction)
+
+    def generate():
+        started = time.perf_counter()
+        outcome = 'error'
+        n_rows = n_errors = 0
+        try:
+            for chunk in iter_chunks(records, STREAM_CHUNK_SIZE):
+                proba, valid_index, errors = score_chunk(runtime, chunk)
+                yield formatter.format_chunk(chunk, n_rows, proba, valid_index, errors)
+                n_rows += len(chunk)
+                n_errors += len(errors)
+            if not n_rows:
+                # Nessuna riga (es. CSV con la sola intestazione): l'uscita ha
+                # comunque la sua intestazione
+                columns = getattr(records, 'fieldnames', None) or []
+                yield formatter.format_header(formatter.id_column in columns)
+            outcome = 'ok'
+        except Exception as e:
+            # Lo stato HTTP è già stato inviato: l'errore chiude lo stream
+            yield formatter.format_error(f'Errore nello scoring: {str(e)}')
+        finally:
+            elapsed = time.perf_counter() - started
+            REQUESTS_TOTAL.inc('stream', outcome)
+            REQUEST_SECONDS.observe(elapsed, 'stream')
+            STREAM_ROWS_TOTAL.inc('ok', amount=n_rows - n_errors)
+            STREAM_ROWS_TOTAL.inc('invalid', amount=n_errors)
+            request_log.log(
+                event='predict_stream', request_id=request_id, outcome=outcome,
+                latency_ms=round(elapsed * 1000, 3), model_version=runtime.version,
+                n_rows=n_rows, n_errors=n_errors
+            )
+
+    return Response(stream_with_context(generate()), mimetype=formatter.content_type)
+
+# Numero massimo di punti della griglia di /api/whatif
+MAX_WHATIF_POINTS = int(os.environ.get('MAX_WHATIF_POINTS', 10000))
+
+@app.route('/api/whatif', methods=['POST'])
+def predict_whatif():
+    """Analisi what-if: probabilità di uno studente al variare di una o due feature.
+
+    Body: {"student": {...}, "sweep": [{"feature": "Attendance_Rate",
+    "start": 50, "stop": 100, "steps": 51}, ...], "target": "High Performer"}.
+    Tutti i punti della griglia sono predetti con un'unica chiamata al
+    modello. Con "target" (etichetta inglese o italiana) la risposta indica
+    anche il punto più vicino allo studente in cui la classe predetta è quella.
+    """
+    timer = StageTimer(STAGE_SECONDS, 'whatif')
+    outcome = 'error'
+    runtime = None
+    n_points = 0
+    try:
+        data = request.get_json(silent=True)
+        timer.mark('parse')
+        if not isinstance(data, dict) or not isinstance(data.get('student'), dict):
+            outcome = 'invalid'
+            return jsonify({'error': 'Fornire "student" (oggetto) e "sweep" (lista di feature)'}), 400
+
+        runtime = registry.active
+        classes = runtime.target_classes
+        target = data.get('target')
+        if target is not None:
+            target = ITALIAN_TO_ENGLISH.get(target, target)
+            if target not in classes:
+                outcome = 'invalid'
+                return jsonify({'error': f'Classe obiettivo sconosciuta: {data["target"]!r}'}), 400
+        timer.mark('validation')
+
+        try:
+            base_row, axes, shape, student_proba, grid_proba = sensitivity(
+                runtime, data['student'], data.get('sweep'), MAX_WHATIF_POINTS
+            )
+        except ValueError as e:
+            outcome = 'invalid'
+            return jsonify({'error': str(e)}), 400
+        n_points = len(grid_proba)
+        timer.mark('inference')
+
+        predicted = grid_proba.argmax(axis=1)
         result = {
-            'prediction': performance_label,
-            'prediction_italian': italian_mapping.get(performance_label, performance_label),
-            'probabilities': probabilities,
-            'confidence': float(max(prediction_proba[0]))
+            'student': _format_prediction(student_proba, classes),
+            'axes': [axis.describe() for axis in axes],
+            'n_points': n_points,
+            'probabilities': {
+                class_name: grid_proba[:, i].reshape(shape).tolist()
+                for i, class_name in enumerate(classes)
+            },
+            'prediction': np.asarray(classes)[predicted].reshape(shape).tolist(),
         }
-        
-        print(f"[DEBUG] Risultato finale inviato: {result}")
-        
-        return jsonify(result)
-        
+        if target is not None:
+            target_index = classes.index(target)
+            reached = predicted == target_index
+            closest = closest_point(axes, shape, reached, base_row)
+            result['target'] = {
+                'class': target,
+                'n_points': int(reached.sum()),
+                'closest': None if closest is None else {
+                    'values': {axis.feature: axis.values[i] for axis, i in zip(axes, closest)},
+                    'probability': float(grid_proba[np.ravel_multi_index(closest, shape), target_index]),
+                },
+            }
+        response = jsonify(result)
+        timer.mark('serialization')
+        outcome = 'ok'
+        return response
+
     except Exception as e:
-        return jsonify({'error': f'Errore nella predizione: {str(e)}'}), 500
+        return jsonify({'error': f'Errore nell\'analisi what-if: {str(e)}'}), 500
+    finally:
+        elapsed = timer.elapsed()
+        REQUESTS_TOTAL.inc('whatif', outcome)
+        REQUEST_SECONDS.observe(elapsed, 'whatif')
+        request_log.log(
+            event='whatif', request_id=_request_id(), outcome=outcome,
+            latency_ms=round(elapsed * 1000, 3),
+            model_version=runtime.version if runtime else None, n_points=n_points
+        )
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Metriche in formato testo Prometheus (latenze per fase, richieste per esito)"""
+    cache = prediction_cache.stats()
+    runtime = registry.active
+    extra = [
+        ('pe_prediction_cache_hits_total', 'counter', 'Hit della cache delle predizioni', cache['hits']),
+        ('pe_prediction_cache_misses_total', 'counter', 'Miss della cache delle predizioni', cache['misses']),
+        ('pe_prediction_cache_size', 'gauge', 'Voci nella cache delle predizioni', cache['size']),
+        ('pe_model_loaded_timestamp_seconds', 'gauge', 'Istante di caricamento del modello attivo',
+         runtime.loaded_at if runtime else 0),
+        ('pe_request_log_dropped_total', 'counter', 'Record del log delle richieste scartati (coda piena)',
+         request_log.dropped),
+    ]
+    memory = process_memory()
+    if 'rss_mb' in memory:
+        extra.append(('process_resident_memory_bytes', 'gauge', 'Memoria residente del worker',
+                      int(memory['rss_mb'] * 1024 * 1024)))
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache', methods=['GET'])
+def get_cache_stats():
+    """Statistiche della cache delle predizioni (hit, miss, eviction)"""
+    return jsonify(prediction_cache.stats())
+
+@app.route('/api/microbatch', methods=['GET'])
+def get_microbatch_stats():
+    """Distribuzione delle dimensioni dei batch e dei tempi di attesa in coda"""
+    if micro_batcher is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **micro_batcher.stats()})
+
+@app.route('/api/shadow', methods=['GET'])
+def get_shadow_report():
+    """Confronto dei modelli ombra con il modello attivo sul traffico campionato"""
+    if shadow_scorer is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **shadow_scorer.stats()})
+
+@app.route('/api/memory', methods=['GET'])
+def get_memory_usage():
+    """Uso di memoria del worker che serve la richiesta"""
+    runtime = registry.active
+    return jsonify({
+        **process_memory(),
+        'inference_engine': INFERENCE_ENGINE,
+        'model_mmapped': runtime.mmapped,
+        'model_nbytes': runtime.nbytes
+    })
 
 @app.route('/api/info', methods=['GET'])
 def get_model_info():
     """Endpoint per ottenere informazioni sul modello"""
     try:
+        runtime = registry.active
         info = {
             'model_type': 'Random Forest Classifier',
             'features': FEATURE_COLUMNS,
-            'classes': list(label_encoders["Performance"].classes_),
-            'n_features': len(FEATURE_COLUMNS)
+            'classes': runtime.target_labels,
+            'n_features': len(FEATURE_COLUMNS),
+            'inference_engine': INFERENCE_ENGINE,
+            'model_version': runtime.version,
+            'model_loaded_at': runtime.loaded_at,
+            'available_versions': registry.versions()
         }
         return jsonify(info)
     except Exception as e:
         return jsonify({'error': f'Errore nel recupero info: {str(e)}'}), 500
 
+def _check_admin_token():
+    """None se la richiesta è autorizzata, altrimenti la risposta di errore"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Endpoint di amministrazione disattivato (ADMIN_TOKEN non impostato)'}), 403
+    # Confronto a tempo costante: il tempo di risposta non rivela il prefisso giusto
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(),
+                               ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Token di amministrazione non valido'}), 403
+    return None
+
+@app.route('/api/admin/models', methods=['GET'])
+def list_model_versions():
+    """Versioni disponibili nel registro e versione attiva"""
+    denied = _check_admin_token()
+    if denied:
+        return denied
+    return jsonify({
+        'active': registry.active.describe() if registry.active else None,
+        'available_versions': registry.versions(),
+        'active_file': registry.read_active_file()
+    })
+
+@app.route('/api/admin/reload', methods=['POST'])
+def reload_model():
+    """Carica una versione, la riscalda e la rende attiva senza riavviare.
+
+    Body JSON opzionale: {"version": "..."} (default: contenuto di models/ACTIVE
+    o versione attuale). La versione scelta viene scritta in models/ACTIVE,
+    così gli altri worker con MODEL_WATCH_INTERVAL > 0 la seguono.
+    """
+    denied = _check_admin_token()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or {}
+    version = (data.get('version') or registry.read_active_file()
+               or (registry.active.version if registry.active else None))
+    # Solo nomi di versione del registro: niente percorsi (../) né pickle arbitrari
+    if not isinstance(version, str) or version not in registry.versions():
+        return jsonify({'error': f'Versione del modello sconosciuta: {version!r}'}), 400
+    try:
+        runtime, previous = registry.activate(version, persist=True)
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': f'Errore nel caricamento del modello: {str(e)}'}), 500
+    if reference_set is not None:
+        # Indice degli studenti simili per il nuovo scaler, in background
+        reference_set.index_nowait(runtime.params)
+    return jsonify({
+        'active': runtime.describe(),
+        'previous_version': previous.version if previous else None
+    })
+
 if __name__ == '__main__':
     import os
     port = int(os.environ.get('PORT', 5001))
@@ -139,4 +878,7 @@ if __name__ != '__main__':
     import logging
     gunicorn_logger = logging.getLogger('gunicorn.error')
     app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
\ No newline at end of file
+    app.logger.setLevel(gunicorn_logger.level)
+    # I record delle richieste finiscono negli stessi handler (scritti in background)
+    if gunicorn_logger.handlers:
+        request_log.configure(gunicorn_logger.handlers, gunicorn_logger.level or logging.INFO)
\ No newline at end of file
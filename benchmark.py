@@ -0,0 +1,296 @@
+# BENCHMARK DELLA PIPELINE DI INFERENZA E DEI MODELLI SALVATI
+#
+# Misura il costo di ogni fase della pipeline del server (encoding,
+# standardizzazione, predict_proba) per la predizione singola e per batch
+# di 1, 16, 256 e 4096 righe, su tutti i modelli salvati (originale da 300
+# alberi, migliorato da 50, calibrato) e per tutti i motori di inferenza.
+# Riporta anche tempi di caricamento e memoria occupata da ogni modello.
+#
+# I motori compilato e a bin sono misurati da soli, senza passare i batch
+# grandi a scikit-learn come fa il server: alla fine vengono segnalati i
+# batch in cui sono più lenti di scikit-learn sullo stesso modello.
+#
+# I risultati sono scritti in JSON, così si possono confrontare tra commit:
+#   python benchmark.py --output bench_prima.json
+#   python benchmark.py --output bench_dopo.json --compare bench_prima.json
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from memory_stats import process_memory
+from model_registry import LEGACY_VERSIONS, SKLEARN_MIN_BATCH, ModelRuntime
+from preprocessing import FEATURE_COLUMNS
+
+BATCH_SIZES = (1, 16, 256, 4096)
+
+
+def _stats(samples_s):
+    """Statistiche di una serie di tempi (in microsecondi)"""
+    us = np.asarray(samples_s) * 1e6
+    return {
+        'median_us': float(np.median(us)),
+        'p95_us': float(np.percentile(us, 95)),
+        'mean_us': float(us.mean()),
+        'min_us': float(us.min()),
+        'repeats': int(len(us)),
+    }
+
+
+def _repeats(first_s, budget_s, min_repeats=5, max_repeats=200):
+    """Ripetizioni che stanno nel budget, stimate dalla prima misura"""
+    return int(min(max_repeats, max(min_repeats, budget_s / max(first_s, 1e-7))))
+
+
+def _n_trees(runtime):
+    model = runtime.inference_model
+    if hasattr(model, 'n_trees'):
+        return int(model.n_trees)
+    if hasattr(model, 'forest'):
+        return int(model.forest.n_trees)
+    calibrated = getattr(model, 'calibrated_classifiers_', None)
+    if calibrated is not None:
+        return sum(len(c.estimator.estimators_) for c in calibrated)
+    return len(model.estimators_)
+
+
+def _sklearn_node_bytes(model):
+    """Byte dei nodi (struttura + valori) di tutti gli alberi scikit-learn del modello"""
+    calibrated = getattr(model, 'calibrated_classifiers_', None)
+    forests = [c.estimator for c in calibrated] if calibrated is not None else [model]
+    total = 0
+    for forest in forests:
+        for tree in forest.estimators_:
+            state = tree.tree_.__getstate__()
+            total += state['nodes'].nbytes + state['values'].nbytes
+    return total
+
+
+def load_runtime(version, engine):
+    """Carica un modello misurando tempo di caricamento e memoria occupata"""
+    files = LEGACY_VERSIONS[version]
+    rss_before = process_memory().get('rss_mb')
+    start = time.perf_counter()
+    runtime = ModelRuntime.from_files(version, *files, engine=engine)
+    load_ms = (time.perf_counter() - start) * 1000
+    rss_after = process_memory().get('rss_mb')
+
+    if runtime.nbytes is not None:
+        node_bytes = runtime.nbytes
+    else:
+        node_bytes = _sklearn_node_bytes(runtime.inference_model)
+    return runtime, {
+        'load_ms': load_ms,
+        'pkl_mb': os.path.getsize(files[0]) / 1024 / 1024,
+        'node_arrays_mb': node_bytes / 1024 / 1024,
+        # Indicativo: dipende da cosa era già in memoria (import, modelli precedenti)
+        'rss_delta_mb': rss_after - rss_before if rss_before is not None else None,
+    }
+
+
+def bench_single(runtime, students, budget_s):
+    """Percorso di /api/predict: encode_one + scale_inplace + predict_proba su una riga"""
+    preprocessor = runtime.preprocessor
+    timings = {'encode': [], 'scale': [], 'predict_proba': [], 'total': []}
+
+    def run(student):
+        t0 = time.perf_counter()
+        row = preprocessor.encode_one(student)
+        t1 = time.perf_counter()
+        preprocessor.scale_inplace(row)
+        t2 = time.perf_counter()
+        runtime.predict_proba(row)
+        t3 = time.perf_counter()
+        return t1 - t0, t2 - t1, t3 - t2, t3 - t0
+
+    first = run(students[0])[3]
+    for i in range(_repeats(first, budget_s)):
+        for name, value in zip(timings, run(students[i % len(students)])):
+            timings[name].append(value)
+    return {name: _stats(values) for name, values in timings.items()}
+
+
+def bench_batch(runtime, students, batch_size, budget_s):
+    """Percorso di /api/predict/batch: encode_many + scale_inplace + predict_proba"""
+    preprocessor = runtime.preprocessor
+    timings = {'encode': [], 'scale': [], 'predict_proba': [], 'total': []}
+
+    def run(batch):
+        t0 = time.perf_counter()
+        X, _, _ = preprocessor.encode_many(batch)
+        t1 = time.perf_counter()
+        preprocessor.scale_inplace(X)
+        t2 = time.perf_counter()
+        runtime.predict_proba(X)
+        t3 = time.perf_counter()
+        return t1 - t0, t2 - t1, t3 - t2, t3 - t0
+
+    batches = [students[i:i + batch_size] for i in range(0, len(students) - batch_size + 1, batch_size)]
+    first = run(batches[0])[3]
+    for i in range(_repeats(first, budget_s)):
+        for name, value in zip(timings, run(batches[i % len(batches)])):
+            timings[name].append(value)
+    result = {name: _stats(values) for name, values in timings.items()}
+    result['rows_per_s'] = batch_size / (result['total']['median_us'] / 1e6)
+    return result
+
+
+def sample_students(csv_path, n, seed):
+    """Studenti estratti (con ripetizione, seme fisso) dal dataset"""
+    import pandas as pd
+    rows = pd.read_csv(csv_path)[FEATURE_COLUMNS].to_dict('records')
+    rng = np.random.default_rng(seed)
+    return [rows[i] for i in rng.integers(0, len(rows), size=n)]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metadata(args):
+    versions = {'python': platform.python_version(), 'numpy': np.__version__}
+    try:
+        import sklearn
+        versions['scikit-learn'] = sklearn.__version__
+    except ImportError:
+        pass
+    return {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'versions': versions,
+        'seed': args.seed,
+        'budget_s': args.budget,
+        'batch_sizes': list(args.batch_sizes),
+    }
+
+
+def run_benchmark(args):
+    # scikit-learn importato prima delle misure: il tempo di import non deve
+    # finire nel caricamento del primo modello
+    start = time.perf_counter()
+    import joblib  # noqa: F401
+    import sklearn.calibration  # noqa: F401
+    import sklearn.ensemble  # noqa: F401
+    import_ms = (time.perf_counter() - start) * 1000
+
+    students = sample_students(args.csv, max(args.batch_sizes) * 4, args.seed)
+    results = []
+    for version in args.models:
+        for engine in args.engines:
+            runtime, memory = load_runtime(version, engine)
+            # Si misura il motore, non l'estimatore scikit-learn dei batch grandi
+            sklearn_min_batch, runtime.sklearn_min_batch = runtime.sklearn_min_batch, None
+            runtime.warmup()
+            print(f"📊 {version} ({engine}, {_n_trees(runtime)} alberi)", file=sys.stderr)
+            entry = {
+                'model': version,
+                'engine': engine,
+                'n_trees': _n_trees(runtime),
+                'sklearn_min_batch': sklearn_min_batch,
+                'memory': memory,
+                'single': bench_single(runtime, students, args.budget),
+                'batch': {
+                    str(size): bench_batch(runtime, students, size, args.budget)
+                    for size in args.batch_sizes
+                },
+            }
+            print(f"   singola: {entry['single']['total']['median_us']:.0f} µs, "
+                  + ', '.join(f"batch {size}: {entry['batch'][str(size)]['rows_per_s']:,.0f} righe/s"
+                              for size in args.batch_sizes), file=sys.stderr)
+            results.append(entry)
+    return {'meta': {**_metadata(args), 'sklearn_import_ms': import_ms}, 'results': results}
+
+
+def slower_than_sklearn(report):
+    """Batch in cui un motore compilato o a bin è più lento di scikit-learn
+    sullo stesso modello: (modello, motore, batch, rapporto delle righe/s)"""
+    sklearn = {entry['model']: entry['batch'] for entry in report['results']
+               if entry['engine'] == 'sklearn'}
+    slower = []
+    for entry in report['results']:
+        baseline = sklearn.get(entry['model'])
+        if entry['engine'] == 'sklearn' or baseline is None:
+            continue
+        for size, result in entry['batch'].items():
+            if size in baseline and result['rows_per_s'] < baseline[size]['rows_per_s']:
+                slower.append((entry['model'], entry['engine'], int(size),
+                               result['rows_per_s'] / baseline[size]['rows_per_s']))
+    return slower
+
+
+def compare(current, baseline, threshold=0.10):
+    """Confronta le mediane con un risultato precedente; restituisce le regressioni"""
+    def key(entry):
+        return entry['model'], entry['engine']
+
+    previous = {key(entry): entry for entry in baseline['results']}
+    regressions = []
+    for entry in current['results']:
+        old = previous.get(key(entry))
+        if old is None:
+            continue
+        pairs = [('single', entry['single'], old['single'])]
+        pairs += [(f'batch {size}', entry['batch'][size], old['batch'][size])
+                  for size in entry['batch'] if size in old['batch']]
+        for name, new_stages, old_stages in pairs:
+            for stage in ('encode', 'scale', 'predict_proba', 'total'):
+                new_us = new_stages[stage]['median_us']
+                old_us = old_stages[stage]['median_us']
+                ratio = new_us / old_us if old_us else float('inf')
+                marker = '⚠️ ' if ratio > 1 + threshold else '   '
+                print(f"{marker}{entry['model']:<11}{entry['engine']:<9}{name:<11}{stage:<14}"
+                      f"{old_us:>10.1f} -> {new_us:>10.1f} µs  ({ratio:.2f}x)")
+                if ratio > 1 + threshold:
+                    regressions.append((key(entry), name, stage, ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark della pipeline di inferenza sui modelli salvati'
+    )
+    parser.add_argument('--models', nargs='+', default=list(LEGACY_VERSIONS),
+                        choices=list(LEGACY_VERSIONS))
+    parser.add_argument('--engines', nargs='+', default=['sklearn', 'compiled', 'binned'],
+                        choices=['sklearn', 'compiled', 'binned'])
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=list(BATCH_SIZES))
+    parser.add_argument('--budget', type=float, default=0.5,
+                        help='secondi di misura per ogni configurazione')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--csv', default='student_pe_performance.csv')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='JSON di un benchmark precedente da confrontare')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='rallentamento oltre il quale segnalare una regressione')
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Risultati salvati in '{args.output}'", file=sys.stderr)
+
+    for model, engine, size, ratio in slower_than_sklearn(report):
+        print(f"⚠️  {model} ({engine}), batch {size}: {ratio:.2f}x le righe/s di scikit-learn "
+              f"(il server usa scikit-learn da {SKLEARN_MIN_BATCH} righe, se il .pkl è caricato)",
+              file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"⚠️  {len(regressions)} regressioni oltre il {args.threshold:.0%}")
+            sys.exit(1)
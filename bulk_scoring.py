@@ -0,0 +1,181 @@
+import codecs
+import csv
+import io
+import json
+
+import numpy as np
+
+# Righe per blocco: ogni blocco è codificato e predetto con una sola chiamata
+DEFAULT_CHUNK_SIZE = 1024
+
+
+def iter_text_lines(stream, encoding='utf-8-sig', block_size=65536):
+    """Righe di testo (con il '\\n' finale) lette a blocchi da uno stream binario.
+
+    Funziona con qualsiasi oggetto con read(n), compreso l'input WSGI di una
+    richiesta chunked: in memoria resta solo un blocco alla volta.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    pending = ''
+    while True:
+        data = stream.read(block_size)
+        if not data:
+            break
+        text = pending + decoder.decode(data)
+        cut = text.rfind('\n') + 1
+        pending = text[cut:]
+        if cut:
+            for line in text[:cut - 1].split('\n'):
+                yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def iter_csv_records(lines):
+    """Righe di un CSV con intestazione (come student_pe_performance.csv) come dizionari"""
+    return csv.DictReader(lines)
+
+
+def iter_ndjson_records(lines):
+    """Un oggetto JSON per riga; le righe non valide diventano None (errore di riga)"""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def iter_chunks(records, size=DEFAULT_CHUNK_SIZE):
+    """Raggruppa un iterabile in liste di al massimo `size` elementi"""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def score_chunk(runtime, records):
+    """Codifica e predice un blocco di studenti con un'unica chiamata al modello.
+
+    Restituisce (proba, valid_index, errors) come transform_many: le righe
+    di `proba` corrispondono alle posizioni in `valid_index`.
+    """
+    X, valid_index, errors = runtime.preprocessor.transform_many(records)
+    if valid_index:
+        proba = runtime.predict_proba(X)
+    else:
+        proba = np.empty((0, len(runtime.target_classes)))
+    return proba, valid_index, errors
+
+
+def _record_id(record, id_column):
+    return record.get(id_column) if isinstance(record, dict) else None
+
+
+class NdjsonFormatter:
+    """Un oggetto JSON per riga, con lo stesso formato dei risultati batch"""
+
+    content_type = 'application/x-ndjson'
+
+    def __init__(self, classes, format_prediction, id_column='ID'):
+        self.classes = classes
+        self.format_prediction = format_prediction
+        self.id_column = id_column
+
+    def format_chunk(self, records, offset, proba, valid_index, errors):
+        lines = []
+        proba_by_index = dict(zip(valid_index, proba))
+        for i, record in enumerate(records):
+            result = {'index': offset + i}
+            record_id = _record_id(record, self.id_column)
+            if record_id is not None:
+                result[self.id_column] = record_id
+            if i in errors:
+                result['error'] = errors[i]
+            else:
+                result.update(self.format_prediction(proba_by_index[i], self.classes))
+            lines.append(json.dumps(result, separators=(',', ':'), ensure_ascii=False))
+        return '\n'.join(lines) + '\n'
+
+    def format_header(self, with_id=False):
+        """NDJSON non ha intestazione"""
+        return ''
+
+    def format_error(self, message):
+        return json.dumps({'error': message}, ensure_ascii=False) + '\n'
+
+
+class CsvFormatter:
+    """CSV con classe predetta, confidenza e una colonna di probabilità per classe.
+
+    L'intestazione viene scritta con il primo blocco (se write_header): la
+    colonna dell'ID compare se with_id è vero o, se non indicato, se è
+    presente nella prima riga in ingresso.
+    """
+
+    content_type = 'text/csv'
+
+    def __init__(self, classes, id_column='ID', with_id=None, write_header=True):
+        self.classes = classes
+        self.id_column = id_column
+        self._with_id = with_id
+        self.write_header = write_header
+
+    def header(self):
+        columns = ['index'] + ([self.id_column] if self._with_id else [])
+        columns += ['prediction', 'confidence']
+        columns += [f'prob_{name}' for name in self.classes]
+        return columns + ['error']
+
+    def format_header(self, with_id=False):
+        """Solo l'intestazione, se non è ancora stata scritta: per un ingresso
+        senza righe (es. un CSV con la sola intestazione)"""
+        if not self.write_header:
+            return ''
+        if self._with_id is None:
+            self._with_id = with_id
+        self.write_header = False
+        out = io.StringIO()
+        csv.writer(out, lineterminator='\n').writerow(self.header())
+        return out.getvalue()
+
+    def format_chunk(self, records, offset, proba, valid_index, errors):
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\n')
+        if self._with_id is None:
+            self._with_id = _record_id(records[0], self.id_column) is not None
+        if self.write_header:
+            writer.writerow(self.header())
+            self.write_header = False
+
+        # Classe e confidenza calcolate per tutto il blocco in una volta
+        best = proba.argmax(axis=1) if len(proba) else []
+        predicted = {
+            i: (self.classes[b], proba[k, b], proba[k])
+            for k, (i, b) in enumerate(zip(valid_index, best))
+        }
+        empty = [''] * (2 + len(self.classes))
+        for i, record in enumerate(records):
+            row = [offset + i]
+            if self._with_id:
+                row.append(_record_id(record, self.id_column))
+            if i in errors:
+                row += empty + [errors[i]]
+            else:
+                label, confidence, proba_row = predicted[i]
+                row += [label, repr(float(confidence))]
+                row += [repr(float(p)) for p in proba_row] + ['']
+            writer.writerow(row)
+        return out.getvalue()
+
+    def format_error(self, message):
+        out = io.StringIO()
+        csv.writer(out, lineterminator='\n').writerow(['error', message])
+        return out.getvalue()
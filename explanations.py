@@ -0,0 +1,100 @@
+import numpy as np
+
+from preprocessing import FEATURE_COLUMNS
+from tree_engine import forest_weights
+
+
+class TreeExplainer:
+    """Contributi delle feature alla singola predizione (metodo di Saabas).
+
+    Lungo il percorso di un albero ogni split sposta la probabilità dal
+    valore del nodo padre a quello del figlio scelto: la differenza viene
+    attribuita alla feature dello split. La probabilità della foglia è quindi
+    il valore della radice (base) più la somma dei contributi delle feature,
+    e mediando sugli alberi lo stesso vale per la probabilità della foresta.
+
+    I contributi cumulati di ogni foglia (n_foglie, n_feature, n_classi) sono
+    calcolati una volta al caricamento: spiegare una riga costa una visita
+    della foresta (apply) più una lettura per albero.
+    """
+
+    # Elementi (righe x alberi x feature) letti per blocco in contributions()
+    BLOCK_ELEMENTS = 1 << 20
+
+    def __init__(self, forest, tree_weights, n_features=len(FEATURE_COLUMNS)):
+        self.forest = forest
+        self.tree_weights = np.asarray(tree_weights, dtype=np.float64)
+        self.n_features = n_features
+
+        n_nodes = len(forest.feature)
+        node_contrib = np.zeros((n_nodes, n_features, forest.n_classes))
+        frontier = forest.roots
+        for _ in range(forest.max_depth):
+            internal = frontier[forest.left[frontier] != frontier]
+            if not len(internal):
+                break
+            split_feature = forest.feature[internal]
+            for children in (forest.left[internal], forest.right[internal]):
+                node_contrib[children] = node_contrib[internal]
+                node_contrib[children, split_feature] += (
+                    forest.proba[children] - forest.proba[internal]
+                )
+            frontier = np.concatenate((forest.left[internal], forest.right[internal]))
+
+        # Solo le foglie, con le classi come primo asse: per una classe data
+        # i contributi di una foglia sono contigui
+        leaves = np.flatnonzero(forest.left == np.arange(n_nodes))
+        self.leaf_row = np.full(n_nodes, -1, dtype=np.int64)
+        self.leaf_row[leaves] = np.arange(len(leaves))
+        self.leaf_contrib = np.ascontiguousarray(node_contrib[leaves].transpose(2, 0, 1))
+        self.base = self.tree_weights @ forest.proba[forest.roots]
+
+    @classmethod
+    def from_model(cls, model, n_features=len(FEATURE_COLUMNS)):
+        """Explainer di un modello compilato (foresta, a bin o calibrato) o scikit-learn.
+
+        Per un modello calibrato vengono spiegate le probabilità non
+        calibrate (media delle foreste interne): i calibratori isotonici non
+        sono additivi, ma in genere conservano l'ordine delle classi.
+        """
+        forest, weights = forest_weights(model)
+        return cls(forest, weights, n_features)
+
+    @property
+    def nbytes(self):
+        return self.leaf_contrib.nbytes + self.leaf_row.nbytes
+
+    def contributions(self, X, class_index):
+        """Contributi (n_samples, n_features) alla probabilità della classe
+        class_index (un indice per riga, o uno solo per tutte)"""
+        leaves = self.leaf_row[self.forest.apply(X)]
+        n_samples, n_trees = leaves.shape
+        class_index = np.broadcast_to(np.asarray(class_index, dtype=np.int64), (n_samples,))
+        result = np.empty((n_samples, self.n_features))
+        block = max(1, self.BLOCK_ELEMENTS // (n_trees * self.n_features))
+        for start in range(0, n_samples, block):
+            stop = start + block
+            gathered = self.leaf_contrib[class_index[start:stop, np.newaxis], leaves[start:stop]]
+            result[start:stop] = np.einsum('rtf,t->rf', gathered, self.tree_weights)
+        return result
+
+    def explain(self, X, class_index):
+        """(base, contributi) per riga: base[i] + contributi[i].sum() è la
+        probabilità della classe secondo la foresta"""
+        contrib = self.contributions(X, class_index)
+        base = np.broadcast_to(self.base[np.asarray(class_index)], (contrib.shape[0],))
+        return base, contrib
+
+
+def format_explanation(base, contributions, class_name, feature_names=FEATURE_COLUMNS):
+    """Spiegazione di una riga per la risposta JSON, feature in ordine di impatto"""
+    order = np.argsort(-np.abs(contributions), kind='stable')
+    return {
+        'class': class_name,
+        'base_value': float(base),
+        'explained_probability': float(base + contributions.sum()),
+        'contributions': [
+            {'feature': feature_names[j], 'value': float(contributions[j])} for j in order
+        ],
+    }
+
@@ -0,0 +1,60 @@
+# ESPORTAZIONE DEL MODELLO COMPILATO CON LO SCALER INCORPORATO NELLE SOGLIE
+#
+# Gli split di un albero non cambiano sotto trasformazioni monotone per
+# feature: invece di standardizzare ogni input, le soglie vengono riportate
+# in unità originali usando mean_/scale_ dello scaler salvato. Il modello
+# esportato accetta direttamente i valori grezzi (categorie codificate come
+# interi), quindi il server può saltare la standardizzazione.
+
+import argparse
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from model_registry import export_runtime, source_fingerprint
+from preprocessing import FEATURE_COLUMNS, FastPreprocessor, preprocessing_params
+from tree_engine import compile_model, fold_scaler, load_compiled
+
+
+def export_model(model_path, scaler_path, encoders_path, output_dir):
+    """Compila il modello, incorpora lo scaler e salva gli array in output_dir.
+
+    Accanto agli array viene salvato preprocessing.json: il server può così
+    caricare il modello esportato senza deserializzare (e importare)
+    scikit-learn.
+    """
+    model = joblib.load(model_path)
+    scaler = joblib.load(scaler_path)
+    label_encoders = joblib.load(encoders_path)
+
+    folded = fold_scaler(compile_model(model), scaler)
+    export_runtime(folded, preprocessing_params(label_encoders, scaler), output_dir,
+                   source=source_fingerprint(model_path, scaler_path, encoders_path))
+    print(f"✅ Modello esportato in '{output_dir}' ({folded.nbytes / 1024:.0f} KB di nodi)")
+
+    # Verifica sul dataset: input grezzo nel modello esportato vs pipeline originale
+    students = pd.read_csv('student_pe_performance.csv')[FEATURE_COLUMNS].to_dict('records')
+    X_raw, _, _ = FastPreprocessor(label_encoders, None).encode_many(students)
+    X_scaled, _, _ = FastPreprocessor(label_encoders, scaler).transform_many(students)
+
+    exported = load_compiled(output_dir)
+    expected = model.predict_proba(X_scaled)
+    got = exported.predict_proba(X_raw)
+    agreement = np.mean(np.argmax(expected, axis=1) == np.argmax(got, axis=1))
+    print(f"   Predizioni identiche: {agreement:.2%}")
+    print(f"   Differenza massima nelle probabilità: {np.max(np.abs(expected - got)):.2e}")
+    return folded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Esporta la foresta compilata con lo scaler incorporato nelle soglie'
+    )
+    parser.add_argument('--model', default='random_forest_model_improved.pkl')
+    parser.add_argument('--scaler', default='scaler_improved.pkl')
+    parser.add_argument('--encoders', default='label_encoders_improved.pkl')
+    parser.add_argument('--output', default='compiled_model/improved')
+    args = parser.parse_args()
+
+    export_model(args.model, args.scaler, args.encoders, args.output)
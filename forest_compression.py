@@ -0,0 +1,380 @@
+# COMPRESSIONE DELLA FORESTA: MENO ALBERI, MENO PROFONDITÀ, MENO FOGLIE
+#
+# Il modello originale ha 300 alberi profondi (547 KB) e quello calibrato
+# tre foreste da 300 (2,1 MB): il costo di ogni predizione cresce con
+# alberi x profondità. Questo script prende una versione del modello e ne
+# costruisce una più piccola con tre tecniche:
+#   - profondità massima: i nodi oltre --max-depth diventano foglie
+#   - fusione delle foglie: uno split le cui due foglie danno (quasi) le
+#     stesse probabilità viene sostituito dal nodo padre
+#   - selezione degli alberi: ricerca in avanti (greedy) dei --trees alberi
+#     la cui media è più vicina, su un set di validazione, alle probabilità
+#     del modello originale (--objective fidelity) o alle etichette (brier)
+# e riporta lo scostamento di accuratezza e probabilità rispetto all'originale
+# insieme a latenza e dimensione risparmiate.
+#
+# Il risultato è ancora un modello scikit-learn (alberi ricostruiti), quindi
+# si salva come versione del registro e funziona con entrambi i motori.
+#
+# Selezione e verifica usano righe mai viste dalla versione base: l'holdout
+# dello split 80/20 di addestramento se la versione è stata addestrata su
+# quello split ('improved' e le versioni di training_pipeline.py sullo stesso
+# CSV), altrimenti un CSV etichettato da indicare con --eval-data. Il
+# modello 'original' (notebook) e 'calibrated' hanno visto tutte le righe
+# del dataset: senza --eval-data vengono rifiutati.
+#
+# Esempio:
+#   python forest_compression.py --base-version original --eval-data nuovi_studenti.csv \
+#       --trees 30 --max-depth 8 --version original-compressed
+
+import argparse
+import copy
+import json
+import os
+import pickle
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.model_selection import train_test_split
+
+from model_registry import VERSION_FILES, ModelRegistry
+from retrain_incremental import encode_labeled
+from training_pipeline import dataset_key, probability_metrics, save_version
+from tree_engine import compile_model
+
+OBJECTIVES = ('fidelity', 'brier')
+
+# Versioni storiche addestrate sullo split 80/20 di fix_confidence_problem.py
+HOLDOUT_VERSIONS = ('improved',)
+
+
+def forests_of(model):
+    """Foreste di alberi del modello: una, o una per membro se calibrato"""
+    calibrated = getattr(model, 'calibrated_classifiers_', None)
+    return [c.estimator for c in calibrated] if calibrated is not None else [model]
+
+
+def prune_tree(estimator, max_depth=None, merge_tolerance=None):
+    """Copia di un DecisionTreeClassifier con profondità limitata e foglie fuse.
+
+    Il valore di un nodo interno è già la distribuzione delle classi di tutto
+    il suo sottoalbero, quindi trasformarlo in foglia equivale a mediare le
+    foglie tagliate con i loro pesi. Due foglie sorelle le cui probabilità
+    differiscono al più di merge_tolerance vengono fuse nel padre, risalendo
+    finché è possibile: con tolleranza 0 si fondono solo foglie identiche e le
+    predizioni non cambiano.
+    """
+    cls, args, state = estimator.tree_.__reduce__()
+    nodes, values = state['nodes'], state['values']
+    left, right = nodes['left_child'], nodes['right_child']
+    n_nodes = len(nodes)
+
+    # I nodi sono in preordine: il padre precede sempre i figli
+    is_leaf = left == -1
+    depth = np.zeros(n_nodes, dtype=np.int64)
+    for node in np.flatnonzero(~is_leaf):
+        depth[left[node]] = depth[right[node]] = depth[node] + 1
+    if max_depth is not None:
+        is_leaf = is_leaf | (depth >= max_depth)
+
+    if merge_tolerance is not None:
+        proba = values[:, 0, :].astype(np.float64)
+        normalizer = proba.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        proba /= normalizer
+        for node in range(n_nodes - 1, -1, -1):
+            if is_leaf[node] or not (is_leaf[left[node]] and is_leaf[right[node]]):
+                continue
+            if np.max(np.abs(proba[left[node]] - proba[right[node]])) <= merge_tolerance:
+                is_leaf[node] = True
+
+    # Rinumerazione in preordine dei soli nodi raggiungibili
+    kept, stack = [], [0]
+    while stack:
+        node = stack.pop()
+        kept.append(node)
+        if not is_leaf[node]:
+            stack.extend((right[node], left[node]))
+    kept = np.asarray(kept, dtype=np.int64)
+    new_index = np.full(n_nodes, -1, dtype=np.int64)
+    new_index[kept] = np.arange(len(kept))
+
+    new_nodes = nodes[kept].copy()
+    leaves = is_leaf[kept]
+    new_nodes['left_child'] = np.where(leaves, -1, new_index[left[kept]])
+    new_nodes['right_child'] = np.where(leaves, -1, new_index[right[kept]])
+    new_nodes['feature'][leaves] = -2
+    new_nodes['threshold'][leaves] = -2.0
+    if 'missing_go_to_left' in new_nodes.dtype.names:
+        new_nodes['missing_go_to_left'][leaves] = 0
+
+    tree = cls(*args)
+    tree.__setstate__({
+        'max_depth': int(depth[kept].max()),
+        'node_count': len(kept),
+        'nodes': new_nodes,
+        'values': np.ascontiguousarray(values[kept]),
+    })
+    pruned = copy.copy(estimator)
+    pruned.tree_ = tree
+    return pruned
+
+
+def greedy_selection(probas, target, n_trees):
+    """Selezione in avanti degli alberi (senza ripetizioni).
+
+    probas: (alberi, righe, classi); target: (righe, classi), etichette
+    one-hot o probabilità del modello originale. A ogni passo viene aggiunto
+    l'albero che minimizza lo scarto quadratico medio tra la media degli
+    alberi scelti e il target. Restituisce gli indici scelti e l'errore dopo
+    ogni aggiunta.
+    """
+    n_trees = min(n_trees, len(probas))
+    available = np.ones(len(probas), dtype=bool)
+    total = np.zeros_like(target)
+    order, curve = [], []
+    for k in range(1, n_trees + 1):
+        errors = np.mean(np.sum(((total + probas) / k - target) ** 2, axis=2), axis=1)
+        errors[~available] = np.inf
+        best = int(np.argmin(errors))
+        order.append(best)
+        curve.append(float(errors[best]))
+        available[best] = False
+        total += probas[best]
+    return order, curve
+
+
+def compress_forest(forest, X_val, target, n_trees, max_depth=None, merge_tolerance=None):
+    """Foresta ridotta: alberi potati/fusi, poi selezione greedy sulla validazione"""
+    trees = [prune_tree(t, max_depth, merge_tolerance) for t in forest.estimators_]
+    probas = np.stack([t.predict_proba(X_val) for t in trees])
+    order, curve = greedy_selection(probas, target, n_trees)
+
+    compressed = copy.copy(forest)
+    compressed.estimators_ = [trees[i] for i in order]
+    compressed.n_estimators = len(order)
+    return compressed, {'selected': order, 'curve': curve}
+
+
+def compress(model, X_val, y_val, n_trees, max_depth=None, merge_tolerance=None,
+             objective='fidelity'):
+    """Comprime una foresta o ciascuna foresta interna di un modello calibrato.
+
+    Per un modello calibrato il target di ogni foresta interna è la sua
+    uscita grezza (fidelity) o le etichette (brier): i calibratori isotonici
+    restano quelli originali e si aspettano probabilità grezze simili.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f'Obiettivo sconosciuto: {objective}')
+    compressed = model
+    selections = []
+    members = None
+    if hasattr(model, 'calibrated_classifiers_'):
+        compressed = copy.deepcopy(model)
+        members = compressed.calibrated_classifiers_
+        # Il pickle del modello calibrato contiene anche una copia addestrata
+        # della foresta base, mai usata per predire: resta solo come parametro
+        compressed.estimator = clone(model.estimator)
+    for i, forest in enumerate(forests_of(model)):
+        if objective == 'brier':
+            target = np.eye(len(forest.classes_))[np.searchsorted(forest.classes_, y_val)]
+        else:
+            target = forest.predict_proba(X_val)
+        small, selection = compress_forest(forest, X_val, target, n_trees, max_depth,
+                                           merge_tolerance)
+        selections.append(selection)
+        if members is None:
+            compressed = small
+        else:
+            members[i].estimator = small
+    return compressed, selections
+
+
+def drift(original, compressed, X, y, n_classes):
+    """Qualità dei due modelli e scostamento delle probabilità sulle stesse righe"""
+    p0 = original.predict_proba(X)
+    p1 = compressed.predict_proba(X)
+    diff = np.abs(p0 - p1)
+    return {
+        'n_rows': int(len(y)),
+        'original': probability_metrics(p0, y, n_classes),
+        'compressed': probability_metrics(p1, y, n_classes),
+        'agreement': float(np.mean(p0.argmax(axis=1) == p1.argmax(axis=1))),
+        'proba_drift_max': float(diff.max()),
+        'proba_drift_mean': float(diff.max(axis=1).mean()),
+    }
+
+
+def _median_us(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples) * 1e6)
+
+
+def model_cost(model, X, engines=('sklearn', 'compiled'), single_repeats=200,
+               batch_repeats=20, batch_size=256):
+    """Dimensione (pickle, alberi, nodi, profondità) e latenza di predict_proba per motore"""
+    forests = forests_of(model)
+    trees = [t.tree_ for forest in forests for t in forest.estimators_]
+    cost = {
+        'size_kb': len(pickle.dumps(model)) / 1024,
+        'n_trees': len(trees),
+        'n_nodes': int(sum(t.node_count for t in trees)),
+        'max_depth': int(max(t.max_depth for t in trees)),
+    }
+    row = X[:1]
+    batch = np.resize(X, (batch_size, X.shape[1]))
+    for engine in engines:
+        predictor = compile_model(model) if engine == 'compiled' else model
+        predictor.predict_proba(batch)  # warmup
+        cost[engine] = {
+            'single_us': _median_us(lambda: predictor.predict_proba(row), single_repeats),
+            'batch_row_us': _median_us(lambda: predictor.predict_proba(batch),
+                                       batch_repeats) / batch_size,
+        }
+    return cost
+
+
+def holdout_is_unseen(base_version, model_path, csv_path):
+    """Vero se la versione è stata addestrata sullo split 80/20 di csv_path,
+    cioè se l'holdout di validation_split non è mai stato visto dagli alberi"""
+    metrics_path = os.path.join(os.path.dirname(model_path), 'metrics.json')
+    if os.path.basename(model_path) == VERSION_FILES[0]:
+        # Versione del registro: training_pipeline.py salva la chiave del
+        # dataset (CSV e parametri dello split) nelle metriche
+        if not os.path.isfile(metrics_path):
+            return False
+        with open(metrics_path) as f:
+            return json.load(f).get('dataset_key') == dataset_key(csv_path)
+    return base_version in HOLDOUT_VERSIONS
+
+
+def validation_split(csv_path, scaler, label_encoders, eval_csv=None, test_size=0.2,
+                     random_state=42):
+    """Righe di valutazione divise a metà: selezione degli alberi e verifica.
+
+    Senza eval_csv sono l'holdout dello split di fix_confidence_problem.py e
+    training_pipeline.py, mai visto dagli alberi solo per le versioni
+    addestrate su quello split (holdout_is_unseen); con eval_csv sono le
+    righe di quel file.
+    """
+    X, y = encode_labeled(pd.read_csv(csv_path), scaler, label_encoders)
+    if eval_csv:
+        X_eval, y_eval = encode_labeled(pd.read_csv(eval_csv), scaler, label_encoders)
+    else:
+        _, X_eval, _, y_eval = train_test_split(
+            X, y, test_size=test_size, random_state=random_state, stratify=y
+        )
+    X_val, X_test, y_val, y_test = train_test_split(
+        X_eval, y_eval, test_size=0.5, random_state=random_state, stratify=y_eval
+    )
+    return X, y, X_val, y_val, X_test, y_test
+
+
+def run(base_version='improved', n_trees=30, max_depth=None, merge_tolerance=0.0,
+        objective='fidelity', csv_path='student_pe_performance.csv', registry_dir='models',
+        version=None, eval_csv=None):
+    registry = ModelRegistry(root=registry_dir)
+    model_path, scaler_path, encoders_path = registry.artifact_files(base_version)
+    if not eval_csv and not holdout_is_unseen(base_version, model_path, csv_path):
+        # Sulle righe viste in addestramento il modello base è quasi perfetto:
+        # accuratezza e calibrazione del compresso sarebbero sovrastimate
+        raise ValueError(f"La versione '{base_version}' non è stata addestrata sullo split "
+                         f"80/20 di '{csv_path}': il suo holdout non è affidabile. "
+                         "Indicare con --eval-data un CSV etichettato mai visto dal modello")
+    model = joblib.load(model_path)
+    scaler = joblib.load(scaler_path)
+    label_encoders = joblib.load(encoders_path)
+    n_classes = len(label_encoders['Performance'].classes_)
+
+    X, y, X_val, y_val, X_test, y_test = validation_split(csv_path, scaler, label_encoders,
+                                                          eval_csv)
+
+    start = time.perf_counter()
+    compressed, selections = compress(model, X_val, y_val, n_trees, max_depth,
+                                      merge_tolerance, objective)
+    compress_s = time.perf_counter() - start
+
+    report = {
+        'base_version': base_version,
+        'mode': 'compressed',
+        'params': {'trees': n_trees, 'max_depth': max_depth,
+                   'merge_tolerance': merge_tolerance, 'objective': objective},
+        'compress_s': compress_s,
+        'evaluation': eval_csv or 'holdout',
+        'selection': selections,
+        'test': drift(model, compressed, X_test, y_test, n_classes),
+        'all_rows': drift(model, compressed, X, y, n_classes),
+        'cost_original': model_cost(model, X),
+        'cost_compressed': model_cost(compressed, X),
+    }
+    if version:
+        save_version(os.path.join(registry_dir, version), compressed, scaler, label_encoders,
+                     report)
+    return report
+
+
+def print_report(report):
+    before, after = report['cost_original'], report['cost_compressed']
+    print(f"📦 {report['base_version']}: {before['n_trees']} -> {after['n_trees']} alberi, "
+          f"{before['n_nodes']} -> {after['n_nodes']} nodi, profondità "
+          f"{before['max_depth']} -> {after['max_depth']}, "
+          f"{before['size_kb']:.0f} -> {after['size_kb']:.0f} KB "
+          f"({report['compress_s']:.1f} s)")
+    for engine in ('sklearn', 'compiled'):
+        print(f"   {engine:<9} singola {before[engine]['single_us']:7.0f} -> "
+              f"{after[engine]['single_us']:7.0f} µs   batch "
+              f"{before[engine]['batch_row_us']:6.1f} -> {after[engine]['batch_row_us']:6.1f} µs/riga")
+    for name, label in (('test', f"verifica, {report['evaluation']}"),
+                        ('all_rows', 'tutte le righe del dataset')):
+        d = report[name]
+        o, c = d['original'], d['compressed']
+        print(f"📊 {label} ({d['n_rows']} righe): accuratezza {o['accuracy']:.3f} -> "
+              f"{c['accuracy']:.3f}, Brier {o['brier']:.3f} -> {c['brier']:.3f}, "
+              f"ECE {o['ece']:.3f} -> {c['ece']:.3f}")
+        print(f"   stessa classe {d['agreement']:.1%}, scostamento probabilità "
+              f"medio {d['proba_drift_mean']:.3f}, massimo {d['proba_drift_max']:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Comprime una foresta (selezione degli alberi, profondità, fusione delle foglie)'
+    )
+    parser.add_argument('--base-version', default='improved',
+                        help='versione da comprimere (registro o artefatti storici)')
+    parser.add_argument('--trees', type=int, default=30,
+                        help='alberi da tenere (per ogni foresta interna se calibrato)')
+    parser.add_argument('--max-depth', type=int, default=None, help='profondità massima')
+    parser.add_argument('--merge-tolerance', type=float, default=0.0,
+                        help='scarto massimo di probabilità tra foglie sorelle da fondere '
+                             '(0 = solo foglie identiche, negativo = nessuna fusione)')
+    parser.add_argument('--objective', choices=OBJECTIVES, default='fidelity',
+                        help="fidelity: vicino al modello originale; brier: vicino alle etichette")
+    parser.add_argument('--csv', default='student_pe_performance.csv')
+    parser.add_argument('--eval-data',
+                        help='CSV etichettato mai visto dal modello per selezione e verifica '
+                             "(obbligatorio se la versione non è stata addestrata sullo split "
+                             "80/20 di --csv, come 'original' e 'calibrated')")
+    parser.add_argument('--registry-dir', default=os.environ.get('MODEL_REGISTRY_DIR', 'models'))
+    parser.add_argument('--version', help='salva il modello compresso come versione del registro')
+    parser.add_argument('--output', help='salva il report in JSON')
+    args = parser.parse_args()
+
+    try:
+        report = run(args.base_version, args.trees, args.max_depth,
+                     args.merge_tolerance if args.merge_tolerance >= 0 else None,
+                     args.objective, args.csv, args.registry_dir, args.version, args.eval_data)
+    except ValueError as e:
+        parser.error(str(e))
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.version:
+        print(f"✅ Versione '{args.version}' salvata in '{args.registry_dir}/{args.version}'")
@@ -0,0 +1,203 @@
+# RICERCA DEGLI IPERPARAMETRI TRA ACCURATEZZA, CALIBRAZIONE E COSTO DI SERVIZIO
+#
+# I parametri del modello migliorato (n_estimators=50, max_depth=8,
+# min_samples_leaf=5) sono stati scelti a mano per risolvere le confidenze
+# al 100%. Questo script valuta in parallelo una griglia (o un campione
+# casuale) di configurazioni della foresta e per ognuna misura:
+#   - accuratezza e calibrazione (Brier, ECE) in validazione incrociata
+#   - latenza reale di predict_proba su una riga e per riga in batch da 256
+#   - dimensione del modello (pickle e numero di nodi)
+# e riporta il fronte di Pareto, per scegliere il modello più economico che
+# dia ancora confidenze realistiche. Il test set non partecipa alla scelta:
+# è valutato solo per le configurazioni del fronte.
+#
+# Esempio:
+#   python hyperparam_search.py --mode random --samples 40 --output search.json
+
+import argparse
+import itertools
+import json
+import os
+import pickle
+import random
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import StratifiedKFold
+
+from training_pipeline import load_dataset, probability_metrics, single_threaded
+from tree_engine import compile_model, quantize
+
+SEARCH_SPACE = {
+    'n_estimators': [10, 25, 50, 100, 200],
+    'max_depth': [4, 6, 8, 12, None],
+    'min_samples_leaf': [1, 3, 5, 10],
+    'max_features': ['sqrt', 0.5, None],
+    'class_weight': [None, 'balanced'],
+}
+
+# Obiettivi del fronte di Pareto: (nome della metrica, True se va massimizzata).
+# Solo metriche in validazione incrociata: scegliere sul test set lo
+# renderebbe una seconda validazione e le sue metriche sarebbero ottimistiche
+OBJECTIVES = {
+    'cv_accuracy': True,
+    'cv_brier': False,
+    'cv_ece': False,
+    'latency_single_us': False,
+    'latency_batch_row_us': False,
+    'size_kb': False,
+}
+
+
+def configurations(mode='grid', samples=30, seed=42):
+    """Configurazioni da valutare: tutta la griglia o un campione casuale"""
+    names = list(SEARCH_SPACE)
+    grid = [dict(zip(names, values)) for values in itertools.product(*SEARCH_SPACE.values())]
+    if mode == 'random' and samples < len(grid):
+        grid = random.Random(seed).sample(grid, samples)
+    return grid
+
+
+def _evaluate(params, X_train, y_train, n_classes, n_folds, random_state):
+    """Addestra una configurazione: metriche in CV e modello finale"""
+    estimator = single_threaded(RandomForestClassifier(random_state=random_state, **params))
+    folds = StratifiedKFold(n_folds, shuffle=True, random_state=random_state)
+    cv = []
+    for train_idx, eval_idx in folds.split(X_train, y_train):
+        model = clone(estimator).fit(X_train[train_idx], y_train[train_idx])
+        cv.append(probability_metrics(model.predict_proba(X_train[eval_idx]),
+                                      y_train[eval_idx], n_classes))
+    start = time.perf_counter()
+    model = clone(estimator).fit(X_train, y_train)
+    fit_s = time.perf_counter() - start
+    return model, {
+        'params': params,
+        'fit_s': fit_s,
+        'cv_accuracy': float(np.mean([m['accuracy'] for m in cv])),
+        'cv_brier': float(np.mean([m['brier'] for m in cv])),
+        'cv_ece': float(np.mean([m['ece'] for m in cv])),
+        'cv_confidence_max': float(np.max([m['confidence_max'] for m in cv])),
+    }
+
+
+def _median_us(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples) * 1e6)
+
+
+def serving_cost(model, X, engine='sklearn', single_repeats=100, batch_repeats=10,
+                 batch_size=256):
+    """Latenza di predict_proba (una riga, e per riga in batch) e dimensione del modello.
+
+    Misurata nel processo principale, un modello alla volta, perché i tempi
+    non risentano degli addestramenti in parallelo.
+    """
+    predictor = model
+    if engine == 'compiled':
+        predictor = compile_model(model)
+    elif engine == 'binned':
+        predictor = quantize(compile_model(model))
+    row = X[:1]
+    batch = np.resize(X, (batch_size, X.shape[1]))
+    predictor.predict_proba(batch)  # warmup
+    return {
+        'engine': engine,
+        'latency_single_us': _median_us(lambda: predictor.predict_proba(row), single_repeats),
+        'latency_batch_row_us': _median_us(lambda: predictor.predict_proba(batch),
+                                           batch_repeats) / batch_size,
+        'size_kb': len(pickle.dumps(model)) / 1024,
+        'n_nodes': int(sum(tree.tree_.node_count for tree in model.estimators_)),
+    }
+
+
+def pareto_front(results, objectives):
+    """Indici delle configurazioni non dominate rispetto agli obiettivi dati"""
+    signs = np.array([1.0 if OBJECTIVES[name] else -1.0 for name in objectives])
+    values = np.array([[r[name] for name in objectives] for r in results]) * signs
+    front = []
+    for i, point in enumerate(values):
+        dominated = np.any(np.all(values >= point, axis=1) & np.any(values > point, axis=1))
+        if not dominated:
+            front.append(i)
+    return front
+
+
+def search(mode='grid', samples=30, objectives=('cv_accuracy', 'cv_ece', 'latency_single_us'),
+           engine='sklearn', n_folds=3, n_jobs=-1, csv_path='student_pe_performance.csv',
+           seed=42):
+    dataset = load_dataset(csv_path)
+    n_classes = len(dataset.classes)
+    configs = configurations(mode, samples, seed)
+    print(f"🔍 {len(configs)} configurazioni, {n_folds} fold, motore '{engine}'")
+
+    start = time.perf_counter()
+    trained = Parallel(n_jobs=n_jobs)(
+        delayed(_evaluate)(params, dataset.X_train, dataset.y_train, n_classes, n_folds, seed)
+        for params in configs
+    )
+    train_s = time.perf_counter() - start
+
+    results = []
+    for model, metrics in trained:
+        results.append({**metrics, **serving_cost(model, dataset.X_test, engine)})
+
+    front = pareto_front(results, objectives)
+    # Test set solo per le configurazioni scelte: stima finale, non criterio di scelta
+    for i in front:
+        model = trained[i][0]
+        results[i]['test'] = probability_metrics(model.predict_proba(dataset.X_test),
+                                                 dataset.y_test, n_classes)
+    return {
+        'dataset_key': dataset.key,
+        'mode': mode,
+        'engine': engine,
+        'objectives': list(objectives),
+        'train_s': train_s,
+        'results': results,
+        'pareto_front': sorted(front, key=lambda i: results[i]['latency_single_us']),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Ricerca parallela di configurazioni della foresta con fronte di Pareto'
+    )
+    parser.add_argument('--mode', choices=['grid', 'random'], default='random')
+    parser.add_argument('--samples', type=int, default=30, help='configurazioni in modalità random')
+    parser.add_argument('--objectives', nargs='+', choices=list(OBJECTIVES),
+                        default=['cv_accuracy', 'cv_ece', 'latency_single_us'])
+    parser.add_argument('--engine', choices=['sklearn', 'compiled', 'binned'],
+                        default=os.environ.get('INFERENCE_ENGINE', 'sklearn'),
+                        help='motore con cui misurare la latenza')
+    parser.add_argument('--folds', type=int, default=3)
+    parser.add_argument('--jobs', type=int, default=-1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--csv', default='student_pe_performance.csv')
+    parser.add_argument('--output', default='hyperparam_search.json')
+    args = parser.parse_args()
+
+    report = search(args.mode, args.samples, args.objectives, args.engine, args.folds,
+                    args.jobs, args.csv, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n📈 Fronte di Pareto ({', '.join(args.objectives)}):")
+    for i in report['pareto_front']:
+        r = report['results'][i]
+        p, test = r['params'], r['test']
+        print(f"   alberi {p['n_estimators']:>3}  prof. {str(p['max_depth']):>4}  "
+              f"foglia {p['min_samples_leaf']:>2}  feat. {str(p['max_features']):>4}  "
+              f"{str(p['class_weight']):>8} | CV acc {r['cv_accuracy']:.3f}  ece {r['cv_ece']:.3f} | "
+              f"test acc {test['accuracy']:.3f}  brier {test['brier']:.3f}  "
+              f"ece {test['ece']:.3f}  conf.max {test['confidence_max']:.2f} | "
+              f"{r['latency_single_us']:7.0f} µs/riga  {r['latency_batch_row_us']:6.1f} µs/riga batch  "
+              f"{r['size_kb']:6.0f} KB")
+    print(f"✅ {len(report['results'])} configurazioni in {report['train_s']:.1f} s, "
+          f"risultati in '{args.output}'")
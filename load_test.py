@@ -0,0 +1,265 @@
+# TEST DI CARICO CON RIPRODUZIONE DEL TRAFFICO
+#
+# Invia richieste di predizione a un QPS obiettivo con N client concorrenti e
+# riporta latenze (p50/p95/p99), throughput ed errori. I payload vengono dalle
+# righe di student_pe_performance.csv oppure da un log di richieste catturato
+# (i record JSON di request_log con il campo "payload", anche con il prefisso
+# di gunicorn, o un file NDJSON di payload).
+#
+# Il carico è "a ciclo aperto": la richiesta i-esima è pianificata all'istante
+# i / QPS e la latenza è misurata da quell'istante, quindi se il server non
+# regge il ritmo l'attesa in coda viene contata (niente coordinated omission).
+#
+# Esempi:
+#   python load_test.py --qps 200 --duration 30                 # in-process (test client)
+#   python load_test.py --url http://127.0.0.1:8000 --qps 200   # gunicorn locale
+#   python load_test.py --url http://127.0.0.1:8000 --sweep 50 100 200 400 800
+
+import argparse
+import http.client
+import json
+import sys
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+from preprocessing import FEATURE_COLUMNS
+
+
+def payloads_from_csv(path, n, seed=42, jitter=0.0):
+    """Payload dalle righe del dataset, in ordine casuale.
+
+    Con jitter > 0 i valori numerici vengono perturbati (in proporzione)
+    perché i payload non siano tutti già nella cache delle predizioni.
+    """
+    import pandas as pd
+    rows = pd.read_csv(path)[FEATURE_COLUMNS].to_dict('records')
+    rng = np.random.default_rng(seed)
+    payloads = []
+    for i in rng.integers(0, len(rows), size=n):
+        row = dict(rows[i])
+        if jitter:
+            for col, value in row.items():
+                if isinstance(value, float):
+                    row[col] = value * (1 + rng.normal(0, jitter))
+        payloads.append(row)
+    return payloads
+
+
+def payloads_from_log(path):
+    """Payload da un log catturato: record di request_log o una riga JSON per payload"""
+    payloads = []
+    with open(path) as f:
+        for line in f:
+            start = line.find('{')
+            if start < 0:
+                continue
+            try:
+                record = json.loads(line[start:])
+            except ValueError:
+                continue
+            if 'event' in record:
+                if record.get('event') == 'predict' and record.get('payload'):
+                    payloads.append(record['payload'])
+            else:
+                payloads.append(record)
+    return payloads
+
+
+class HttpTarget:
+    """Client HTTP con una connessione keep-alive per thread"""
+
+    def __init__(self, url, endpoint):
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = endpoint
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def send(self, payload):
+        body = json.dumps(payload)
+        conn = self._connection()
+        try:
+            conn.request('POST', self.path, body=body,
+                          headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            if response.will_close:
+                conn.close()
+                self._local.conn = None
+            return response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+
+
+class InProcessTarget:
+    """L'app Flask chiamata direttamente con il test client (un client per thread)"""
+
+    def __init__(self, endpoint):
+        import logging
+        import app as flask_app
+        # I record delle richieste restano attivi (costano come in produzione)
+        # ma non vengono mescolati al report
+        flask_app.request_log.configure([logging.NullHandler()])
+        self.app = flask_app.app
+        self.path = endpoint
+        self._local = threading.local()
+
+    def send(self, payload):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client.post(self.path, json=payload).status_code
+
+
+def run_load(target, payloads, qps, duration, concurrency):
+    """Esegue il carico e restituisce il riepilogo delle misure.
+
+    Con qps=0 ogni client invia la richiesta successiva appena riceve la
+    risposta (ciclo chiuso: misura il throughput massimo).
+    """
+    n_requests = int(qps * duration) if qps else None
+    next_index = [0]
+    index_lock = threading.Lock()
+    latencies = [[] for _ in range(concurrency)]
+    service_times = [[] for _ in range(concurrency)]
+    statuses = [{} for _ in range(concurrency)]
+    started = time.perf_counter()
+    deadline = started + duration
+
+    def client(slot):
+        while True:
+            with index_lock:
+                i = next_index[0]
+                next_index[0] += 1
+            if n_requests is not None:
+                if i >= n_requests:
+                    return
+                scheduled = started + i / qps
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                scheduled = time.perf_counter()
+                if scheduled >= deadline:
+                    return
+            sent = time.perf_counter()
+            try:
+                status = target.send(payloads[i % len(payloads)])
+            except Exception as e:
+                status = type(e).__name__
+            done = time.perf_counter()
+            latencies[slot].append(done - scheduled)
+            service_times[slot].append(done - sent)
+            statuses[slot][status] = statuses[slot].get(status, 0) + 1
+
+    threads = [threading.Thread(target=client, args=(slot,), daemon=True)
+               for slot in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return summarize(latencies, service_times, statuses, elapsed, qps, concurrency)
+
+
+def _percentiles_ms(values):
+    if not len(values):
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+    return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99),
+            'mean': float(np.mean(values) * 1000), 'max': float(np.max(values) * 1000)}
+
+
+def summarize(latencies, service_times, statuses, elapsed, qps, concurrency):
+    latency = np.concatenate([np.asarray(v) for v in latencies])
+    service = np.concatenate([np.asarray(v) for v in service_times])
+    by_status = {}
+    for counts in statuses:
+        for status, count in counts.items():
+            by_status[str(status)] = by_status.get(str(status), 0) + count
+    total = int(len(latency))
+    ok = by_status.get('200', 0)
+    return {
+        'target_qps': qps,
+        'concurrency': concurrency,
+        'requests': total,
+        'elapsed_s': elapsed,
+        'throughput_rps': total / elapsed if elapsed else 0.0,
+        'error_rate': (total - ok) / total if total else 0.0,
+        'status': by_status,
+        # Dall'istante pianificato (include l'attesa se il server non regge il ritmo)
+        'latency_ms': _percentiles_ms(latency),
+        # Solo invio -> risposta
+        'service_time_ms': _percentiles_ms(service),
+    }
+
+
+def print_summary(result):
+    latency = result['latency_ms']
+    target = f"{result['target_qps']:.0f} QPS" if result['target_qps'] else 'max'
+    print(f"   {target:>9} | {result['throughput_rps']:8.1f} req/s | "
+          f"p50 {latency.get('p50', 0):7.2f} ms  p95 {latency.get('p95', 0):7.2f} ms  "
+          f"p99 {latency.get('p99', 0):7.2f} ms | errori {result['error_rate']:.2%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Test di carico delle predizioni con percentili di latenza'
+    )
+    parser.add_argument('--url', help='server da colpire (es. http://127.0.0.1:8000); '
+                                      'senza --url l\'app viene chiamata in-process')
+    parser.add_argument('--endpoint', default='/api/predict')
+    parser.add_argument('--qps', type=float, default=50,
+                        help='richieste al secondo obiettivo (0 = più veloce possibile)')
+    parser.add_argument('--sweep', type=float, nargs='+',
+                        help='serie di QPS da provare in sequenza per trovare la saturazione')
+    parser.add_argument('--duration', type=float, default=10, help='secondi per ogni prova')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--csv', default='student_pe_performance.csv')
+    parser.add_argument('--replay', help='log di richieste da riprodurre al posto del CSV')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='perturbazione relativa dei valori numerici (evita la cache)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--p99-limit', type=float, default=None,
+                        help='nello sweep, ferma la serie quando il p99 supera questi ms')
+    parser.add_argument('--output', help='salva i risultati in JSON')
+    args = parser.parse_args()
+
+    if args.replay:
+        payloads = payloads_from_log(args.replay)
+        if not payloads:
+            sys.exit(f"Nessun payload trovato in '{args.replay}'")
+    else:
+        payloads = payloads_from_csv(args.csv, 10000, seed=args.seed, jitter=args.jitter)
+
+    target = HttpTarget(args.url, args.endpoint) if args.url else InProcessTarget(args.endpoint)
+    where = args.url or 'in-process'
+    print(f"🚀 {len(payloads)} payload -> {where}{args.endpoint}, {args.concurrency} client")
+
+    results = []
+    for qps in (args.sweep or [args.qps]):
+        result = run_load(target, payloads, qps, args.duration, args.concurrency)
+        print_summary(result)
+        results.append(result)
+        if args.p99_limit and result['latency_ms'].get('p99', 0) > args.p99_limit:
+            print(f"⚠️  Saturazione: p99 oltre {args.p99_limit} ms a {qps:.0f} QPS")
+            break
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'url': where, 'endpoint': args.endpoint,
+                       'n_payloads': len(payloads), 'results': results}, f, indent=2)
+        print(f"✅ Risultati salvati in '{args.output}'")
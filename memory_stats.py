@@ -0,0 +1,41 @@
+import os
+import resource
+
+
+def _smaps_rollup():
+    """Legge /proc/self/smaps_rollup (Linux) e restituisce i valori in kB"""
+    values = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return values
+
+
+def process_memory():
+    """Uso di memoria del processo corrente (in MB).
+
+    Su Linux distingue la memoria condivisa con altri processi (ad esempio
+    le pagine dei modelli mappati in memoria) da quella privata del worker;
+    `pss` ripartisce le pagine condivise tra i processi che le usano ed è la
+    misura giusta da sommare sui worker. Altrove riporta solo il picco RSS.
+    """
+    try:
+        smaps = _smaps_rollup()
+    except OSError:
+        # ru_maxrss è in kB su Linux e in byte su macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        divisor = 1024 * 1024 if os.uname().sysname == 'Darwin' else 1024
+        return {'pid': os.getpid(), 'peak_rss_mb': round(peak / divisor, 2)}
+
+    def mb(*keys):
+        return round(sum(smaps.get(k, 0) for k in keys) / 1024, 2)
+
+    return {
+        'pid': os.getpid(),
+        'rss_mb': mb('Rss'),
+        'pss_mb': mb('Pss'),
+        'shared_mb': mb('Shared_Clean', 'Shared_Dirty'),
+        'private_mb': mb('Private_Clean', 'Private_Dirty'),
+    }
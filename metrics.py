@@ -0,0 +1,154 @@
+import bisect
+import threading
+import time
+
+# Limiti dei bucket in secondi: le fasi di una predizione durano da pochi
+# microsecondi (encoding) a qualche millisecondo (inferenza scikit-learn)
+STAGE_BUCKETS = (
+    0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0
+)
+REQUEST_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contatore monotono con etichette (una serie per combinazione di valori)"""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            yield self.name + _format_labels(self.labelnames, labelvalues), value
+
+
+class Histogram:
+    """Istogramma a bucket fissi, nel formato di Prometheus.
+
+    observe() costa una ricerca binaria sui limiti e due incrementi sotto
+    lock: si può lasciare attivo sul percorso caldo.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        # Bucket "le": il primo limite >= value (l'ultimo slot è +Inf)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labels, (list(counts), total))
+                           for labels, (counts, total) in self._series.items())
+        bounds = self.buckets + (float('inf'),)
+        for labelvalues, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues,
+                                        [('le', _format_value(bound))])
+                yield f'{self.name}_bucket{labels}', cumulative
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f'{self.name}_sum{labels}', total
+            yield f'{self.name}_count{labels}', cumulative
+
+
+class MetricsRegistry:
+    """Insieme delle metriche del processo, esportate in formato testo Prometheus.
+
+    Le metriche sono per processo: con più worker gunicorn ogni worker
+    riporta le proprie.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, extra=()):
+        """Testo per /metrics; `extra` sono righe (nome, tipo, descrizione, valore) aggiuntive"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for sample, value in metric.samples():
+                lines.append(f'{sample} {_format_value(value)}')
+        for name, kind, documentation, value in extra:
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """Misura le fasi consecutive di una richiesta.
+
+    Ogni mark(fase) registra nell'istogramma il tempo trascorso dalla marca
+    precedente (o dall'inizio), con le etichette date più il nome della fase.
+    """
+
+    def __init__(self, histogram, *labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+        self.started = self._last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.histogram.observe(now - self._last, *self.labelvalues, stage)
+        self._last = now
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
@@ -0,0 +1,137 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Raggruppa le predizioni singole concorrenti in un'unica inferenza batch.
+
+    Le richieste che arrivano entro `max_wait_ms` dalla prima richiesta in
+    coda (o finché non si raggiungono `max_batch_size` righe) vengono unite
+    in una sola matrice e passate a `predict_fn` con una sola chiamata; ogni
+    richiesta riceve poi la propria riga di probabilità tramite una Future.
+    Ogni richiesta indica la `predict_fn` del modello con cui è stata
+    preprocessata: se durante una finestra il modello attivo cambia, le righe
+    vengono raggruppate per modello e non si mescolano mai.
+
+    Il thread di lavoro viene avviato alla prima richiesta di ogni processo,
+    così funziona anche quando gunicorn crea i worker con fork.
+    """
+
+    def __init__(self, max_batch_size=64, max_wait_ms=2.0, history=10000):
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        # Distribuzioni esposte da stats()
+        self._stats_lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.recent_waits_ms = deque(maxlen=history)
+        self.n_requests = 0
+        self.n_batches = 0
+        self.n_failed_batches = 0
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name='microbatch-worker', daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, row, predict_fn):
+        """Accoda una riga (già preprocessata) e restituisce una Future"""
+        self._ensure_worker()
+        future = Future()
+        # Copia: la riga può stare in un buffer riutilizzato dal chiamante
+        row = np.array(row, dtype=np.float64).ravel()
+        self._queue.put((row, time.perf_counter(), future, predict_fn))
+        return future
+
+    def predict(self, row, predict_fn, timeout=None):
+        """Probabilità (1D) per una singola riga, calcolate in batch con le altre"""
+        return self.submit(row, predict_fn).result(timeout=timeout)
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = first[1] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[3], []).append(item)
+
+            failed = False
+            for predict_fn, items in groups.items():
+                futures = [item[2] for item in items]
+                try:
+                    proba = predict_fn(np.vstack([item[0] for item in items]))
+                    if len(proba) != len(items):
+                        # Senza una riga per richiesta qualcuno resterebbe in attesa
+                        raise ValueError(f'predict_fn ha restituito {len(proba)} righe '
+                                         f'per {len(items)} richieste')
+                except Exception as e:
+                    for future in futures:
+                        future.set_exception(e)
+                    failed = True
+                else:
+                    for future, proba_row in zip(futures, proba):
+                        future.set_result(proba_row)
+
+            with self._stats_lock:
+                self.n_requests += len(batch)
+                self.n_batches += 1
+                self.n_failed_batches += failed
+                self.batch_sizes[len(batch)] += 1
+                self.recent_waits_ms.extend((started - item[1]) * 1000 for item in batch)
+
+    def stats(self):
+        with self._stats_lock:
+            waits = np.asarray(self.recent_waits_ms)
+            sizes = dict(sorted(self.batch_sizes.items()))
+            n_requests, n_batches = self.n_requests, self.n_batches
+            failed = self.n_failed_batches
+
+        wait_stats = {}
+        if len(waits):
+            p50, p95, p99 = np.percentile(waits, [50, 95, 99])
+            wait_stats = {
+                'mean': float(waits.mean()), 'p50': float(p50), 'p95': float(p95),
+                'p99': float(p99), 'max': float(waits.max())
+            }
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'requests': n_requests,
+            'batches': n_batches,
+            'failed_batches': failed,
+            'mean_batch_size': n_requests / n_batches if n_batches else 0.0,
+            'batch_size_distribution': {str(k): v for k, v in sizes.items()},
+            'queue_wait_ms': wait_stats,
+        }
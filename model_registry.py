@@ -0,0 +1,380 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from explanations import TreeExplainer
+from preprocessing import (FEATURE_COLUMNS, FastPreprocessor, load_preprocessing_params,
+                           preprocessing_params, save_preprocessing_params)
+from tree_engine import (compile_model, compiled_metadata, fold_scaler, is_tree_model,
+                         load_compiled, quantize, save_compiled)
+from tree_votes import VoteAnalyzer
+
+# Artefatti storici nella cartella principale, disponibili come versioni
+LEGACY_VERSIONS = {
+    'improved': ('random_forest_model_improved.pkl', 'scaler_improved.pkl',
+                 'label_encoders_improved.pkl'),
+    'original': ('random_forest_model.pkl', 'scaler.pkl', 'label_encoders.pkl'),
+    'calibrated': ('random_forest_model_calibrated.pkl', 'scaler.pkl', 'label_encoders.pkl'),
+}
+
+# Nomi dei file dentro una directory di versione del registro
+VERSION_FILES = ('model.pkl', 'scaler.pkl', 'label_encoders.pkl')
+
+# Parametri di preprocessing salvati accanto al modello compilato esportato
+PREPROCESSING_FILE = 'preprocessing.json'
+
+# Da quante righe un batch dei motori compilato e a bin va all'estimatore di
+# scikit-learn, se è caricato: sui batch grandi il suo ciclo in C è più
+# veloce della visita NumPy (vedi benchmark.py)
+SKLEARN_MIN_BATCH = 1024
+
+
+class ModelRuntime:
+    """Una versione del modello pronta per servire richieste.
+
+    Raggruppa preprocessing compilato, motore di inferenza e metadati del
+    target. Gli endpoint leggono il runtime attivo una volta all'inizio
+    della richiesta e lo usano fino alla fine: uno scambio di versione non
+    tocca le richieste già in corso.
+    """
+
+    def __init__(self, version, engine, inference_model, preprocessor, params, model=None):
+        self.version = version
+        self.engine = engine
+        self.inference_model = inference_model
+        self.preprocessor = preprocessor
+        self.params = params
+        self.model = model
+        self.loaded_at = time.time()
+        self.load_ms = None
+        self.warmup_ms = None
+        # Con lo scaler incorporato nelle soglie l'input è grezzo: per passare
+        # un batch a scikit-learn va standardizzato come nel training
+        self.sklearn_min_batch = None
+        if model is not None and engine != 'sklearn':
+            self.sklearn_min_batch = SKLEARN_MIN_BATCH
+            self._scaler = FastPreprocessor.from_params(params, scaled=True)
+
+        # Etichette del target: tutte e nell'ordine delle colonne di predict_proba
+        self.target_labels = list(params['target_labels'])
+        self.target_classes = [self.target_labels[int(c)] for c in inference_model.classes_]
+        # Identifica il modello: se cambia, la cache delle predizioni viene invalidata
+        self.token = f'{version}:{engine}:{self.loaded_at}'
+        # Tabelle per foglia di spiegazioni e consenso tra gli alberi: costruite
+        # alla prima richiesta che le usa, non a ogni caricamento (sono memoria
+        # privata del worker)
+        self.trees_available = is_tree_model(inference_model)
+        self._lock = threading.Lock()
+        self._leaf_tables = {}
+
+    @classmethod
+    def from_sklearn(cls, version, model, scaler, label_encoders, engine='sklearn',
+                     compiled_dir=None, mmap=False, source=None):
+        params = preprocessing_params(label_encoders, scaler)
+        if engine == 'sklearn':
+            return cls(version, engine, model, FastPreprocessor(label_encoders, scaler),
+                       params, model=model)
+        if engine not in ('compiled', 'binned'):
+            raise ValueError(f'Motore di inferenza sconosciuto: {engine}')
+
+        # Scaler incorporato nelle soglie: l'input non viene standardizzato
+        compiled = fold_scaler(compile_model(model), scaler)
+        if compiled_dir and (mmap or os.path.isdir(compiled_dir)):
+            # Esportazione su disco (atomica): i worker mappano gli stessi file.
+            # Un'esportazione di .pkl diversi da questi viene sostituita
+            if not export_is_current(compiled_dir, source):
+                export_runtime(compiled, params, compiled_dir, source=source)
+            if mmap:
+                compiled = load_compiled(compiled_dir, mmap_mode='r')
+        if engine == 'binned':
+            # Le soglie con lo scaler incorporato sono già i tagli esatti dei
+            # bin: stessa esportazione del motore compilato, e con mmap nodi e
+            # probabilità restano mappati (privati solo gli indici dei bin)
+            compiled = quantize(compiled)
+        return cls(version, engine, compiled, FastPreprocessor(label_encoders, None), params,
+                   model=None if mmap else model)
+
+    @classmethod
+    def from_export(cls, version, compiled_dir, mmap=False, engine='compiled'):
+        """Runtime da un modello esportato: nessun .pkl, nessun import di scikit-learn"""
+        params = load_preprocessing_params(os.path.join(compiled_dir, PREPROCESSING_FILE))
+        compiled = load_compiled(compiled_dir, mmap_mode='r' if mmap else None)
+        if engine == 'binned':
+            compiled = quantize(compiled)
+        return cls(version, engine, compiled,
+                   FastPreprocessor.from_params(params, scaled=not compiled.raw_input), params)
+
+    @classmethod
+    def from_files(cls, version, model_path, scaler_path, encoders_path,
+                   engine='sklearn', compiled_dir=None, mmap=False):
+        source = source_fingerprint(model_path, scaler_path, encoders_path)
+        if (engine in ('compiled', 'binned') and compiled_dir
+                and export_is_current(compiled_dir, source)):
+            return cls.from_export(version, compiled_dir, mmap=mmap, engine=engine)
+
+        # joblib (e con lui scikit-learn) viene importato solo se serve davvero
+        import joblib
+        return cls.from_sklearn(
+            version, joblib.load(model_path), joblib.load(scaler_path),
+            joblib.load(encoders_path), engine=engine, compiled_dir=compiled_dir, mmap=mmap,
+            source=source
+        )
+
+    def predict_proba(self, X):
+        if self.sklearn_min_batch is not None and len(X) >= self.sklearn_min_batch:
+            X = self._scaler.scale_inplace(np.array(X, dtype=np.float64))
+            return self.model.predict_proba(X)
+        return self.inference_model.predict_proba(X)
+
+    @property
+    def nbytes(self):
+        return getattr(self.inference_model, 'nbytes', None)
+
+    @property
+    def mmapped(self):
+        forest = getattr(self.inference_model, 'forest', self.inference_model)
+        return isinstance(getattr(forest, 'proba', None), np.memmap)
+
+    def synthetic_students(self, n):
+        """Studenti sintetici (valori medi, prima categoria) per il warmup"""
+        means = self.params['mean']
+        student = {}
+        for j, col in enumerate(FEATURE_COLUMNS):
+            codes = self.preprocessor.category_codes.get(col)
+            if codes is not None:
+                student[col] = next(iter(codes))
+            else:
+                student[col] = float(means[j]) if means is not None else 0.0
+        return [dict(student) for _ in range(n)]
+
+    def warmup(self, n_single=5, batch_size=64):
+        """Predizioni sintetiche (singole e batch) prima di servire traffico"""
+        start = time.perf_counter()
+        students = self.synthetic_students(batch_size)
+        for student in students[:n_single]:
+            self.predict_proba(self.preprocessor.transform_one(student))
+        X, _, _ = self.preprocessor.transform_many(students)
+        self.predict_proba(X)
+        self.warmup_ms = (time.perf_counter() - start) * 1000
+        return self.warmup_ms
+
+    @property
+    def explainer(self):
+        """Contributi delle feature (None se il modello non è una foresta di alberi)"""
+        return self._leaf_table(TreeExplainer)
+
+    @property
+    def vote_analyzer(self):
+        """Voti e probabilità per foglia di /api/uncertainty (None se non è una foresta)"""
+        return self._leaf_table(VoteAnalyzer)
+
+    def _leaf_table(self, cls):
+        if cls not in self._leaf_tables:
+            with self._lock:
+                if cls not in self._leaf_tables:
+                    self._leaf_tables[cls] = (_from_trees(cls, self.inference_model)
+                                              if self.trees_available else None)
+        return self._leaf_tables[cls]
+
+    def describe(self):
+        return {
+            'version': self.version,
+            'inference_engine': self.engine,
+            'loaded_at': self.loaded_at,
+            'load_ms': self.load_ms,
+            'warmup_ms': self.warmup_ms,
+            'model_mmapped': self.mmapped,
+            'sklearn_min_batch': self.sklearn_min_batch,
+            'explanations': self.trees_available,
+            'uncertainty': self.trees_available,
+        }
+
+
+def _from_trees(cls, model):
+    try:
+        return cls.from_model(model)
+    except TypeError:
+        return None
+
+
+def source_fingerprint(model_path, scaler_path, encoders_path):
+    """Dimensione e data di modifica dei .pkl di una versione (None se ne manca
+    uno): salvate nell'esportazione per accorgersi che i .pkl sono cambiati"""
+    fingerprint = {}
+    for name, path in (('model', model_path), ('scaler', scaler_path),
+                       ('label_encoders', encoders_path)):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        fingerprint[name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return fingerprint
+
+
+def export_is_current(directory, source):
+    """True se la directory contiene un'esportazione completa degli stessi .pkl.
+
+    Senza .pkl da confrontare (source None, es. un deploy con la sola
+    esportazione) vale l'esportazione presente.
+    """
+    if not os.path.isfile(os.path.join(directory, PREPROCESSING_FILE)):
+        return False
+    meta = compiled_metadata(directory)
+    return meta is not None and (source is None or meta.get('source') == source)
+
+
+def export_runtime(compiled, params, directory, overwrite=True, source=None):
+    """Salva modello compilato e parametri di preprocessing nella stessa directory"""
+    save_compiled(compiled, directory, overwrite=overwrite, source=source)
+    params_path = os.path.join(directory, PREPROCESSING_FILE)
+    if overwrite or not os.path.isfile(params_path):
+        tmp_path = f'{params_path}.tmp-{os.getpid()}'
+        save_preprocessing_params(params, tmp_path)
+        os.replace(tmp_path, params_path)
+
+
+class ModelRegistry:
+    """Registro versionato dei modelli con scambio atomico in-process.
+
+    Ogni versione è una directory `<root>/<versione>/` con model.pkl,
+    scaler.pkl e label_encoders.pkl (ed eventualmente `compiled/` con la
+    foresta esportata). Il file `<root>/ACTIVE` contiene la versione attiva;
+    gli artefatti storici nella cartella principale sono disponibili come
+    versioni 'improved', 'original' e 'calibrated'.
+
+    Il cambio di versione carica e riscalda il nuovo modello prima di
+    renderlo attivo con una singola assegnazione: le richieste in corso
+    finiscono sul modello precedente.
+    """
+
+    def __init__(self, root='models', engine='sklearn', mmap=False,
+                 compiled_root='compiled_model'):
+        self.root = root
+        self.engine = engine
+        self.mmap = mmap
+        self.compiled_root = compiled_root
+        self._active = None
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._watcher_pid = None
+        self._active_file_state = None
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def active_file(self):
+        return os.path.join(self.root, 'ACTIVE')
+
+    def _paths(self, version):
+        # Solo nomi semplici: una versione non può uscire dalla cartella del registro
+        if not isinstance(version, str) or version in ('', '.', '..') or os.path.basename(version) != version:
+            raise FileNotFoundError(f'Nome di versione non valido: {version!r}')
+        version_dir = os.path.join(self.root, version)
+        if os.path.isfile(os.path.join(version_dir, VERSION_FILES[0])):
+            files = tuple(os.path.join(version_dir, name) for name in VERSION_FILES)
+            return files, os.path.join(version_dir, 'compiled')
+        if version in LEGACY_VERSIONS:
+            return LEGACY_VERSIONS[version], os.path.join(self.compiled_root, version)
+        raise FileNotFoundError(f'Versione del modello non trovata: {version}')
+
+    def artifact_files(self, version):
+        """Percorsi (modello, scaler, label encoder) dei .pkl di una versione"""
+        return self._paths(version)[0]
+
+    def versions(self):
+        """Versioni disponibili (registro + artefatti storici presenti su disco)"""
+        found = []
+        if os.path.isdir(self.root):
+            for name in sorted(os.listdir(self.root)):
+                if os.path.isfile(os.path.join(self.root, name, VERSION_FILES[0])):
+                    found.append(name)
+        for name, files in LEGACY_VERSIONS.items():
+            if name not in found and all(os.path.isfile(f) for f in files):
+                found.append(name)
+        return found
+
+    def read_active_file(self):
+        try:
+            with open(self.active_file) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def write_active_file(self, version):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f'{self.active_file}.tmp-{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            f.write(version + '\n')
+        os.replace(tmp_path, self.active_file)
+
+    def initial_version(self, requested=None):
+        """Versione da caricare all'avvio: richiesta, poi ACTIVE, poi 'improved'/'original'"""
+        for candidate in (requested, self.read_active_file()):
+            if candidate:
+                return candidate
+        available = self.versions()
+        for fallback in ('improved', 'original'):
+            if fallback in available:
+                return fallback
+        raise FileNotFoundError('Nessun modello disponibile')
+
+    def load(self, version):
+        """Carica una versione senza attivarla"""
+        files, compiled_dir = self._paths(version)
+        return ModelRuntime.from_files(version, *files, engine=self.engine,
+                                       compiled_dir=compiled_dir, mmap=self.mmap)
+
+    def activate(self, version, warmup=True, persist=False):
+        """Carica, riscalda e rende attiva una versione (una ricarica alla volta)"""
+        with self._reload_lock:
+            start = time.perf_counter()
+            runtime = self.load(version)
+            runtime.load_ms = (time.perf_counter() - start) * 1000
+            if warmup:
+                runtime.warmup()
+            previous = self._active
+            self._active = runtime
+            if persist:
+                self.write_active_file(version)
+            self._active_file_state = self._file_state()
+            return runtime, previous
+
+    def _file_state(self):
+        try:
+            return os.stat(self.active_file).st_mtime_ns, self.read_active_file()
+        except FileNotFoundError:
+            return None
+
+    def check_active_file(self):
+        """Se ACTIVE è cambiato (es. da un altro worker), passa alla nuova versione"""
+        state = self._file_state()
+        if state is None or state == self._active_file_state:
+            return None
+        self._active_file_state = state
+        version = state[1]
+        if version and (self._active is None or version != self._active.version):
+            return self.activate(version)[0]
+        return None
+
+    def ensure_watcher(self, interval):
+        """Avvia (una volta per processo) il thread che osserva il file ACTIVE"""
+        if interval <= 0 or (self._watcher is not None and self._watcher_pid == os.getpid()):
+            return
+        self._watcher_pid = os.getpid()
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    runtime = self.check_active_file()
+                    if runtime is not None:
+                        print(f"🔄 Modello aggiornato alla versione '{runtime.version}'")
+                except Exception as e:
+                    print(f"❌ Errore nel cambio di modello: {e}")
+
+        self._watcher = threading.Thread(target=watch, name='model-watcher', daemon=True)
+        self._watcher.start()
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionCache:
+    """Cache in-process dei risultati di predizione con eviction LRU e TTL.
+
+    La chiave è il vettore delle feature già codificato (categorie tradotte
+    nel codice che vede il modello, categorie sconosciute comprese) con i
+    valori numerici arrotondati a `precision` decimali: payload identici o
+    quasi identici condividono la stessa voce. Ogni voce è legata al
+    `model_token` del modello che l'ha prodotta; quando il token cambia la
+    cache viene svuotata. `clock` misura le scadenze (sostituibile nei test).
+    """
+
+    def __init__(self, maxsize=4096, ttl=None, precision=6, clock=time.monotonic):
+        self.maxsize = int(maxsize)
+        self.ttl = ttl if ttl else None
+        self.precision = precision
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_token = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def make_key(self, encoded_row):
+        """Chiave canonica per una riga codificata (non standardizzata)"""
+        row = np.asarray(encoded_row, dtype=np.float64).ravel()
+        if self.precision is not None:
+            row = np.round(row, self.precision) + 0.0  # +0.0 normalizza -0.0
+        return tuple(row.tolist())
+
+    def _check_model(self, model_token):
+        # Da chiamare con il lock acquisito
+        if model_token != self._model_token:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self._model_token = model_token
+
+    def get(self, key, model_token):
+        """Restituisce il risultato in cache oppure None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._check_model(model_token)
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= self.clock():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, model_token):
+        if not self.enabled:
+            return
+        expires_at = self.clock() + self.ttl if self.ttl else None
+        with self._lock:
+            self._check_model(model_token)
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'precision': self.precision,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
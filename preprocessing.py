@@ -0,0 +1,182 @@
+import json
+import math
+import threading
+
+import numpy as np
+
+# Definizione delle colonne del dataset (senza ID e Performance)
+FEATURE_COLUMNS = [
+    'Age', 'Gender', 'Grade_Level', 'Strength_Score', 'Endurance_Score',
+    'Flexibility_Score', 'Speed_Agility_Score', 'BMI',
+    'Health_Fitness_Knowledge_Score', 'Skills_Score',
+    'Class_Participation_Level', 'Attendance_Rate', 'Motivation_Level',
+    'Overall_PE_Performance_Score', 'Improvement_Rate', 'Final_Grade',
+    'Previous_Semester_PE_Grade', 'Hours_Physical_Activity_Per_Week'
+]
+
+
+class FastPreprocessor:
+    """Preprocessing compilato: label encoding + standardizzazione senza pandas.
+
+    Viene costruito una sola volta al caricamento dei modelli a partire dai
+    LabelEncoder e dallo StandardScaler salvati. Le categorie sono codificate
+    con lookup su dizionario (categoria sconosciuta -> prima classe, come nel
+    percorso originale) e la standardizzazione usa gli array mean_/scale_
+    precalcolati, con le stesse operazioni in-place di scaler.transform:
+    il risultato è identico bit per bit.
+
+    Con scaler=None la standardizzazione viene saltata: serve per i modelli
+    compilati con lo scaler incorporato nelle soglie (tree_engine.fold_scaler).
+    """
+
+    def __init__(self, label_encoders, scaler, feature_columns=FEATURE_COLUMNS):
+        categories = {
+            col: list(le.classes_) for col, le in label_encoders.items()
+            if col != "Performance"
+        }
+        mean = scaler.mean_ if scaler is not None and scaler.with_mean else None
+        scale = scaler.scale_ if scaler is not None and scaler.with_std else None
+        self._setup(categories, mean, scale, feature_columns)
+
+    @classmethod
+    def from_params(cls, params, scaled=True):
+        """Costruisce il preprocessing dai parametri di preprocessing_params.
+
+        Non richiede scikit-learn: serve ad avviare il server senza
+        deserializzare gli oggetti LabelEncoder/StandardScaler.
+        """
+        self = cls.__new__(cls)
+        self._setup(
+            params['categories'],
+            params['mean'] if scaled else None,
+            params['scale'] if scaled else None,
+            params['feature_columns'],
+        )
+        return self
+
+    def _setup(self, categories, mean, scale, feature_columns):
+        self.feature_columns = list(feature_columns)
+        self.n_features = len(self.feature_columns)
+
+        # Per ogni colonna: dizionario categoria -> codice, oppure None se numerica
+        self.category_codes = {
+            col: {c: i for i, c in enumerate(classes)}
+            for col, classes in categories.items()
+            if col in self.feature_columns
+        }
+        self._columns = [
+            (col, self.category_codes.get(col)) for col in self.feature_columns
+        ]
+
+        # Parametri dello scaler (None se lo scaler non centra / non scala)
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float64)
+        self.scale = None if scale is None else np.asarray(scale, dtype=np.float64)
+
+        # Buffer di una riga riutilizzato, uno per thread
+        self._local = threading.local()
+
+    def _row_buffer(self):
+        buffer = getattr(self._local, 'row', None)
+        if buffer is None:
+            buffer = np.empty((1, self.n_features), dtype=np.float64)
+            self._local.row = buffer
+        return buffer
+
+    def encode_into(self, student, out):
+        """Scrive in `out` la riga codificata (non standardizzata) di uno studente.
+
+        Solleva ValueError con un messaggio leggibile se la riga non è valida.
+        """
+        if not isinstance(student, dict):
+            raise ValueError('Riga non valida: atteso un oggetto JSON')
+
+        for j, (col, codes) in enumerate(self._columns):
+            if col not in student:
+                raise ValueError(f'Campo mancante: {col}')
+            value = student[col]
+            if codes is not None:
+                try:
+                    out[j] = codes.get(value, 0)
+                except TypeError:
+                    raise ValueError(f'Valore non valido per {col}: {value!r}')
+            else:
+                try:
+                    number = float(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f'Valore non numerico per {col}: {value!r}')
+                if not math.isfinite(number):
+                    raise ValueError(f'Valore non finito per {col}: {value!r}')
+                out[j] = number
+        return out
+
+    def scale_inplace(self, X):
+        """Standardizza X in-place (stesse operazioni di StandardScaler.transform)"""
+        if self.mean is not None:
+            X -= self.mean
+        if self.scale is not None:
+            X /= self.scale
+        return X
+
+    def encode_one(self, student):
+        """Codifica uno studente (senza standardizzare) nel buffer del thread corrente.
+
+        Restituisce una vista (1, n_features) valida fino alla prossima
+        chiamata dallo stesso thread.
+        """
+        buffer = self._row_buffer()
+        self.encode_into(student, buffer[0])
+        return buffer
+
+    def transform_one(self, student):
+        """Come encode_one, con la riga già standardizzata"""
+        return self.scale_inplace(self.encode_one(student))
+
+    def encode_many(self, students):
+        """Codifica una lista di studenti saltando le righe non valide.
+
+        Restituisce (X, valid_index, errors) dove X contiene solo le righe
+        valide (non standardizzate), valid_index le loro posizioni originali
+        ed errors un dizionario posizione -> messaggio.
+        """
+        X = np.empty((len(students), self.n_features), dtype=np.float64)
+        valid_index = []
+        errors = {}
+        for i, student in enumerate(students):
+            try:
+                self.encode_into(student, X[len(valid_index)])
+                valid_index.append(i)
+            except ValueError as e:
+                errors[i] = str(e)
+        return X[:len(valid_index)], valid_index, errors
+
+    def transform_many(self, students):
+        """Come encode_many, ma con la matrice già standardizzata"""
+        X, valid_index, errors = self.encode_many(students)
+        return self.scale_inplace(X), valid_index, errors
+
+
+def preprocessing_params(label_encoders, scaler, feature_columns=FEATURE_COLUMNS):
+    """Parametri di encoding e scaling in forma JSON (senza oggetti scikit-learn)"""
+    def as_list(values):
+        return [v.item() if hasattr(v, 'item') else v for v in values]
+
+    return {
+        'feature_columns': list(feature_columns),
+        'categories': {
+            col: as_list(le.classes_) for col, le in label_encoders.items()
+            if col != "Performance"
+        },
+        'target_labels': as_list(label_encoders["Performance"].classes_),
+        'mean': scaler.mean_.tolist() if scaler.with_mean else None,
+        'scale': scaler.scale_.tolist() if scaler.with_std else None,
+    }
+
+
+def save_preprocessing_params(params, path):
+    with open(path, 'w') as f:
+        json.dump(params, f, indent=2)
+
+
+def load_preprocessing_params(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,133 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+
+class _JsonMessage:
+    """Messaggio serializzato in JSON solo quando viene scritto (nel thread del listener)"""
+
+    __slots__ = ('fields',)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return json.dumps(self.fields, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def _stdout_handlers():
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    return [handler]
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler che non blocca mai e non formatta nel thread della richiesta.
+
+    Se la coda è piena il record viene scartato (e contato) invece di
+    rallentare la richiesta.
+    """
+
+    def __init__(self, log_queue, owner):
+        super().__init__(log_queue)
+        self.owner = owner
+
+    def prepare(self, record):
+        # La formattazione (e il json.dumps) avviene nel listener
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.owner._count_dropped()
+
+
+class RequestLogger:
+    """Log strutturato delle richieste: record JSON compatti scritti in background.
+
+    Ogni richiesta produce un record compatto (id della richiesta, latenza,
+    classe predetta, versione del modello). Una frazione `sample_rate` delle
+    richieste, scelta a caso, include anche i dettagli verbosi (payload e
+    probabilità). I record passano da una coda e vengono scritti dagli
+    handler di destinazione (ad esempio quelli di gunicorn) da un thread
+    separato, avviato alla prima scrittura di ogni processo come per il
+    micro-batching.
+    """
+
+    def __init__(self, name='pe.requests', sample_rate=0.01, enabled=True, queue_size=10000):
+        self.sample_rate = float(sample_rate)
+        self.enabled = enabled
+        self.dropped = 0
+        self._queue_size = queue_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._handlers = None
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # Lock separato: _lock è tenuto mentre il listener si ferma, e una
+        # richiesta con la coda piena non deve aspettarlo
+        self._dropped_lock = threading.Lock()
+
+        self.logger = logging.getLogger(name)
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self._queue_handler = _NonBlockingQueueHandler(self._queue, self)
+        self.logger.handlers = [self._queue_handler]
+        atexit.register(self.flush)
+
+    def configure(self, handlers=None, level=logging.INFO):
+        """Handler su cui scrivere; senza handler i record vanno su stdout"""
+        self.logger.setLevel(level)
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._handlers = list(handlers) if handlers else _stdout_handlers()
+            self._listener = None
+
+    def _ensure_listener(self):
+        if self._listener is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener is None or self._pid != os.getpid():
+                if self._handlers is None:
+                    self._handlers = _stdout_handlers()
+                # Dopo un fork coda e thread del processo padre non servono più
+                self._queue = queue.Queue(maxsize=self._queue_size)
+                self._queue_handler.queue = self._queue
+                self._pid = os.getpid()
+                self._listener = logging.handlers.QueueListener(
+                    self._queue, *self._handlers, respect_handler_level=True
+                )
+                self._listener.start()
+
+    def _count_dropped(self):
+        # `dropped += 1` non è atomico: da più thread si perderebbero incrementi
+        with self._dropped_lock:
+            self.dropped += 1
+
+    def sampled(self):
+        """True per la frazione di richieste di cui registrare i dettagli verbosi"""
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def log(self, level=logging.INFO, **fields):
+        if not self.enabled or not self.logger.isEnabledFor(level):
+            return
+        self._ensure_listener()
+        # Record costruito direttamente: niente ricerca del chiamante nello stack
+        record = logging.LogRecord(self.logger.name, level, __file__, 0,
+                                   _JsonMessage(fields), None, None)
+        self._queue_handler.enqueue(record)
+
+    def flush(self):
+        """Scrive i record in coda (usato in chiusura e nei test manuali)"""
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+                self._listener = None
@@ -0,0 +1,153 @@
+# RIADDESTRAMENTO INCREMENTALE CON WARM START
+#
+# Quando arrivano i dati di un nuovo semestre non serve riaddestrare la
+# foresta da zero: si parte dalla versione attuale del registro, si
+# aggiungono alberi addestrati solo sui dati nuovi (warm_start di
+# RandomForestClassifier) ed eventualmente si eliminano gli alberi più
+# vecchi per non superare una dimensione massima. Il costo dipende quindi
+# dai dati nuovi, non da tutta la storia.
+#
+# Encoder e scaler restano quelli della versione di partenza (gli alberi
+# esistenti sono stati addestrati in quello spazio): le righe nuove vengono
+# preprocessate come nel server, categorie sconosciute comprese.
+#
+# Esempio:
+#   python retrain_incremental.py semestre_2.csv --add-trees 25 --max-trees 100
+
+import argparse
+import copy
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+
+from model_registry import ModelRegistry
+from preprocessing import FEATURE_COLUMNS, FastPreprocessor
+from training_pipeline import probability_metrics, save_version
+
+
+def encode_labeled(df, scaler, label_encoders):
+    """Feature (preprocessing del server) e target codificati di un CSV etichettato"""
+    X, valid_index, errors = FastPreprocessor(label_encoders, scaler).transform_many(
+        df[FEATURE_COLUMNS].to_dict('records')
+    )
+    if errors:
+        first = next(iter(errors.items()))
+        raise ValueError(f'{len(errors)} righe non valide (riga {first[0]}: {first[1]})')
+
+    target_le = label_encoders['Performance']
+    unknown = set(df['Performance']) - set(target_le.classes_)
+    if unknown:
+        raise ValueError(f'Classi del target sconosciute: {sorted(unknown)}')
+    return X, target_le.transform(df['Performance'])
+
+
+def warm_start_forest(model, X_new, y_new, add_trees, max_trees=None):
+    """Copia di `model` con `add_trees` alberi in più addestrati solo su X_new.
+
+    Con max_trees vengono tenuti solo gli alberi più recenti. Restituisce
+    (nuovo modello, alberi eliminati).
+    """
+    if not isinstance(model, RandomForestClassifier):
+        raise TypeError(
+            f'Il warm start richiede un RandomForestClassifier, non {type(model).__name__}'
+        )
+    # Ogni albero deve vedere tutte le classi, altrimenti classes_ cambierebbe
+    # e le probabilità dei vecchi e nuovi alberi non sarebbero allineate
+    missing = set(range(len(model.classes_))) - set(np.unique(y_new))
+    if missing:
+        names = [str(model.classes_[i]) for i in sorted(missing)]
+        raise ValueError(f'Nei dati nuovi mancano le classi {names}: aggiungere dati recenti')
+
+    forest = copy.deepcopy(model)
+    forest.set_params(warm_start=True, n_estimators=len(forest.estimators_) + add_trees,
+                      oob_score=False)
+    forest.fit(X_new, y_new)
+
+    retired = 0
+    if max_trees is not None and len(forest.estimators_) > max_trees:
+        retired = len(forest.estimators_) - max_trees
+        forest.estimators_ = forest.estimators_[retired:]
+        forest.n_estimators = len(forest.estimators_)
+    forest.set_params(warm_start=False)
+    return forest, retired
+
+
+def retrain(new_csv, version, base_version=None, registry_dir='models', recent_csv=None,
+            eval_csv=None, holdout=0.2, add_trees=25, max_trees=None, random_state=42):
+    registry = ModelRegistry(root=registry_dir)
+    base_version = registry.initial_version(base_version)
+    model_path, scaler_path, encoders_path = registry.artifact_files(base_version)
+    model = joblib.load(model_path)
+    scaler = joblib.load(scaler_path)
+    label_encoders = joblib.load(encoders_path)
+
+    new_df = pd.read_csv(new_csv)
+    if recent_csv:
+        new_df = pd.concat([pd.read_csv(recent_csv), new_df], ignore_index=True)
+    X_new, y_new = encode_labeled(new_df, scaler, label_encoders)
+
+    if eval_csv:
+        X_eval, y_eval = encode_labeled(pd.read_csv(eval_csv), scaler, label_encoders)
+        X_fit, y_fit = X_new, y_new
+    else:
+        # Valutazione su una parte dei dati nuovi, mai vista dagli alberi nuovi
+        X_fit, X_eval, y_fit, y_eval = train_test_split(
+            X_new, y_new, test_size=holdout, random_state=random_state, stratify=y_new
+        )
+
+    start = time.perf_counter()
+    forest, retired = warm_start_forest(model, X_fit, y_fit, add_trees, max_trees)
+    fit_s = time.perf_counter() - start
+
+    n_classes = len(label_encoders['Performance'].classes_)
+    metrics = {
+        'base_version': base_version,
+        'mode': 'incremental',
+        'n_new_rows': int(len(y_fit)),
+        'n_eval_rows': int(len(y_eval)),
+        'trees_before': len(model.estimators_),
+        'trees_added': add_trees,
+        'trees_retired': retired,
+        'trees_after': len(forest.estimators_),
+        'fit_s': fit_s,
+        'eval_base': probability_metrics(model.predict_proba(X_eval), y_eval, n_classes),
+        'eval_new': probability_metrics(forest.predict_proba(X_eval), y_eval, n_classes),
+    }
+    save_version(os.path.join(registry_dir, version), forest, scaler, label_encoders, metrics)
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Aggiunge alberi (warm start) a una versione del modello con i dati nuovi'
+    )
+    parser.add_argument('new_data', help='CSV etichettato con i dati nuovi (stesse colonne del dataset)')
+    parser.add_argument('--version', default=time.strftime('%Y%m%d-%H%M%S-inc'),
+                        help='nome della nuova versione nel registro')
+    parser.add_argument('--base-version', default=None,
+                        help="versione di partenza (default: models/ACTIVE, poi 'improved')")
+    parser.add_argument('--recent-data', help='CSV di dati recenti da usare insieme ai nuovi')
+    parser.add_argument('--eval-data', help='CSV di valutazione (default: holdout dei dati nuovi)')
+    parser.add_argument('--holdout', type=float, default=0.2)
+    parser.add_argument('--add-trees', type=int, default=25)
+    parser.add_argument('--max-trees', type=int, default=None,
+                        help='numero massimo di alberi: i più vecchi vengono eliminati')
+    parser.add_argument('--registry-dir', default=os.environ.get('MODEL_REGISTRY_DIR', 'models'))
+    args = parser.parse_args()
+
+    metrics = retrain(args.new_data, args.version, args.base_version, args.registry_dir,
+                      recent_csv=args.recent_data, eval_csv=args.eval_data,
+                      holdout=args.holdout, add_trees=args.add_trees, max_trees=args.max_trees)
+    base, new = metrics['eval_base'], metrics['eval_new']
+    print(f"✅ Versione '{args.version}' da '{metrics['base_version']}': "
+          f"{metrics['trees_before']} + {metrics['trees_added']} - {metrics['trees_retired']} "
+          f"= {metrics['trees_after']} alberi, {metrics['n_new_rows']} righe nuove "
+          f"in {metrics['fit_s']:.2f} s")
+    print(f"   accuratezza {base['accuracy']:.3f} -> {new['accuracy']:.3f}, "
+          f"Brier {base['brier']:.3f} -> {new['brier']:.3f}, "
+          f"ECE {base['ece']:.3f} -> {new['ece']:.3f}")
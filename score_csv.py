@@ -0,0 +1,194 @@
+# SCORING OFFLINE DI FILE CSV CON UN POOL DI PROCESSI
+#
+# Legge il CSV a blocchi (senza caricarlo tutto in memoria), distribuisce i
+# blocchi su un pool di processi e scrive per ogni riga la classe predetta e
+# le probabilità, nello stesso ordine dell'ingresso. Il preprocessing è lo
+# stesso del server (preprocessing.FastPreprocessor tramite il registro dei
+# modelli), quindi i risultati coincidono con quelli di /api/predict.
+#
+# Esempio:
+#   python score_csv.py student_pe_performance.csv predizioni.csv --workers 4
+
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+
+from bulk_scoring import CsvFormatter, iter_chunks, iter_text_lines, score_chunk
+from model_registry import ModelRegistry
+
+# Variabili che limitano i thread delle librerie numeriche: con un processo
+# per core, ogni processo deve usare un solo thread
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+# Modello caricato in ogni processo del pool (da _init_worker)
+_RUNTIME = None
+
+
+def _limit_threads(model):
+    """n_jobs=1 sulla foresta (e su quelle dentro un modello calibrato)"""
+    estimators = [model] + [
+        c.estimator for c in getattr(model, 'calibrated_classifiers_', [])
+    ]
+    for estimator in estimators:
+        if hasattr(estimator, 'n_jobs'):
+            estimator.n_jobs = 1
+
+
+def _single_thread():
+    """Context manager che limita a un thread BLAS/OpenMP (se c'è threadpoolctl)"""
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return nullcontext()
+    return threadpool_limits(1)
+
+
+def _load_runtime(version, engine, mmap, registry_dir, compiled_dir):
+    registry = ModelRegistry(root=registry_dir, engine=engine, mmap=mmap,
+                             compiled_root=compiled_dir)
+    runtime = registry.load(version)
+    if runtime.model is not None:
+        _limit_threads(runtime.model)
+    return runtime
+
+
+def _init_worker(*init_args):
+    """Inizializzazione dei processi del pool: i limiti sui thread restano
+    per tutta la vita del processo, che esiste solo per lo scoring"""
+    global _RUNTIME
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = '1'
+    _single_thread()
+    _RUNTIME = _load_runtime(*init_args)
+
+
+def _score_rows(header, rows, offset, with_id, write_header, runtime=None):
+    """Predice un blocco di righe CSV e restituisce (testo CSV, righe, errori)"""
+    runtime = runtime or _RUNTIME
+    records = [dict(zip(header, row)) for row in rows]
+    proba, valid_index, errors = score_chunk(runtime, records)
+    formatter = CsvFormatter(runtime.target_classes, with_id=with_id,
+                             write_header=write_header)
+    return (formatter.format_chunk(records, offset, proba, valid_index, errors),
+            len(records), len(errors))
+
+
+def score_csv(input_path, output_path, version, engine='sklearn', workers=None,
+              chunk_size=10000, mmap=False, registry_dir='models',
+              compiled_dir='compiled_model', progress_every=2.0):
+    """Scoring di input_path in output_path; restituisce (righe, errori, secondi)"""
+    workers = workers or os.cpu_count() or 1
+    init_args = (version, engine, mmap, registry_dir, compiled_dir)
+    start = time.perf_counter()
+    last_report = start
+    n_rows = n_errors = 0
+
+    def report(final=False):
+        elapsed = time.perf_counter() - start
+        rate = n_rows / elapsed if elapsed > 0 else 0.0
+        end = '\n' if final else '\r'
+        print(f"   {n_rows} righe ({n_errors} errori), {rate:,.0f} righe/s",
+              end=end, file=sys.stderr, flush=True)
+
+    with open(input_path, 'rb') as f_in, open(output_path, 'w', newline='') as f_out:
+        reader = csv.reader(iter_text_lines(f_in))
+        header = next(reader, None)
+        if not header:
+            raise ValueError(f"'{input_path}' è vuoto: manca l'intestazione del CSV")
+        with_id = 'ID' in header
+        chunks = iter_chunks(reader, chunk_size)
+
+        if workers == 1:
+            # Nel processo del chiamante: il limite sui thread vale solo
+            # durante lo scoring (un context manager, niente variabili
+            # d'ambiente) e il modello non finisce nella globale dei worker
+            score_rows = partial(_score_rows, runtime=_load_runtime(*init_args))
+            limits = _single_thread()
+            submit = None
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=init_args)
+            limits = nullcontext()
+            submit = pool.submit
+
+        # Al massimo due blocchi in volo per processo: memoria costante, e i
+        # risultati vengono scritti nell'ordine dei blocchi
+        pending = deque()
+        offset = 0
+        try:
+            with limits:
+                for chunk in chunks:
+                    args = (header, chunk, offset, with_id, offset == 0)
+                    offset += len(chunk)
+                    if submit is None:
+                        pending.append(score_rows(*args))
+                    else:
+                        pending.append(submit(_score_rows, *args))
+                    while pending and (submit is None or len(pending) >= 2 * workers):
+                        item = pending.popleft()
+                        text, rows, errors = item if submit is None else item.result()
+                        f_out.write(text)
+                        n_rows += rows
+                        n_errors += errors
+                        if time.perf_counter() - last_report >= progress_every:
+                            last_report = time.perf_counter()
+                            report()
+                if offset == 0:
+                    # Solo l'intestazione: il file di uscita ha comunque la sua
+                    args = (header, [], 0, with_id, True)
+                    pending.append(score_rows(*args) if submit is None
+                                   else submit(_score_rows, *args))
+                while pending:
+                    item = pending.popleft()
+                    text, rows, errors = item if submit is None else item.result()
+                    f_out.write(text)
+                    n_rows += rows
+                    n_errors += errors
+        finally:
+            if submit is not None:
+                pool.shutdown(cancel_futures=True)
+
+    report(final=True)
+    return n_rows, n_errors, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Scoring offline di un CSV di studenti con un pool di processi'
+    )
+    parser.add_argument('input', help='CSV con intestazione (come student_pe_performance.csv)')
+    parser.add_argument('output', help='CSV di uscita con predizioni e probabilità')
+    parser.add_argument('--version', default=None,
+                        help="versione del modello (default: models/ACTIVE, poi 'improved')")
+    parser.add_argument('--engine', default=os.environ.get('INFERENCE_ENGINE', 'sklearn'),
+                        choices=['sklearn', 'compiled', 'binned'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='processi del pool (default: uno per core)')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--mmap', action='store_true',
+                        help='modello compilato mappato in memoria e condiviso tra i processi')
+    parser.add_argument('--registry-dir', default=os.environ.get('MODEL_REGISTRY_DIR', 'models'))
+    parser.add_argument('--compiled-dir', default=os.environ.get('COMPILED_MODEL_DIR', 'compiled_model'))
+    args = parser.parse_args()
+
+    registry = ModelRegistry(root=args.registry_dir, engine=args.engine,
+                             compiled_root=args.compiled_dir)
+    version = registry.initial_version(args.version)
+    print(f"📊 Scoring di '{args.input}' con il modello '{version}' "
+          f"({args.engine}, {args.workers} processi)")
+    try:
+        n_rows, n_errors, elapsed = score_csv(
+            args.input, args.output, version, engine=args.engine, workers=args.workers,
+            chunk_size=args.chunk_size, mmap=args.mmap, registry_dir=args.registry_dir,
+            compiled_dir=args.compiled_dir
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"✅ {n_rows} righe in {elapsed:.1f} s ({n_rows / elapsed:,.0f} righe/s), "
+          f"{n_errors} errori -> '{args.output}'")
@@ -0,0 +1,256 @@
+import multiprocessing
+import os
+import queue
+import random
+import threading
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+
+class ShadowScorer:
+    """Confronto dei modelli candidati sul traffico reale, fuori dal percorso della richiesta.
+
+    Una frazione `sample_rate` degli input di /api/predict viene accodata
+    (una put non bloccante: se la coda è piena la riga viene scartata e
+    contata) insieme alla risposta del modello attivo. Un processo separato
+    raccoglie fino a `max_batch_size` righe, le predice con ogni candidato
+    con una sola chiamata per modello, ciascuno con il proprio
+    preprocessing, e aggiorna per ogni candidato accordo con il modello
+    attivo, differenze di confidenza e latenza.
+
+    Un processo e non un thread: l'inferenza dei candidati non contende il
+    GIL alle richieste, e gira con priorità ridotta (`niceness`) per non
+    rubare CPU al modello attivo. Il processo è creato con spawn (non fork:
+    il worker ha già altri thread e i loro lock) da start(), all'avvio del
+    worker; riceve solo le opzioni del registro e i nomi delle versioni e
+    carica lui i candidati.
+    """
+
+    def __init__(self, registry_options, versions, sample_rate=0.1, max_queue=1000,
+                 max_batch_size=256, history=10000, stats_timeout=2.0, niceness=10):
+        self.registry_options = dict(registry_options)
+        self.versions = list(versions)
+        self.sample_rate = float(sample_rate)
+        self.max_queue = int(max_queue)
+        self.max_batch_size = int(max_batch_size)
+        self.history = history
+        self.stats_timeout = stats_timeout
+        self.niceness = int(niceness)
+        self._lock = threading.Lock()
+        self._queue = None
+        self._conn = None
+        self._process = None
+        self._pid = None
+        self._starting_pid = None
+        self.n_sampled = 0
+        self.n_dropped = 0
+        self._stats_requests = 0
+
+    def start(self):
+        """Avvia il processo ombra di questo worker (una volta per processo)"""
+        if multiprocessing.parent_process() is not None:
+            # Già in un processo figlio di multiprocessing: niente processo
+            # ombra annidato
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            context = multiprocessing.get_context('spawn')
+            rows = context.Queue(maxsize=self.max_queue)
+            conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_worker_main, name='shadow-scorer', daemon=True,
+                args=(self.registry_options, self.versions, self.max_batch_size,
+                      self.history, self.niceness, rows, child_conn),
+            )
+            process.start()
+            self._queue, self._conn, self._process = rows, conn, process
+            self.n_sampled = self.n_dropped = 0
+            # Per ultimo: da qui submit() usa la nuova coda
+            self._pid = os.getpid()
+
+    def _start_in_background(self):
+        with self._lock:
+            if self._starting_pid == os.getpid():
+                return
+            self._starting_pid = os.getpid()
+        threading.Thread(target=self.start, name='shadow-start', daemon=True).start()
+
+    def submit(self, payload, result, primary_version, latency_ms):
+        """Accoda (con probabilità sample_rate) un input e la risposta del
+        modello attivo. Non blocca mai: restituisce True se la riga è accodata"""
+        if not self.versions or random.random() >= self.sample_rate:
+            return False
+        if self._pid != os.getpid():
+            # Processo non ancora avviato in questo worker (es. creato con fork
+            # dopo l'import): parte in un thread, la riga non viene campionata
+            self._start_in_background()
+            return False
+        try:
+            self._queue.put_nowait((payload, result, primary_version, latency_ms))
+        except queue.Full:
+            self.n_dropped += 1
+            return False
+        self.n_sampled += 1
+        return True
+
+    def stats(self):
+        """Report per modello candidato, esposto da /api/shadow"""
+        report = {
+            'candidates': self.versions,
+            'sample_rate': self.sample_rate,
+            'sampled': self.n_sampled,
+            'dropped': self.n_dropped,
+            'worker_alive': self._process is not None and self._process.is_alive(),
+        }
+        if not report['worker_alive'] or self._pid != os.getpid():
+            return report
+        with self._lock:
+            # Ogni richiesta ha un id: le risposte arrivate dopo il timeout di
+            # una richiesta precedente sono scartate, non restituite al posto
+            # di quella attuale
+            self._stats_requests += 1
+            request_id = self._stats_requests
+            self._conn.send(request_id)
+            deadline = time.monotonic() + self.stats_timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._conn.poll(remaining):
+                    return {**report, 'error': 'Il processo ombra non risponde'}
+                reply_id, stats = self._conn.recv()
+                if reply_id == request_id:
+                    return {**report, **stats}
+
+
+def _worker_main(registry_options, versions, max_batch_size, history, niceness, rows, conn):
+    """Processo ombra: predice le righe accodate e risponde alle richieste di report"""
+    from model_registry import ModelRegistry
+    registry = ModelRegistry(**registry_options)
+    # Priorità più bassa: sui core condivisi lo scheduler preferisce le richieste
+    os.nice(niceness)
+    stats_lock = threading.Lock()
+    models = {version: _ModelStats(history) for version in versions}
+    primary_latency_ms = deque(maxlen=history)
+    primary_versions = Counter()
+
+    def serve_stats():
+        while True:
+            request_id = conn.recv()
+            with stats_lock:
+                conn.send((request_id, {
+                    'primary_versions': dict(primary_versions),
+                    'primary_latency_ms': _latency_summary(np.asarray(primary_latency_ms)),
+                    'models': {version: stats.report() for version, stats in models.items()},
+                }))
+
+    threading.Thread(target=serve_stats, name='shadow-stats', daemon=True).start()
+
+    candidates = {}
+    for version in versions:
+        try:
+            runtime = registry.load(version)
+            runtime.warmup()
+            candidates[version] = runtime
+        except Exception as e:
+            with stats_lock:
+                models[version].load_error = str(e)
+            print(f"❌ Modello ombra '{version}' non caricato: {e}")
+
+    while True:
+        batch = [rows.get()]
+        while len(batch) < max_batch_size:
+            try:
+                batch.append(rows.get_nowait())
+            except queue.Empty:
+                break
+        payloads = [item[0] for item in batch]
+        for version, runtime in candidates.items():
+            try:
+                start = time.perf_counter()
+                encoded, valid_index, errors = runtime.preprocessor.encode_many(payloads)
+                proba = (runtime.predict_proba(runtime.preprocessor.scale_inplace(encoded))
+                         if valid_index else np.empty((0, len(runtime.target_classes))))
+                elapsed_ms = (time.perf_counter() - start) * 1000
+            except Exception as e:
+                with stats_lock:
+                    models[version].n_errors += len(batch)
+                    models[version].last_error = str(e)
+                continue
+            primary = [batch[i][1] for i in valid_index]
+            with stats_lock:
+                models[version].update(primary, proba, runtime.target_classes,
+                                       len(errors), elapsed_ms)
+        with stats_lock:
+            primary_latency_ms.extend(item[3] for item in batch)
+            primary_versions.update(item[2] for item in batch)
+
+
+class _ModelStats:
+    """Aggregati di un candidato rispetto al modello attivo"""
+
+    def __init__(self, history):
+        self.n_scored = 0
+        self.n_errors = 0
+        self.n_agree = 0
+        self.confidence_delta_sum = 0.0
+        self.confidence_delta_abs_sum = 0.0
+        self.max_proba_delta_sum = 0.0
+        self.transitions = Counter()
+        self.batch_latency_ms = deque(maxlen=history)
+        self.total_ms = 0.0
+        self.total_rows = 0
+        self.load_error = None
+        self.last_error = None
+
+    def update(self, primary, proba, classes, n_errors, elapsed_ms):
+        self.n_errors += n_errors
+        self.batch_latency_ms.append(elapsed_ms)
+        self.total_ms += elapsed_ms
+        self.total_rows += len(primary) + n_errors
+        if not primary:
+            return
+        predicted = proba.argmax(axis=1)
+        confidence = proba.max(axis=1)
+        for result, row, best, conf in zip(primary, proba, predicted, confidence):
+            candidate_class = classes[best]
+            self.n_agree += candidate_class == result['prediction']
+            self.transitions[(result['prediction'], candidate_class)] += 1
+            delta = float(conf) - result['confidence']
+            self.confidence_delta_sum += delta
+            self.confidence_delta_abs_sum += abs(delta)
+            self.max_proba_delta_sum += max(
+                abs(float(row[k]) - result['probabilities'].get(c, 0.0))
+                for k, c in enumerate(classes)
+            )
+        self.n_scored += len(primary)
+
+    def report(self):
+        n = self.n_scored
+        return {
+            'scored': n,
+            'errors': self.n_errors,
+            'agreement_rate': self.n_agree / n if n else None,
+            'confidence_delta_mean': self.confidence_delta_sum / n if n else None,
+            'confidence_delta_abs_mean': self.confidence_delta_abs_sum / n if n else None,
+            'max_probability_delta_mean': self.max_proba_delta_sum / n if n else None,
+            # Lista: jsonify ordina le chiavi, così restano in ordine di frequenza
+            'transitions': [
+                {'primary': p, 'candidate': c, 'count': count}
+                for (p, c), count in self.transitions.most_common()
+            ],
+            # Preprocessing e inferenza di un blocco di righe accodate
+            'latency_ms_per_batch': _latency_summary(np.asarray(self.batch_latency_ms)),
+            'latency_ms_per_row': self.total_ms / self.total_rows if self.total_rows else None,
+            'load_error': self.load_error,
+            'last_error': self.last_error,
+        }
+
+
+def _latency_summary(values):
+    if not len(values):
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'mean': float(values.mean()), 'p50': float(p50), 'p95': float(p95),
+            'p99': float(p99)}
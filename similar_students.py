@@ -0,0 +1,165 @@
+import threading
+import time
+
+import numpy as np
+
+from preprocessing import FastPreprocessor
+
+# Indici disponibili (classi di sklearn.neighbors, importate solo se servono)
+INDEX_TYPES = {'kd_tree': 'KDTree', 'ball_tree': 'BallTree'}
+
+
+class SimilarStudents:
+    """Indice spaziale degli studenti di riferimento nello spazio standardizzato del modello.
+
+    Le righe di riferimento sono codificate e standardizzate con i parametri
+    di una versione del modello e inserite in un KD-tree (o ball-tree): una
+    ricerca dei k più vicini costa circa O(k log n) invece di una scansione
+    di tutte le righe, e un batch di studenti è una sola chiamata a query.
+    """
+
+    def __init__(self, preprocessor, X, reference, labels, algorithm='kd_tree', leaf_size=40):
+        if algorithm not in INDEX_TYPES:
+            raise ValueError(f'Indice sconosciuto: {algorithm} (disponibili: {", ".join(INDEX_TYPES)})')
+        self.preprocessor = preprocessor
+        self.reference = reference
+        self.labels = labels
+        self.algorithm = algorithm
+        from sklearn import neighbors
+        self.tree = getattr(neighbors, INDEX_TYPES[algorithm])(X, leaf_size=leaf_size)
+
+    @classmethod
+    def build(cls, frame, params, target='Performance', algorithm='kd_tree', leaf_size=40):
+        """Indice del DataFrame di riferimento con i parametri di preprocessing
+        di una versione (preprocessing_params): sempre standardizzato, anche
+        per i motori con lo scaler incorporato nelle soglie."""
+        preprocessor = FastPreprocessor.from_params(params, scaled=True)
+        X, valid = encode_frame(preprocessor, frame)
+        reference = frame[valid].reset_index(drop=True)
+        return cls(preprocessor, preprocessor.scale_inplace(X), reference,
+                   reference[target].astype(str).to_numpy(), algorithm, leaf_size)
+
+    def __len__(self):
+        return len(self.reference)
+
+    def query(self, X, k):
+        """(distanze, indici) dei k vicini di ogni riga codificata (non standardizzata)"""
+        X = self.preprocessor.scale_inplace(np.array(X, dtype=np.float64))
+        return self.tree.query(X, k=min(k, len(self)))
+
+    def neighbors(self, distances, indices):
+        """Vicini di ogni riga per la risposta JSON (id, distanza, etichetta e
+        feature), letti dal riferimento con un solo accesso per tutto il batch"""
+        flat = indices.ravel()
+        rows = self.reference.iloc[flat]
+        features = rows[self.preprocessor.feature_columns].to_dict('records')
+        ids = rows['ID'].tolist() if 'ID' in rows else flat.tolist()
+        items = [
+            {'id': i, 'distance': d, 'performance': label,
+             'features': {col: _plain(v) for col, v in row.items()}}
+            for i, d, label, row in zip(ids, distances.ravel().tolist(),
+                                        self.labels[flat].tolist(), features)
+        ]
+        k = indices.shape[1]
+        return [items[start:start + k] for start in range(0, len(items), k)]
+
+
+class ReferenceSet:
+    """Dataset di riferimento con un indice per ogni spazio standardizzato.
+
+    Niente viene letto alla creazione: CSV e indice sono costruiti alla prima
+    richiesta, in un thread separato (index_nowait) o in modo sincrono
+    (index, per gli script). Versioni del modello con gli stessi parametri
+    di preprocessing (es. 'original' e 'calibrated') condividono l'indice.
+    """
+
+    def __init__(self, path, algorithm='kd_tree', leaf_size=40):
+        if algorithm not in INDEX_TYPES:
+            raise ValueError(f'Indice sconosciuto: {algorithm} (disponibili: {", ".join(INDEX_TYPES)})')
+        self.path = path
+        self.algorithm = algorithm
+        self.leaf_size = leaf_size
+        self.frame = None
+        self.error = None
+        self.build_ms = None
+        self._indexes = {}
+        self._building = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(params):
+        return repr((params['categories'], params['mean'], params['scale'],
+                     params['feature_columns']))
+
+    def index(self, params):
+        """Indice per i parametri dati, costruito ora se manca"""
+        key = self._key(params)
+        index = self._indexes.get(key)
+        if index is None:
+            index = self._publish(key, self._build(params))
+        return index
+
+    def index_nowait(self, params):
+        """Indice per i parametri dati, oppure None se non è ancora pronto: in
+        quel caso la costruzione parte (una volta sola) in background"""
+        key = self._key(params)
+        index = self._indexes.get(key)
+        if index is not None:
+            return index
+        with self._lock:
+            if key not in self._building and key not in self._indexes:
+                self._building.add(key)
+                threading.Thread(target=self._build_in_background, args=(key, params),
+                                 name='similar-index', daemon=True).start()
+        return self._indexes.get(key)
+
+    def _build_in_background(self, key, params):
+        try:
+            self._publish(key, self._build(params))
+            self.error = None
+        except Exception as e:
+            self.error = f'Indice degli studenti simili non disponibile: {e}'
+            print(f"❌ {self.error}")
+        finally:
+            with self._lock:
+                self._building.discard(key)
+
+    def _build(self, params):
+        # Fuori dal lock: lettura del CSV e costruzione dell'albero possono
+        # durare secondi e index_nowait deve rispondere subito (503)
+        started = time.perf_counter()
+        frame = self.frame
+        if frame is None:
+            import pandas as pd
+            frame = self.frame = pd.read_csv(self.path)
+        index = SimilarStudents.build(frame, params, algorithm=self.algorithm,
+                                      leaf_size=self.leaf_size)
+        self.build_ms = (time.perf_counter() - started) * 1000
+        return index
+
+    def _publish(self, key, index):
+        """Rende visibile l'indice; se un'altra costruzione è arrivata prima,
+        restituisce quella"""
+        with self._lock:
+            return self._indexes.setdefault(key, index)
+
+
+def encode_frame(preprocessor, frame):
+    """Codifica vettoriale di un DataFrame con le regole di encode_into
+    (categoria sconosciuta -> primo codice). Restituisce (X, valid): le righe
+    con tutti i valori numerici finiti e la loro maschera sul DataFrame."""
+    import pandas as pd
+    X = np.empty((len(frame), preprocessor.n_features), dtype=np.float64)
+    for j, col in enumerate(preprocessor.feature_columns):
+        codes = preprocessor.category_codes.get(col)
+        if codes is not None:
+            X[:, j] = frame[col].map(codes).fillna(0).to_numpy(dtype=np.float64)
+        else:
+            X[:, j] = pd.to_numeric(frame[col], errors='coerce').to_numpy(dtype=np.float64)
+    valid = np.isfinite(X).all(axis=1)
+    return X[valid], valid
+
+
+def _plain(value):
+    return value.item() if isinstance(value, np.generic) else value
+
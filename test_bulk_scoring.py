@@ -0,0 +1,56 @@
+import io
+import unittest
+
+import numpy as np
+
+from bulk_scoring import (CsvFormatter, NdjsonFormatter, iter_chunks, iter_csv_records,
+                          iter_ndjson_records, iter_text_lines)
+
+CLASSES = ['High', 'Low']
+
+
+def format_prediction(proba, classes):
+    return {'prediction': classes[int(np.argmax(proba))]}
+
+
+class CsvFormatterTest(unittest.TestCase):
+
+    def test_header_written_once(self):
+        formatter = CsvFormatter(CLASSES)
+        records = [{'ID': '7'}, {'ID': '8'}]
+        first = formatter.format_chunk(records, 0, np.array([[0.9, 0.1]]), [0], {1: 'errore'})
+        self.assertEqual(first.splitlines(), [
+            'index,ID,prediction,confidence,prob_High,prob_Low,error',
+            '0,7,High,0.9,0.9,0.1,',
+            '1,8,,,,,errore',
+        ])
+        second = formatter.format_chunk(records[:1], 2, np.array([[0.2, 0.8]]), [0], {})
+        self.assertEqual(second, '2,7,Low,0.8,0.2,0.8,\n')
+        self.assertEqual(formatter.format_header(), '')
+
+    def test_header_without_rows(self):
+        self.assertEqual(CsvFormatter(CLASSES).format_header(with_id=True),
+                         'index,ID,prediction,confidence,prob_High,prob_Low,error\n')
+        self.assertEqual(CsvFormatter(CLASSES).format_header(),
+                         'index,prediction,confidence,prob_High,prob_Low,error\n')
+        self.assertEqual(CsvFormatter(CLASSES, write_header=False).format_header(), '')
+        self.assertEqual(NdjsonFormatter(CLASSES, format_prediction).format_header(), '')
+
+
+class ReadersTest(unittest.TestCase):
+
+    def test_csv_header_only(self):
+        records = iter_csv_records(iter_text_lines(io.BytesIO(b'ID,Age\r\n')))
+        self.assertEqual(list(iter_chunks(records, 10)), [])
+        self.assertEqual(records.fieldnames, ['ID', 'Age'])
+
+    def test_ndjson_invalid_lines(self):
+        lines = iter_text_lines(io.BytesIO(b'{"Age": 15}\n\nnot json\n'))
+        self.assertEqual(list(iter_ndjson_records(lines)), [{'Age': 15}, None])
+
+    def test_chunks(self):
+        self.assertEqual(list(iter_chunks(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+
+if __name__ == '__main__':
+    unittest.main()
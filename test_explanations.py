@@ -0,0 +1,86 @@
+import unittest
+
+import numpy as np
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import StandardScaler
+
+from explanations import TreeExplainer, format_explanation
+from test_tree_engine import make_data
+from tree_engine import compile_model, forest_weights, quantize
+
+
+class TreeExplainerTest(unittest.TestCase):
+    """base + somma dei contributi = probabilità della foresta"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.raw, cls.y = make_data()
+        cls.scaler = StandardScaler().fit(cls.raw)
+        cls.X = cls.scaler.transform(cls.raw)
+        cls.n_features = cls.X.shape[1]
+        cls.forest = RandomForestClassifier(n_estimators=15, max_depth=6, random_state=0)
+        cls.forest.fit(cls.X, cls.y)
+
+    def assert_additive(self, explainer, X, expected):
+        for k in range(expected.shape[1]):
+            base, contrib = explainer.explain(X, k)
+            np.testing.assert_allclose(base + contrib.sum(axis=1), expected[:, k],
+                                       rtol=0, atol=1e-12)
+
+    def test_additive_for_every_class(self):
+        explainer = TreeExplainer.from_model(self.forest, n_features=self.n_features)
+        self.assert_additive(explainer, self.X, self.forest.predict_proba(self.X))
+
+    def test_class_index_per_row(self):
+        explainer = TreeExplainer.from_model(self.forest, n_features=self.n_features)
+        proba = self.forest.predict_proba(self.X)
+        predicted = proba.argmax(axis=1)
+        base, contrib = explainer.explain(self.X, predicted)
+        np.testing.assert_allclose(base + contrib.sum(axis=1),
+                                   proba[np.arange(len(self.X)), predicted], rtol=0, atol=1e-12)
+
+    def test_blocks_give_same_result(self):
+        explainer = TreeExplainer.from_model(self.forest, n_features=self.n_features)
+        expected = explainer.contributions(self.X, 1)
+        explainer.BLOCK_ELEMENTS = 7 * explainer.forest.n_trees * self.n_features
+        np.testing.assert_array_equal(explainer.contributions(self.X, 1), expected)
+
+    def test_single_row(self):
+        explainer = TreeExplainer.from_model(self.forest, n_features=self.n_features)
+        base, contrib = explainer.explain(self.X[:1], 2)
+        self.assertEqual(contrib.shape, (1, self.n_features))
+        self.assertAlmostEqual(float(base[0] + contrib.sum()),
+                               float(self.forest.predict_proba(self.X[:1])[0, 2]), places=12)
+
+    def test_binned_model_on_raw_input(self):
+        binned = quantize(compile_model(self.forest), self.scaler)
+        explainer = TreeExplainer.from_model(binned, n_features=self.n_features)
+        self.assert_additive(explainer, self.raw, self.forest.predict_proba(self.X))
+
+    def test_calibrated_explains_uncalibrated_forests(self):
+        model = CalibratedClassifierCV(
+            RandomForestClassifier(n_estimators=10, max_depth=5, random_state=0),
+            method='isotonic', cv=3,
+        ).fit(self.X, self.y)
+        explainer = TreeExplainer.from_model(model, n_features=self.n_features)
+        forest, weights = forest_weights(model)
+        expected = np.einsum('rtc,t->rc', forest.proba[forest.apply(self.X)], weights)
+        self.assert_additive(explainer, self.X, expected)
+
+    def test_unused_feature_has_no_contribution(self):
+        X = np.column_stack((self.X, np.zeros(len(self.X))))
+        forest = RandomForestClassifier(n_estimators=5, max_depth=4, random_state=0).fit(X, self.y)
+        explainer = TreeExplainer.from_model(forest, n_features=X.shape[1])
+        self.assertFalse(explainer.contributions(X, 0)[:, -1].any())
+
+    def test_format_explanation(self):
+        explanation = format_explanation(0.3, np.array([0.05, -0.2, 0.1]), 'High',
+                                         feature_names=['a', 'b', 'c'])
+        self.assertEqual(explanation['class'], 'High')
+        self.assertEqual([c['feature'] for c in explanation['contributions']], ['b', 'c', 'a'])
+        self.assertAlmostEqual(explanation['explained_probability'], 0.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
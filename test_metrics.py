@@ -0,0 +1,158 @@
+import re
+import unittest
+
+from metrics import MetricsRegistry, StageTimer
+
+# Una riga di campione nel formato testo di Prometheus: nome, etichette opzionali, valore
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})? (\S+)$')
+
+
+def parse(text):
+    """Righe HELP/TYPE per metrica e valori dei campioni per (nome, etichette)"""
+    assert text.endswith('\n')
+    types, samples = {}, {}
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            continue
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            types[name] = kind
+            continue
+        match = SAMPLE.match(line)
+        assert match, f'riga non valida: {line!r}'
+        name, labels, value = match.groups()
+        samples[name, labels or ''] = float(value)
+    return types, samples
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = MetricsRegistry()
+        self.stages = self.metrics.histogram('stage_seconds', 'Durata delle fasi',
+                                             ('endpoint', 'stage'), buckets=(0.01, 0.1, 1.0))
+        self.requests = self.metrics.counter('requests_total', 'Richieste per esito',
+                                             ('endpoint', 'outcome'))
+
+    def test_help_and_type_precede_the_samples(self):
+        self.stages.observe(0.5, 'predict', 'model')
+        self.requests.inc('predict', 'ok')
+        lines = self.metrics.render().splitlines()
+        self.assertEqual(lines[:2], ['# HELP stage_seconds Durata delle fasi',
+                                     '# TYPE stage_seconds histogram'])
+        start = lines.index('# HELP requests_total Richieste per esito')
+        self.assertEqual(lines[start + 1], '# TYPE requests_total counter')
+        self.assertTrue(all(line.startswith('stage_seconds_') for line in lines[2:start]))
+        self.assertEqual(lines[start + 2:], ['requests_total{endpoint="predict",outcome="ok"} 1'])
+
+    def test_histogram_buckets_are_cumulative(self):
+        for value in (0.005, 0.01, 0.05, 0.5, 2.0):
+            self.stages.observe(value, 'predict', 'model')
+        self.stages.observe(0.2, 'batch', 'model')
+        types, samples = parse(self.metrics.render())
+        self.assertEqual(types['stage_seconds'], 'histogram')
+
+        # Il limite è incluso nel bucket (le = "less or equal")
+        labels = 'endpoint="predict",stage="model"'
+        for bound, expected in (('0.01', 2), ('0.1', 3), ('1.0', 4), ('+Inf', 5)):
+            self.assertEqual(samples['stage_seconds_bucket', f'{{{labels},le="{bound}"}}'],
+                             expected)
+        self.assertEqual(samples['stage_seconds_count', f'{{{labels}}}'], 5)
+        self.assertAlmostEqual(samples['stage_seconds_sum', f'{{{labels}}}'], 2.565)
+
+        # Ogni serie ha i propri bucket, _sum e _count
+        labels = 'endpoint="batch",stage="model"'
+        for bound, expected in (('0.01', 0), ('0.1', 0), ('1.0', 1), ('+Inf', 1)):
+            self.assertEqual(samples['stage_seconds_bucket', f'{{{labels},le="{bound}"}}'],
+                             expected)
+        self.assertEqual(samples['stage_seconds_count', f'{{{labels}}}'], 1)
+        self.assertAlmostEqual(samples['stage_seconds_sum', f'{{{labels}}}'], 0.2)
+
+    def test_counter_series_per_label_values(self):
+        self.requests.inc('predict', 'ok')
+        self.requests.inc('predict', 'ok')
+        self.requests.inc('predict', 'invalid')
+        self.requests.inc('batch', 'ok', amount=5)
+        types, samples = parse(self.metrics.render())
+        self.assertEqual(types['requests_total'], 'counter')
+        counters = {labels: value for (name, labels), value in samples.items()
+                    if name == 'requests_total'}
+        self.assertEqual(counters, {
+            '{endpoint="batch",outcome="ok"}': 5,
+            '{endpoint="predict",outcome="invalid"}': 1,
+            '{endpoint="predict",outcome="ok"}': 2,
+        })
+
+    def test_label_values_are_escaped(self):
+        self.requests.inc('a"b', 'x\\y\nz')
+        _, samples = parse(self.metrics.render())
+        self.assertIn(('requests_total', r'{endpoint="a\"b",outcome="x\\y\nz"}'), samples)
+
+    def test_extra_lines(self):
+        text = self.metrics.render([('cache_size', 'gauge', 'Voci in cache', 3)])
+        self.assertTrue(text.endswith('# HELP cache_size Voci in cache\n'
+                                      '# TYPE cache_size gauge\n'
+                                      'cache_size 3\n'))
+
+    def test_stage_timer_labels(self):
+        timer = StageTimer(self.stages, 'predict')
+        timer.mark('parse')
+        timer.mark('model')
+        timer.mark('model')
+        _, samples = parse(self.metrics.render())
+        counts = {labels: value for (name, labels), value in samples.items()
+                  if name == 'stage_seconds_count'}
+        self.assertEqual(counts, {'{endpoint="predict",stage="model"}': 2,
+                                  '{endpoint="predict",stage="parse"}': 1})
+        total = sum(value for (name, _), value in samples.items() if name == 'stage_seconds_sum')
+        self.assertLessEqual(total, timer.elapsed())
+
+
+class MetricsEndpointTest(unittest.TestCase):
+    """/metrics dell'app dopo una richiesta di predizione"""
+
+    @classmethod
+    def setUpClass(cls):
+        import app
+        cls.client = app.app.test_client()
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        return parse(response.get_data(as_text=True))
+
+    def test_predict_request_is_recorded(self):
+        _, before = self.scrape()
+        # Corpo vuoto: la richiesta termina dopo la fase 'parse' con esito 'invalid'
+        response = self.client.post('/api/predict', json={})
+        self.assertEqual(response.status_code, 400)
+        types, after = self.scrape()
+
+        self.assertEqual(types['pe_request_stage_seconds'], 'histogram')
+        self.assertEqual(types['pe_request_duration_seconds'], 'histogram')
+        self.assertEqual(types['pe_requests_total'], 'counter')
+        self.assertEqual(types['pe_prediction_cache_size'], 'gauge')
+        self.assertEqual(types['pe_request_log_dropped_total'], 'counter')
+
+        def delta(name, labels):
+            return after[name, labels] - before.get((name, labels), 0)
+
+        self.assertEqual(delta('pe_requests_total', '{endpoint="predict",outcome="invalid"}'), 1)
+        stage = 'endpoint="predict",stage="parse"'
+        self.assertEqual(delta('pe_request_stage_seconds_count', f'{{{stage}}}'), 1)
+        self.assertEqual(delta('pe_request_stage_seconds_bucket', f'{{{stage},le="+Inf"}}'), 1)
+        self.assertEqual(delta('pe_request_duration_seconds_count', '{endpoint="predict"}'), 1)
+        self.assertGreater(delta('pe_request_duration_seconds_sum', '{endpoint="predict"}'), 0)
+
+        # Bucket cumulativi: non decrescenti fino a +Inf, che è uguale a _count
+        buckets = [value for (name, labels), value in after.items()
+                   if name == 'pe_request_duration_seconds_bucket'
+                   and labels.startswith('{endpoint="predict",')]
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(buckets[-1],
+                         after['pe_request_duration_seconds_count', '{endpoint="predict"}'])
+
+
+if __name__ == '__main__':
+    unittest.main()
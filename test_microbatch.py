@@ -0,0 +1,120 @@
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from microbatch import MicroBatcher
+
+
+class RecordingModel:
+    """predict_proba fittizia: una riga diversa per ogni riga in ingresso"""
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    def predict_proba(self, X):
+        self.calls.append(X.copy())
+        if self.error is not None:
+            raise self.error
+        return np.column_stack([X[:, 0], 1 - X[:, 0]])
+
+
+def batch_stats(batcher, n_batches, timeout=10):
+    """stats() dopo che il thread di lavoro ha registrato n_batches batch
+    (le statistiche sono aggiornate subito dopo aver risposto)"""
+    deadline = time.monotonic() + timeout
+    while batcher.stats()['batches'] < n_batches and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return batcher.stats()
+
+
+class MicroBatcherTest(unittest.TestCase):
+
+    def test_concurrent_requests_share_one_call(self):
+        model = RecordingModel()
+        n = 8
+        batcher = MicroBatcher(max_batch_size=n, max_wait_ms=5000)
+        results = [None] * n
+        # Tutte le richieste partono insieme; la finestra è lunga, quindi il
+        # batch si chiude solo quando è pieno
+        barrier = threading.Barrier(n)
+
+        def client(i):
+            barrier.wait()
+            results[i] = batcher.predict(np.array([[i / 10, 0.5]]), model.predict_proba,
+                                         timeout=10)
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(n)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(len(model.calls), 1)
+        self.assertEqual(model.calls[0].shape, (n, 2))
+        for i, proba in enumerate(results):
+            np.testing.assert_allclose(proba, [i / 10, 1 - i / 10])
+        stats = batch_stats(batcher, 1)
+        self.assertEqual((stats['requests'], stats['batches']), (n, 1))
+        self.assertEqual(stats['batch_size_distribution'], {str(n): 1})
+
+    def test_rows_are_copied_at_submit(self):
+        model = RecordingModel()
+        batcher = MicroBatcher(max_batch_size=2, max_wait_ms=5000)
+        buffer = np.array([[0.1, 0.0]])
+        first = batcher.submit(buffer, model.predict_proba)
+        buffer[0, 0] = 0.2  # buffer riutilizzato dal chiamante
+        second = batcher.submit(buffer, model.predict_proba)
+        np.testing.assert_allclose(first.result(10), [0.1, 0.9])
+        np.testing.assert_allclose(second.result(10), [0.2, 0.8])
+
+    def test_single_request_flushed_after_max_wait(self):
+        model = RecordingModel()
+        batcher = MicroBatcher(max_batch_size=64, max_wait_ms=50)
+        start = time.perf_counter()
+        proba = batcher.predict(np.array([[0.3, 0.0]]), model.predict_proba, timeout=5)
+        elapsed = time.perf_counter() - start
+        np.testing.assert_allclose(proba, [0.3, 0.7])
+        self.assertGreaterEqual(elapsed, 0.045)
+        self.assertLess(elapsed, 2)
+        self.assertEqual(len(model.calls), 1)
+
+    def test_models_are_not_mixed(self):
+        old, new = RecordingModel(), RecordingModel()
+        batcher = MicroBatcher(max_batch_size=3, max_wait_ms=5000)
+        futures = [batcher.submit(np.array([0.1, 0.0]), old.predict_proba),
+                   batcher.submit(np.array([0.2, 0.0]), new.predict_proba),
+                   batcher.submit(np.array([0.3, 0.0]), old.predict_proba)]
+        self.assertEqual([f.result(10)[0] for f in futures], [0.1, 0.2, 0.3])
+        self.assertEqual([len(c) for c in old.calls + new.calls], [2, 1])
+
+    def test_error_reaches_every_caller(self):
+        error = RuntimeError('modello non disponibile')
+        model = RecordingModel(error=error)
+        batcher = MicroBatcher(max_batch_size=3, max_wait_ms=5000)
+        futures = [batcher.submit(np.array([i, 0.0]), model.predict_proba) for i in range(3)]
+        for future in futures:
+            self.assertIs(future.exception(timeout=10), error)
+        self.assertEqual(batch_stats(batcher, 1)['failed_batches'], 1)
+
+        # Il thread di lavoro sopravvive all'errore
+        model.error = None
+        futures = [batcher.submit(np.array([0.5, 0.0]), model.predict_proba) for _ in range(3)]
+        for future in futures:
+            np.testing.assert_allclose(future.result(timeout=10), [0.5, 0.5])
+
+    def test_missing_rows_are_an_error(self):
+        batcher = MicroBatcher(max_batch_size=2, max_wait_ms=5000)
+
+        def predict_first_row(X):
+            return X[:1]
+
+        futures = [batcher.submit(np.array([i, 0.0]), predict_first_row) for i in range(2)]
+        for future in futures:
+            self.assertIsInstance(future.exception(timeout=10), ValueError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from model_registry import SKLEARN_MIN_BATCH, VERSION_FILES, ModelRegistry, ModelRuntime
+from preprocessing import FEATURE_COLUMNS
+from training_pipeline import preprocess
+
+CSV_PATH = 'student_pe_performance.csv'
+
+
+class ModelRuntimeTest(unittest.TestCase):
+    """Runtime di una versione: motori compilato e a bin, batch grandi a scikit-learn"""
+
+    @classmethod
+    def setUpClass(cls):
+        frame = pd.read_csv(CSV_PATH)
+        X_train, _, y_train, _, cls.scaler, cls.label_encoders = preprocess(frame)
+        cls.model = RandomForestClassifier(n_estimators=10, max_depth=6, random_state=0)
+        cls.model.fit(X_train, y_train)
+        students = frame[FEATURE_COLUMNS].to_dict('records')
+        cls.students = (students * (SKLEARN_MIN_BATCH // len(students) + 1))[:SKLEARN_MIN_BATCH]
+
+    def test_large_batches_go_to_sklearn(self):
+        for engine in ('compiled', 'binned'):
+            with self.subTest(engine=engine):
+                runtime = ModelRuntime.from_sklearn('test', self.model, self.scaler,
+                                                    self.label_encoders, engine=engine)
+                self.assertEqual(runtime.sklearn_min_batch, SKLEARN_MIN_BATCH)
+                X, _, _ = runtime.preprocessor.transform_many(self.students)
+                expected = self.model.predict_proba(self.scaler.transform(X))
+                with mock.patch.object(self.model, 'predict_proba',
+                                       wraps=self.model.predict_proba) as predict_proba:
+                    np.testing.assert_allclose(runtime.predict_proba(X[:-1]), expected[:-1],
+                                               rtol=0, atol=1e-12)
+                    predict_proba.assert_not_called()
+                    np.testing.assert_array_equal(runtime.predict_proba(X), expected)
+                    predict_proba.assert_called_once()
+                # L'input grezzo non viene standardizzato sul posto
+                np.testing.assert_allclose(runtime.predict_proba(X), expected, rtol=0, atol=1e-12)
+
+    def test_no_routing_without_the_sklearn_model(self):
+        runtime = ModelRuntime.from_sklearn('test', self.model, self.scaler,
+                                            self.label_encoders)
+        self.assertIsNone(runtime.sklearn_min_batch)
+        self.assertIsNone(ModelRuntime('test', 'compiled', runtime.model, runtime.preprocessor,
+                                       runtime.params).sklearn_min_batch)
+
+
+class ModelRegistryTest(unittest.TestCase):
+    """Cambio di versione: nomi validi, nessuno scambio se il caricamento fallisce"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.root = os.path.join(cls.tmp.name, 'models')
+        X_train, _, y_train, _, scaler, label_encoders = preprocess(pd.read_csv(CSV_PATH))
+        for version, n_trees in (('v1', 3), ('v2', 5)):
+            model = RandomForestClassifier(n_estimators=n_trees, max_depth=4, random_state=0)
+            model.fit(X_train, y_train)
+            os.makedirs(os.path.join(cls.root, version))
+            for name, artifact in zip(VERSION_FILES, (model, scaler, label_encoders)):
+                joblib.dump(artifact, os.path.join(cls.root, version, name))
+        # Versione con un model.pkl illeggibile
+        os.makedirs(os.path.join(cls.root, 'broken'))
+        for name in VERSION_FILES:
+            with open(os.path.join(cls.root, 'broken', name), 'wb') as f:
+                f.write(b'non un pickle')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        # Ogni test parte senza ACTIVE e con v1 attiva
+        if os.path.exists(os.path.join(self.root, 'ACTIVE')):
+            os.remove(os.path.join(self.root, 'ACTIVE'))
+        self.registry = ModelRegistry(root=self.root,
+                                      compiled_root=os.path.join(self.tmp.name, 'compiled'))
+        self.registry.activate('v1')
+
+    def test_versions(self):
+        self.assertEqual(self.registry.versions()[:3], ['broken', 'v1', 'v2'])
+
+    def test_rejects_paths_and_unknown_versions(self):
+        for version in ('../models/v2', 'v2/', os.path.join(self.root, 'v2'), '..', '.', '',
+                        'v3', None, ['v2']):
+            with self.subTest(version=version), self.assertRaises(FileNotFoundError):
+                self.registry.activate(version, persist=True)
+        self.assertEqual(self.registry.active.version, 'v1')
+        self.assertIsNone(self.registry.read_active_file())
+
+    def test_failed_load_keeps_previous_runtime(self):
+        previous = self.registry.active
+        with self.assertRaises(Exception):
+            self.registry.activate('broken', persist=True)
+        self.assertIs(self.registry.active, previous)
+        self.assertIsNone(self.registry.read_active_file())
+
+    def test_failed_warmup_keeps_previous_runtime(self):
+        previous = self.registry.active
+        with mock.patch.object(ModelRuntime, 'warmup', side_effect=RuntimeError('warmup')):
+            with self.assertRaises(RuntimeError):
+                self.registry.activate('v2', persist=True)
+        self.assertIs(self.registry.active, previous)
+        self.assertIsNone(self.registry.read_active_file())
+
+    def test_swap(self):
+        runtime, previous = self.registry.activate('v2', persist=True)
+        self.assertIs(self.registry.active, runtime)
+        self.assertEqual((runtime.version, previous.version), ('v2', 'v1'))
+        self.assertIsNotNone(runtime.warmup_ms)
+        self.assertEqual(self.registry.read_active_file(), 'v2')
+
+    def test_active_file_change_is_picked_up(self):
+        # Un altro worker scrive ACTIVE
+        other = ModelRegistry(root=self.root)
+        self.assertIsNone(self.registry.check_active_file())
+        other.write_active_file('v2')
+        self.assertEqual(self.registry.check_active_file().version, 'v2')
+        self.assertEqual(self.registry.active.version, 'v2')
+        # Nessun nuovo caricamento se ACTIVE non cambia
+        self.assertIsNone(self.registry.check_active_file())
+
+    def test_watcher_thread(self):
+        self.registry.ensure_watcher(0.01)
+        ModelRegistry(root=self.root).write_active_file('v2')
+        deadline = time.monotonic() + 10
+        while self.registry.active.version != 'v2' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.registry.active.version, 'v2')
+
+
+class AdminEndpointTest(unittest.TestCase):
+    """/api/admin/reload: token obbligatorio e solo versioni del registro"""
+
+    @classmethod
+    def setUpClass(cls):
+        import app
+        cls.app = app
+        cls.client = app.app.test_client()
+
+    def reload(self, version, token='segreto'):
+        with mock.patch.object(self.app, 'ADMIN_TOKEN', 'segreto'), \
+                mock.patch.object(self.app.registry, 'activate') as activate:
+            headers = {'X-Admin-Token': token} if token is not None else {}
+            response = self.client.post('/api/admin/reload', json={'version': version},
+                                        headers=headers)
+        return response, activate
+
+    def test_token_required(self):
+        for token in (None, '', 'sbagliato', 'segreto2'):
+            with self.subTest(token=token):
+                response, activate = self.reload('improved', token)
+                self.assertEqual(response.status_code, 403)
+                activate.assert_not_called()
+
+    def test_disabled_without_admin_token(self):
+        with mock.patch.object(self.app, 'ADMIN_TOKEN', None):
+            response = self.client.post('/api/admin/reload', json={'version': 'improved'},
+                                        headers={'X-Admin-Token': ''})
+        self.assertEqual(response.status_code, 403)
+
+    def test_unknown_versions_are_rejected(self):
+        for version in ('../models/v1', '/etc/passwd', 'inesistente', 42, ['improved']):
+            with self.subTest(version=version):
+                response, activate = self.reload(version)
+                self.assertEqual(response.status_code, 400)
+                activate.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+
+from prediction_cache import PredictionCache
+from preprocessing import FastPreprocessor
+
+PARAMS = {
+    'feature_columns': ['Age', 'Gender', 'BMI'],
+    'categories': {'Gender': ['Female', 'Male']},
+    'mean': None,
+    'scale': None,
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class PredictionCacheTest(unittest.TestCase):
+
+    def test_lru_eviction_order(self):
+        cache = PredictionCache(maxsize=2)
+        cache.put('a', 1, 'm')
+        cache.put('b', 2, 'm')
+        # 'a' letta per ultima: esce 'b', la meno usata di recente
+        self.assertEqual(cache.get('a', 'm'), 1)
+        cache.put('c', 3, 'm')
+        self.assertIsNone(cache.get('b', 'm'))
+        self.assertEqual((cache.get('a', 'm'), cache.get('c', 'm')), (1, 3))
+        # Riscrivere una voce la rende la più recente
+        cache.put('a', 10, 'm')
+        cache.put('d', 4, 'm')
+        self.assertIsNone(cache.get('c', 'm'))
+        self.assertEqual(cache.get('a', 'm'), 10)
+        stats = cache.stats()
+        self.assertEqual((stats['size'], stats['evictions']), (2, 2))
+
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = PredictionCache(maxsize=10, ttl=30, clock=clock)
+        cache.put('a', 1, 'm')
+        clock.now += 29.9
+        self.assertEqual(cache.get('a', 'm'), 1)
+        clock.now += 0.1
+        self.assertIsNone(cache.get('a', 'm'))
+        stats = cache.stats()
+        self.assertEqual((stats['size'], stats['expirations'], stats['hits'], stats['misses']),
+                         (0, 1, 1, 1))
+
+    def test_without_ttl_entries_do_not_expire(self):
+        clock = FakeClock()
+        cache = PredictionCache(maxsize=10, ttl=0, clock=clock)
+        cache.put('a', 1, 'm')
+        clock.now += 1e9
+        self.assertEqual(cache.get('a', 'm'), 1)
+
+    def test_key_normalisation(self):
+        preprocessor = FastPreprocessor.from_params(PARAMS, scaled=False)
+        cache = PredictionCache(precision=6)
+
+        def key(student):
+            return cache.make_key(preprocessor.encode_one(student))
+
+        base = key({'Age': 15, 'Gender': 'Male', 'BMI': 21.5})
+        self.assertEqual(key({'BMI': 21.5, 'Gender': 'Male', 'Age': 15}), base)
+        self.assertEqual(key({'Age': '15', 'Gender': 'Male', 'BMI': '21.50'}), base)
+        self.assertEqual(key({'Age': 15.0, 'Gender': 'Male', 'BMI': 21.5000000001}), base)
+        self.assertNotEqual(key({'Age': 15, 'Gender': 'Male', 'BMI': 21.51}), base)
+        self.assertNotEqual(key({'Age': 15, 'Gender': 'Female', 'BMI': 21.5}), base)
+        # Categoria sconosciuta: stesso codice che vede il modello (la prima)
+        self.assertEqual(key({'Age': 15, 'Gender': 'Altro', 'BMI': 21.5}),
+                         key({'Age': 15, 'Gender': 'Female', 'BMI': 21.5}))
+        self.assertEqual(cache.make_key([-0.0, 0, 1e-9]), cache.make_key([0.0, 0, 0]))
+
+    def test_invalidation_on_model_swap(self):
+        cache = PredictionCache(maxsize=10)
+        cache.put('a', 1, 'v1')
+        cache.put('b', 2, 'v1')
+        self.assertIsNone(cache.get('a', 'v2'))
+        self.assertEqual(cache.stats()['size'], 0)
+        cache.put('a', 3, 'v2')
+        self.assertEqual(cache.get('a', 'v2'), 3)
+        # Una put del vecchio modello (richiesta ancora in corso) non mescola le
+        # voci: svuota la cache, e la lettura successiva del nuovo di nuovo
+        cache.put('b', 2, 'v1')
+        self.assertIsNone(cache.get('a', 'v2'))
+        self.assertIsNone(cache.get('b', 'v2'))
+        self.assertEqual(cache.stats()['invalidations'], 3)
+
+    def test_disabled(self):
+        cache = PredictionCache(maxsize=0)
+        cache.put('a', 1, 'm')
+        self.assertIsNone(cache.get('a', 'm'))
+        self.assertFalse(cache.stats()['enabled'])
+
+
+if __name__ == '__main__':
+    unittest.main()
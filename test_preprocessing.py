@@ -0,0 +1,98 @@
+import unittest
+import warnings
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from model_registry import LEGACY_VERSIONS
+from preprocessing import FEATURE_COLUMNS, FastPreprocessor, preprocessing_params
+
+CSV_PATH = 'student_pe_performance.csv'
+
+
+def pandas_transform(frame, scaler, label_encoders):
+    """Percorso originale: DataFrame, LabelEncoder (categoria sconosciuta ->
+    prima classe) e StandardScaler.transform"""
+    features = frame[FEATURE_COLUMNS].copy()
+    for col, le in label_encoders.items():
+        if col in features:
+            features[col] = features[col].apply(lambda x: x if x in le.classes_ else le.classes_[0])
+            features[col] = le.transform(features[col])
+    return scaler.transform(features)
+
+
+class FastPreprocessorTest(unittest.TestCase):
+    """Stesso risultato, bit per bit, della pipeline pandas/scikit-learn"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.frame = pd.read_csv(CSV_PATH)
+        cls.students = cls.frame[FEATURE_COLUMNS].to_dict('records')
+        cls.artifacts = {}
+        with warnings.catch_warnings():
+            # .pkl salvati con un'altra versione di scikit-learn
+            warnings.simplefilter('ignore')
+            for version in ('improved', 'original'):
+                _, scaler_path, encoders_path = LEGACY_VERSIONS[version]
+                cls.artifacts[version] = joblib.load(scaler_path), joblib.load(encoders_path)
+
+    def preprocessors(self, scaler, label_encoders):
+        yield 'pickle', FastPreprocessor(label_encoders, scaler)
+        yield 'params', FastPreprocessor.from_params(preprocessing_params(label_encoders, scaler))
+
+    def test_full_csv_is_bit_identical(self):
+        for version, (scaler, label_encoders) in self.artifacts.items():
+            expected = pandas_transform(self.frame, scaler, label_encoders)
+            for source, preprocessor in self.preprocessors(scaler, label_encoders):
+                with self.subTest(version=version, source=source):
+                    X, valid_index, errors = preprocessor.transform_many(self.students)
+                    self.assertEqual((valid_index, errors), (list(range(len(self.frame))), {}))
+                    self.assertTrue(np.array_equal(X, expected))
+                    for i in range(0, len(self.students), 50):
+                        row = preprocessor.transform_one(self.students[i])
+                        self.assertTrue(np.array_equal(row[0], expected[i]))
+
+    def test_unknown_category_is_the_first_class(self):
+        scaler, label_encoders = self.artifacts['improved']
+        frame = self.frame.head(3).copy()
+        frame['Gender'] = frame['Gender'].astype(object)
+        frame.loc[1, 'Gender'] = 'Sconosciuto'
+        frame.loc[2, 'Motivation_Level'] = None
+        expected = pandas_transform(frame, scaler, label_encoders)
+        for source, preprocessor in self.preprocessors(scaler, label_encoders):
+            with self.subTest(source=source):
+                X, _, errors = preprocessor.transform_many(frame.to_dict('records'))
+                self.assertEqual(errors, {})
+                self.assertTrue(np.array_equal(X, expected))
+
+    def test_invalid_rows(self):
+        scaler, label_encoders = self.artifacts['improved']
+        preprocessor = FastPreprocessor(label_encoders, scaler)
+        student = self.students[0]
+        missing = {k: v for k, v in student.items() if k != 'BMI'}
+        cases = {
+            'Campo mancante: BMI': missing,
+            "Valore non numerico per Age: 'quindici'": {**student, 'Age': 'quindici'},
+            'Valore non numerico per Age: None': {**student, 'Age': None},
+            'Valore non finito per BMI': {**student, 'BMI': float('nan')},
+            'Valore non valido per Gender': {**student, 'Gender': ['Male']},
+            'Riga non valida': ['non', 'un', 'oggetto'],
+        }
+        for message, row in cases.items():
+            with self.subTest(message=message):
+                with self.assertRaisesRegex(ValueError, message):
+                    preprocessor.transform_one(row)
+
+        # Nel batch le righe non valide sono saltate e riportate per posizione
+        rows = [student, missing, self.students[1], {**student, 'Age': 'x'}]
+        X, valid_index, errors = preprocessor.transform_many(rows)
+        self.assertEqual(valid_index, [0, 2])
+        self.assertEqual(sorted(errors), [1, 3])
+        self.assertEqual(errors[1], 'Campo mancante: BMI')
+        expected = pandas_transform(self.frame.iloc[:2], scaler, label_encoders)
+        self.assertTrue(np.array_equal(X, expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import logging
+import sys
+import threading
+import unittest
+
+from request_log import RequestLogger
+
+
+class RequestLoggerTest(unittest.TestCase):
+
+    def test_dropped_records_are_all_counted(self):
+        # Coda da un record e listener mai avviato: dopo il primo, ogni record è scartato
+        request_log = RequestLogger(name='pe.requests.test', queue_size=1)
+        handler = request_log._queue_handler
+        record = logging.LogRecord(request_log.logger.name, logging.INFO, __file__, 0,
+                                   'msg', None, None)
+        handler.enqueue(record)
+        n_threads, n_records = 8, 2000
+        barrier = threading.Barrier(n_threads)
+
+        def client():
+            barrier.wait()
+            for _ in range(n_records):
+                handler.enqueue(record)
+
+        # Cambi di thread frequenti: con un incremento non protetto si perderebbero conteggi
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=client) for _ in range(n_threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(30)
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(request_log.dropped, n_threads * n_records)
+
+
+if __name__ == '__main__':
+    unittest.main()
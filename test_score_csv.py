@@ -0,0 +1,84 @@
+import csv
+import os
+import tempfile
+import unittest
+
+import joblib
+import pandas as pd
+from threadpoolctl import threadpool_info
+from sklearn.ensemble import RandomForestClassifier
+
+from model_registry import VERSION_FILES
+import score_csv as score_csv_module
+from score_csv import THREAD_ENV_VARS, score_csv
+from training_pipeline import preprocess
+
+CSV_PATH = 'student_pe_performance.csv'
+
+
+class ScoreCsvTest(unittest.TestCase):
+    """Scoring di file CSV da un registro temporaneo con una piccola foresta"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.registry_dir = os.path.join(cls.tmp.name, 'models')
+        X_train, _, y_train, _, scaler, label_encoders = preprocess(pd.read_csv(CSV_PATH))
+        model = RandomForestClassifier(n_estimators=5, max_depth=4, random_state=0)
+        model.fit(X_train, y_train)
+        version_dir = os.path.join(cls.registry_dir, 'test')
+        os.makedirs(version_dir)
+        for name, artifact in zip(VERSION_FILES, (model, scaler, label_encoders)):
+            joblib.dump(artifact, os.path.join(version_dir, name))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def score(self, text, **kwargs):
+        input_path = os.path.join(self.tmp.name, 'input.csv')
+        output_path = os.path.join(self.tmp.name, 'output.csv')
+        with open(input_path, 'w') as f:
+            f.write(text)
+        result = score_csv(input_path, output_path, 'test', workers=1,
+                           registry_dir=self.registry_dir,
+                           compiled_dir=os.path.join(self.tmp.name, 'compiled'), **kwargs)
+        with open(output_path, newline='') as f:
+            return result, list(csv.reader(f))
+
+    def test_rows_in_input_order(self):
+        with open(CSV_PATH) as f:
+            text = ''.join(f.readlines()[:26])
+        (n_rows, n_errors, _), rows = self.score(text, chunk_size=7)
+        self.assertEqual((n_rows, n_errors), (25, 0))
+        self.assertEqual(rows[0][:4], ['index', 'ID', 'prediction', 'confidence'])
+        self.assertEqual([row[0] for row in rows[1:]], [str(i) for i in range(25)])
+
+    def test_empty_file(self):
+        with self.assertRaisesRegex(ValueError, 'intestazione'):
+            self.score('')
+
+    def test_header_only(self):
+        with open(CSV_PATH) as f:
+            header = f.readline()
+        (n_rows, _, _), rows = self.score(header)
+        self.assertEqual(n_rows, 0)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][:3], ['index', 'ID', 'prediction'])
+
+    def test_single_process_leaves_caller_untouched(self):
+        # workers=1 gira nel processo del chiamante: niente variabili d'ambiente,
+        # limiti sui thread o modello globale che sopravvivono alla chiamata
+        env = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+        threads = [pool['num_threads'] for pool in threadpool_info()]
+        with open(CSV_PATH) as f:
+            text = ''.join(f.readlines()[:6])
+        (n_rows, _, _), _ = self.score(text)
+        self.assertEqual(n_rows, 5)
+        self.assertEqual({var: os.environ.get(var) for var in THREAD_ENV_VARS}, env)
+        self.assertEqual([pool['num_threads'] for pool in threadpool_info()], threads)
+        self.assertIsNone(score_csv_module._RUNTIME)
+
+
+if __name__ == '__main__':
+    unittest.main()
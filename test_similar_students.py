@@ -0,0 +1,147 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from preprocessing import FEATURE_COLUMNS, preprocessing_params
+from similar_students import ReferenceSet, SimilarStudents
+from training_pipeline import preprocess
+
+CSV_PATH = 'student_pe_performance.csv'
+
+
+class SimilarStudentsTest(unittest.TestCase):
+    """Vicini dell'indice = vicini della scansione completa"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.frame = pd.read_csv(CSV_PATH)
+        *_, scaler, label_encoders = preprocess(cls.frame)
+        cls.params = preprocessing_params(label_encoders, scaler)
+        cls.students = cls.frame[FEATURE_COLUMNS].to_dict('records')
+
+    def brute_force(self, index, queries, k):
+        X = index.tree.get_arrays()[0]
+        scaled = index.preprocessor.scale_inplace(np.array(queries, dtype=np.float64))
+        distances = np.sqrt(((scaled[:, np.newaxis] - X[np.newaxis]) ** 2).sum(axis=2))
+        return np.sort(distances, axis=1)[:, :k]
+
+    def test_same_neighbors_as_full_scan(self):
+        for algorithm in ('kd_tree', 'ball_tree'):
+            with self.subTest(algorithm=algorithm):
+                index = SimilarStudents.build(self.frame, self.params, algorithm=algorithm)
+                self.assertEqual(len(index), len(self.frame))
+                queries, _, _ = index.preprocessor.encode_many(self.students[:50])
+                distances, indices = index.query(queries, k=5)
+                np.testing.assert_allclose(distances, self.brute_force(index, queries, 5),
+                                           atol=1e-9)
+                # Ogni studente del riferimento è il vicino più prossimo di sé stesso
+                np.testing.assert_allclose(distances[:, 0], 0.0, atol=1e-9)
+
+    def test_k_larger_than_reference(self):
+        index = SimilarStudents.build(self.frame.head(3), self.params)
+        queries, _, _ = index.preprocessor.encode_many(self.students[:2])
+        distances, indices = index.query(queries, k=10)
+        self.assertEqual(indices.shape, (2, 3))
+
+    def test_rows_with_invalid_numbers_are_skipped(self):
+        frame = self.frame.head(20).copy()
+        frame['Age'] = frame['Age'].astype(object)
+        frame.loc[3, 'BMI'] = np.nan
+        frame.loc[7, 'Age'] = 'n/a'
+        index = SimilarStudents.build(frame, self.params)
+        self.assertEqual(len(index), 18)
+        self.assertNotIn(frame.loc[3, 'ID'], index.reference['ID'].tolist())
+
+    def test_neighbors_for_json(self):
+        index = SimilarStudents.build(self.frame, self.params)
+        queries, _, _ = index.preprocessor.encode_many(self.students[:2])
+        neighbors = index.neighbors(*index.query(queries, k=3))
+        self.assertEqual([len(row) for row in neighbors], [3, 3])
+        first = neighbors[0][0]
+        self.assertEqual(first['id'], int(self.frame.loc[0, 'ID']))
+        self.assertEqual(first['performance'], self.frame.loc[0, 'Performance'])
+        self.assertEqual(set(first['features']), set(FEATURE_COLUMNS))
+        self.assertIsInstance(first['features']['Age'], int)
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(ValueError):
+            SimilarStudents.build(self.frame, self.params, algorithm='brute')
+        with self.assertRaises(ValueError):
+            ReferenceSet(CSV_PATH, algorithm='brute')
+
+
+class ReferenceSetTest(unittest.TestCase):
+    """Il CSV e l'indice sono costruiti alla prima richiesta, non alla creazione"""
+
+    @classmethod
+    def setUpClass(cls):
+        *_, scaler, label_encoders = preprocess(pd.read_csv(CSV_PATH))
+        cls.params = preprocessing_params(label_encoders, scaler)
+
+    def wait_for_index(self, reference, params, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if reference.error:
+                return None
+            index = reference.index_nowait(params)
+            if index is not None:
+                return index
+            time.sleep(0.01)
+        self.fail('Indice non costruito in tempo')
+
+    def test_nothing_is_read_at_creation(self):
+        reference = ReferenceSet('does-not-exist.csv')
+        self.assertIsNone(reference.frame)
+        self.assertIsNone(reference.error)
+
+    def test_index_nowait_builds_in_background(self):
+        reference = ReferenceSet(CSV_PATH)
+        self.assertIsNone(reference.index_nowait(self.params))
+        index = self.wait_for_index(reference, self.params)
+        self.assertIsInstance(index, SimilarStudents)
+        self.assertIsNotNone(reference.build_ms)
+        # Stessi parametri di preprocessing: stesso indice
+        self.assertIs(reference.index(dict(self.params)), index)
+
+    def test_index_nowait_does_not_wait_for_a_build(self):
+        reference = ReferenceSet(CSV_PATH)
+        started, release = threading.Event(), threading.Event()
+        build = SimilarStudents.build
+
+        def slow_build(*args, **kwargs):
+            started.set()
+            release.wait(10)
+            return build(*args, **kwargs)
+
+        with mock.patch.object(SimilarStudents, 'build', side_effect=slow_build):
+            self.assertIsNone(reference.index_nowait(self.params))
+            self.assertTrue(started.wait(10))
+            # Costruzione in corso: risposta immediata, nessuna seconda costruzione
+            t0 = time.perf_counter()
+            self.assertIsNone(reference.index_nowait(self.params))
+            self.assertLess(time.perf_counter() - t0, 0.05)
+            release.set()
+            self.assertIsInstance(self.wait_for_index(reference, self.params), SimilarStudents)
+
+    def test_index_per_scaler(self):
+        reference = ReferenceSet(CSV_PATH)
+        other = {**self.params, 'mean': [m + 1 for m in self.params['mean']]}
+        self.assertIsNot(reference.index(self.params), reference.index(other))
+
+    def test_build_error_is_reported(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            reference = ReferenceSet(os.path.join(tmp, 'missing.csv'))
+            self.assertIsNone(self.wait_for_index(reference, self.params))
+            self.assertIn('missing.csv', reference.error)
+            with self.assertRaises(FileNotFoundError):
+                reference.index(self.params)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import tempfile
+import unittest
+import warnings
+
+import numpy as np
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+
+from tree_engine import (compile_model, fold_scaler, is_tree_model, load_compiled, quantize,
+                         save_compiled)
+
+
+def make_data(n=400, seed=0):
+    """Feature intere (come le categorie codificate) e continue con un decimale
+    (come i punteggi del dataset), tre classi"""
+    rng = np.random.default_rng(seed)
+    raw = np.column_stack([
+        rng.integers(0, 4, n),
+        rng.integers(14, 19, n),
+        rng.normal(70, 12, (n, 3)).round(1),
+        rng.uniform(15, 30, n).round(1),
+    ]).astype(np.float64)
+    score = raw[:, 2] + raw[:, 3] - raw[:, 4] + 5 * raw[:, 0] + rng.normal(0, 8, n)
+    y = np.digitize(score, np.percentile(score, [33, 66]))
+    return raw, y
+
+
+class TreeEngineTest(unittest.TestCase):
+    """I motori compilato e a bin riproducono predict_proba di scikit-learn"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.raw, cls.y = make_data()
+        cls.scaler = StandardScaler().fit(cls.raw)
+        cls.X = cls.scaler.transform(cls.raw)
+        cls.forest = RandomForestClassifier(n_estimators=15, max_depth=6, random_state=0)
+        cls.forest.fit(cls.X, cls.y)
+        cls.calibrated = {}
+        for method in ('isotonic', 'sigmoid'):
+            model = CalibratedClassifierCV(
+                RandomForestClassifier(n_estimators=10, max_depth=5, random_state=0),
+                method=method, cv=3,
+            )
+            cls.calibrated[method] = model.fit(cls.X, cls.y)
+
+    def threshold_rows(self, forest):
+        """Righe grezze con i valori esattamente sulle soglie degli split"""
+        rows = np.repeat(self.raw[:1], len(forest.feature), axis=0)
+        nodes = np.flatnonzero(forest.left != np.arange(len(forest.feature)))
+        features = forest.feature[nodes]
+        rows = rows[:len(nodes)]
+        rows[np.arange(len(nodes)), features] = (
+            forest.threshold[nodes] * self.scaler.scale_[features] + self.scaler.mean_[features]
+        )
+        return rows
+
+    def test_compiled_matches_sklearn(self):
+        compiled = compile_model(self.forest)
+        np.testing.assert_allclose(compiled.predict_proba(self.X),
+                                   self.forest.predict_proba(self.X), rtol=0, atol=1e-12)
+        np.testing.assert_array_equal(compiled.predict(self.X), self.forest.predict(self.X))
+        self.assertFalse(compiled.raw_input)
+
+    def test_single_row(self):
+        compiled = compile_model(self.forest)
+        for row in self.X[:20]:
+            np.testing.assert_allclose(compiled.predict_proba(row.reshape(1, -1)),
+                                       self.forest.predict_proba(row.reshape(1, -1)),
+                                       rtol=0, atol=1e-12)
+
+    def test_folded_scaler_takes_raw_input(self):
+        folded = fold_scaler(compile_model(self.forest), self.scaler)
+        self.assertTrue(folded.raw_input)
+        np.testing.assert_allclose(folded.predict_proba(self.raw),
+                                   self.forest.predict_proba(self.X), rtol=0, atol=1e-12)
+
+    def test_quantized_matches_sklearn(self):
+        compiled = compile_model(self.forest)
+        quantized = quantize(compiled, self.scaler)
+        np.testing.assert_array_equal(quantized.apply(self.raw), compiled.apply(self.X))
+        np.testing.assert_allclose(quantized.predict_proba(self.raw),
+                                   self.forest.predict_proba(self.X), rtol=0, atol=1e-12)
+
+    def test_quantized_is_exact_on_thresholds(self):
+        # A ridosso delle soglie il motore a bin deve scegliere lo stesso ramo
+        # di scikit-learn sull'input standardizzato
+        compiled = compile_model(self.forest)
+        rows = self.threshold_rows(compiled)
+        quantized = quantize(compiled, self.scaler)
+        np.testing.assert_array_equal(quantized.apply(rows),
+                                      compiled.apply(self.scaler.transform(rows)))
+        np.testing.assert_allclose(quantized.predict_proba(rows),
+                                   self.forest.predict_proba(self.scaler.transform(rows)),
+                                   rtol=0, atol=1e-12)
+
+    def test_quantized_from_folded_forest(self):
+        # Il motore a bin riusa l'esportazione con lo scaler incorporato
+        compiled = compile_model(self.forest)
+        from_scaler = quantize(compiled, self.scaler)
+        from_folded = quantize(fold_scaler(compiled, self.scaler))
+        for expected, got in zip(from_scaler.edges, from_folded.edges):
+            np.testing.assert_array_equal(got, expected)
+        rows = np.vstack((self.raw, self.threshold_rows(compiled)))
+        np.testing.assert_array_equal(from_folded.apply(rows), from_scaler.apply(rows))
+
+    def test_quantized_without_scaler(self):
+        compiled = compile_model(self.forest)
+        np.testing.assert_allclose(quantize(compiled).predict_proba(self.X),
+                                   compiled.predict_proba(self.X), rtol=0, atol=1e-12)
+
+    def test_calibrated_matches_sklearn(self):
+        for method, model in self.calibrated.items():
+            with self.subTest(method=method):
+                expected = model.predict_proba(self.X)
+                compiled = compile_model(model)
+                np.testing.assert_allclose(compiled.predict_proba(self.X), expected,
+                                           rtol=0, atol=1e-12)
+                folded = fold_scaler(compiled, self.scaler)
+                np.testing.assert_allclose(folded.predict_proba(self.raw), expected,
+                                           rtol=0, atol=1e-12)
+                quantized = quantize(compiled, self.scaler)
+                np.testing.assert_allclose(quantized.predict_proba(self.raw), expected,
+                                           rtol=0, atol=1e-12)
+
+    def test_save_and_load(self):
+        for model in (self.forest, self.calibrated['isotonic']):
+            folded = fold_scaler(compile_model(model), self.scaler)
+            with self.subTest(model=type(model).__name__), tempfile.TemporaryDirectory() as tmp:
+                directory = f'{tmp}/export'
+                save_compiled(folded, directory, source={'model': {'size': 1}})
+                for mmap_mode in (None, 'r'):
+                    loaded = load_compiled(directory, mmap_mode=mmap_mode)
+                    self.assertTrue(loaded.raw_input)
+                    np.testing.assert_array_equal(loaded.predict_proba(self.raw),
+                                                  folded.predict_proba(self.raw))
+
+    def test_save_without_overwrite_keeps_existing(self):
+        compiled = compile_model(self.forest)
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = f'{tmp}/export'
+            save_compiled(compiled, directory)
+            save_compiled(fold_scaler(compiled, self.scaler), directory, overwrite=False)
+            self.assertFalse(load_compiled(directory).raw_input)
+            save_compiled(fold_scaler(compiled, self.scaler), directory)
+            self.assertTrue(load_compiled(directory).raw_input)
+
+    def test_unsupported_model(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            linear = LogisticRegression(max_iter=200).fit(self.X, self.y)
+        self.assertFalse(is_tree_model(linear))
+        with self.assertRaises(TypeError):
+            compile_model(linear)
+        self.assertTrue(is_tree_model(self.forest))
+        self.assertTrue(is_tree_model(self.calibrated['sigmoid']))
+        self.assertTrue(is_tree_model(compile_model(self.forest)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+import numpy as np
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import StandardScaler
+
+from test_tree_engine import make_data
+from tree_engine import compile_model, quantize
+from tree_votes import VoteAnalyzer, format_uncertainty
+
+
+class VoteAnalyzerTest(unittest.TestCase):
+    """Statistiche vettorizzate uguali al ciclo albero per albero"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.raw, cls.y = make_data()
+        cls.scaler = StandardScaler().fit(cls.raw)
+        cls.X = cls.scaler.transform(cls.raw)
+        cls.forest = RandomForestClassifier(n_estimators=15, max_depth=6, random_state=0)
+        cls.forest.fit(cls.X, cls.y)
+
+    def per_tree(self, estimators, X):
+        votes = np.column_stack([tree.predict(X) for tree in estimators]).astype(int)
+        proba = np.stack([tree.predict_proba(X) for tree in estimators], axis=1)
+        counts = np.stack([(votes == k).sum(axis=1) for k in range(proba.shape[2])], axis=1)
+        return counts, proba
+
+    def test_matches_tree_loop(self):
+        stats = VoteAnalyzer.from_model(self.forest).analyze(self.X)
+        counts, proba = self.per_tree(self.forest.estimators_, self.X)
+        np.testing.assert_array_equal(stats['votes'], counts)
+        np.testing.assert_allclose(stats['vote_share'], counts / len(self.forest.estimators_),
+                                   rtol=0, atol=1e-12)
+        np.testing.assert_allclose(stats['tree_proba_mean'], self.forest.predict_proba(self.X),
+                                   rtol=0, atol=1e-12)
+        np.testing.assert_allclose(stats['tree_proba_std'], proba.std(axis=1), rtol=0, atol=1e-6)
+
+    def test_entropy_and_agreement(self):
+        stats = VoteAnalyzer.from_model(self.forest).analyze(self.X)
+        share = stats['vote_share']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            entropy = -np.where(share > 0, share * np.log(share), 0.0).sum(axis=1) / np.log(3)
+        np.testing.assert_allclose(stats['vote_entropy'], entropy, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(stats['agreement'], share.max(axis=1))
+        self.assertTrue(((stats['vote_entropy'] >= 0) & (stats['vote_entropy'] <= 1 + 1e-12)).all())
+        unanimous = stats['agreement'] == 1.0
+        self.assertTrue(unanimous.any())
+        np.testing.assert_allclose(stats['vote_entropy'][unanimous], 0.0, atol=1e-12)
+
+    def test_blocks_give_same_result(self):
+        analyzer = VoteAnalyzer.from_model(self.forest)
+        expected = analyzer.analyze(self.X)
+        analyzer.BLOCK_ELEMENTS = 5 * analyzer.forest.n_trees * 3 * analyzer.n_classes
+        got = analyzer.analyze(self.X)
+        for name, values in expected.items():
+            np.testing.assert_allclose(got[name], values, rtol=0, atol=1e-12, err_msg=name)
+
+    def test_binned_model_on_raw_input(self):
+        binned = quantize(compile_model(self.forest), self.scaler)
+        got = VoteAnalyzer.from_model(binned).analyze(self.raw)
+        expected = VoteAnalyzer.from_model(self.forest).analyze(self.X)
+        for name, values in expected.items():
+            np.testing.assert_allclose(got[name], values, rtol=0, atol=1e-12, err_msg=name)
+
+    def test_calibrated_uses_all_inner_trees(self):
+        model = CalibratedClassifierCV(
+            RandomForestClassifier(n_estimators=10, max_depth=5, random_state=0),
+            method='isotonic', cv=3,
+        ).fit(self.X, self.y)
+        stats = VoteAnalyzer.from_model(model).analyze(self.X)
+        inner = [member.estimator for member in model.calibrated_classifiers_]
+        counts = sum(self.per_tree(forest.estimators_, self.X)[0] for forest in inner)
+        np.testing.assert_array_equal(stats['votes'], counts)
+        mean = np.mean([forest.predict_proba(self.X) for forest in inner], axis=0)
+        np.testing.assert_allclose(stats['tree_proba_mean'], mean, rtol=0, atol=1e-12)
+
+    def test_format_uncertainty(self):
+        stats = VoteAnalyzer.from_model(self.forest).analyze(self.X[:3])
+        classes = ['High', 'Low', 'Medium']
+        row = format_uncertainty(stats, 0, classes, min_agreement=1.01)
+        self.assertEqual(sum(row['votes'].values()), len(self.forest.estimators_))
+        self.assertEqual(row['majority_vote'], max(row['vote_share'], key=row['vote_share'].get))
+        self.assertTrue(row['needs_review'])
+        self.assertFalse(format_uncertainty(stats, 0, classes, min_agreement=0.0)['needs_review'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from model_registry import ModelRuntime
+from preprocessing import FEATURE_COLUMNS
+from training_pipeline import preprocess
+from whatif import build_grid, closest_point, parse_axis, sensitivity
+
+
+class SensitivityTest(unittest.TestCase):
+    """La griglia predetta in una chiamata = gli studenti modificati uno per uno"""
+
+    @classmethod
+    def setUpClass(cls):
+        frame = pd.read_csv('student_pe_performance.csv')
+        X_train, _, y_train, _, cls.scaler, cls.label_encoders = preprocess(frame)
+        cls.model = RandomForestClassifier(n_estimators=10, max_depth=6, random_state=0)
+        cls.model.fit(X_train, y_train)
+        cls.runtime = ModelRuntime.from_sklearn('test', cls.model, cls.scaler, cls.label_encoders)
+        cls.student = frame[FEATURE_COLUMNS].iloc[0].to_dict()
+
+    def predict_one(self, runtime, changes):
+        student = {**self.student, **changes}
+        return runtime.predict_proba(runtime.preprocessor.transform_one(student))[0]
+
+    def check_grid(self, runtime, sweeps):
+        _, axes, shape, student_proba, grid_proba = sensitivity(runtime, self.student,
+                                                                sweeps, 1000)
+        self.assertEqual(shape, tuple(len(axis.values) for axis in axes))
+        self.assertEqual(len(grid_proba), np.prod(shape))
+        np.testing.assert_allclose(student_proba, self.predict_one(runtime, {}), atol=1e-12)
+        for flat, index in enumerate(np.ndindex(shape)):
+            changes = {axis.feature: axis.values[i] for axis, i in zip(axes, index)}
+            np.testing.assert_allclose(grid_proba[flat], self.predict_one(runtime, changes),
+                                       atol=1e-12, err_msg=str(changes))
+
+    def test_numeric_range(self):
+        self.check_grid(self.runtime, [{'feature': 'Attendance_Rate', 'start': 50, 'stop': 100,
+                                        'steps': 6}])
+
+    def test_two_features(self):
+        self.check_grid(self.runtime, [
+            {'feature': 'Strength_Score', 'values': [40, 60, 80, 100]},
+            {'feature': 'Motivation_Level'},
+        ])
+
+    def test_compiled_engine(self):
+        compiled = ModelRuntime.from_sklearn('test', self.model, self.scaler, self.label_encoders,
+                                             engine='compiled')
+        self.check_grid(compiled, [{'feature': 'Skills_Score', 'start': 30, 'stop': 100},
+                                   {'feature': 'Gender'}])
+
+    def test_categorical_defaults_to_all_categories(self):
+        axis = parse_axis(self.runtime.preprocessor, {'feature': 'Motivation_Level'}, 100)
+        self.assertTrue(axis.categorical)
+        self.assertEqual(sorted(axis.values),
+                         sorted(self.label_encoders['Motivation_Level'].classes_))
+
+    def test_invalid_sweeps(self):
+        invalid = [
+            None,
+            [],
+            [{'feature': 'Age'}, {'feature': 'BMI'}, {'feature': 'Gender'}],
+            [{'feature': 'Unknown'}],
+            [{'feature': 'Age', 'start': 10}],
+            [{'feature': 'Age', 'start': 10, 'stop': 'x'}],
+            [{'feature': 'Age', 'start': 10, 'stop': 20, 'steps': 0}],
+            [{'feature': 'Age', 'start': 10, 'stop': float('inf')}],
+            [{'feature': 'Gender', 'values': ['Unknown']}],
+            [{'feature': 'Gender'}, {'feature': 'Gender'}],
+            [{'feature': 'Age', 'start': 10, 'stop': 20, 'steps': 40},
+             {'feature': 'BMI', 'start': 15, 'stop': 30, 'steps': 40}],
+        ]
+        for sweeps in invalid:
+            with self.subTest(sweeps=sweeps), self.assertRaises(ValueError):
+                sensitivity(self.runtime, self.student, sweeps, 1000)
+
+    def test_closest_point(self):
+        preprocessor = self.runtime.preprocessor
+        base_row = preprocessor.encode_one(self.student)[0].copy()
+        axes = [parse_axis(preprocessor, {'feature': 'Age', 'values': [10, 14, 18, 22]}, 100),
+                parse_axis(preprocessor, {'feature': 'Gender', 'values': ['Female', 'Male']}, 100)]
+        grid, shape = build_grid(base_row, axes)
+        self.assertEqual(grid.shape, (8, len(FEATURE_COLUMNS)))
+        base_row[axes[0].column] = 15
+        base_row[axes[1].column] = axes[1].encoded[1]
+
+        # Età 14 (distanza 1/12 dell'intervallo), stesso genere
+        mask = np.ones(shape, dtype=bool)
+        self.assertEqual(closest_point(axes, shape, mask.ravel(), base_row), (1, 1))
+        # Cambiare genere costa 1, più di qualsiasi variazione dell'età
+        mask[0, 1] = mask[1, 1] = mask[2, 1] = False
+        self.assertEqual(closest_point(axes, shape, mask.ravel(), base_row), (3, 1))
+        mask[3, 1] = False
+        self.assertEqual(closest_point(axes, shape, mask.ravel(), base_row), (1, 0))
+        self.assertIsNone(closest_point(axes, shape, np.zeros(8, dtype=bool), base_row))
+
+
+if __name__ == '__main__':
+    unittest.main()
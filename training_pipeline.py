@@ -0,0 +1,312 @@
+# PIPELINE DI ADDESTRAMENTO CON DATASET PREPROCESSATO IN CACHE
+#
+# Sostituisce i passi separati di fix_confidence_problem.py: il dataset viene
+# letto, codificato e standardizzato una sola volta e gli array risultanti
+# sono salvati in cache su disco (.npy), indicizzati dall'hash del CSV e dei
+# parametri di preprocessing. Tutti i modelli candidati e tutti i fold della
+# validazione incrociata vengono addestrati in parallelo su tutti i core.
+# Ogni candidato viene salvato come versione del registro dei modelli
+# (models/<versione>-<candidato>/) con le sue metriche, più un riepilogo.
+#
+# Esempio:
+#   python training_pipeline.py --version 20250115
+#   python training_pipeline.py --candidates rf_improved rf_calibrated --jobs 4
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, log_loss
+from sklearn.model_selection import StratifiedKFold, train_test_split
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+from sklearn.svm import SVC
+
+from preprocessing import FEATURE_COLUMNS
+
+CATEGORICAL_COLUMNS = ['Gender', 'Grade_Level', 'Class_Participation_Level',
+                       'Motivation_Level', 'Final_Grade', 'Previous_Semester_PE_Grade']
+
+# Da incrementare se cambia il modo in cui vengono costruiti gli array in cache
+CACHE_FORMAT = 1
+
+
+def candidate_models():
+    """Modelli candidati (gli stessi provati in fix_confidence_problem.py)"""
+    return {
+        'rf_improved': RandomForestClassifier(
+            n_estimators=50, max_depth=8, min_samples_split=10, min_samples_leaf=5,
+            max_features='sqrt', bootstrap=True, random_state=42, class_weight='balanced'
+        ),
+        'gradient_boosting': GradientBoostingClassifier(
+            n_estimators=100, max_depth=5, learning_rate=0.1, random_state=42
+        ),
+        'svm': SVC(kernel='rbf', probability=True, random_state=42),
+        'logistic_regression': LogisticRegression(max_iter=1000, random_state=42),
+        'rf_calibrated': CalibratedClassifierCV(
+            RandomForestClassifier(n_estimators=300, max_depth=15, max_features=None,
+                                   random_state=42),
+            method='isotonic', cv=3
+        ),
+    }
+
+
+class Dataset:
+    """Dataset codificato, standardizzato e diviso in train/test"""
+
+    ARRAYS = ('X_train', 'X_test', 'y_train', 'y_test')
+
+    def __init__(self, X_train, X_test, y_train, y_test, scaler, label_encoders, key,
+                 from_cache=False):
+        self.X_train = X_train
+        self.X_test = X_test
+        self.y_train = y_train
+        self.y_test = y_test
+        self.scaler = scaler
+        self.label_encoders = label_encoders
+        self.key = key
+        self.from_cache = from_cache
+
+    @property
+    def classes(self):
+        return list(self.label_encoders['Performance'].classes_)
+
+
+def _file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def dataset_key(csv_path, test_size=0.2, random_state=42):
+    """Hash dei dati e dei parametri di preprocessing: chiave della cache"""
+    config = json.dumps({
+        'format': CACHE_FORMAT, 'features': FEATURE_COLUMNS,
+        'categorical': CATEGORICAL_COLUMNS, 'test_size': test_size,
+        'random_state': random_state,
+    }, sort_keys=True)
+    return hashlib.sha256((_file_hash(csv_path) + config).encode()).hexdigest()[:16]
+
+
+def preprocess(df, test_size=0.2, random_state=42):
+    """Label encoding, standardizzazione e split (come create_better_model)"""
+    features = df[FEATURE_COLUMNS].copy()
+    label_encoders = {}
+    for col in CATEGORICAL_COLUMNS:
+        le = LabelEncoder()
+        features[col] = le.fit_transform(features[col])
+        label_encoders[col] = le
+
+    target_le = LabelEncoder()
+    target = target_le.fit_transform(df['Performance'])
+    label_encoders['Performance'] = target_le
+
+    scaler = StandardScaler()
+    features_scaled = scaler.fit_transform(features)
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        features_scaled, target, test_size=test_size, random_state=random_state, stratify=target
+    )
+    return X_train, X_test, y_train, y_test, scaler, label_encoders
+
+
+def load_dataset(csv_path='student_pe_performance.csv', cache_dir='.cache/datasets',
+                 test_size=0.2, random_state=42):
+    """Dataset preprocessato, dalla cache se i dati non sono cambiati"""
+    key = dataset_key(csv_path, test_size, random_state)
+    directory = os.path.join(cache_dir, key)
+    if os.path.isdir(directory):
+        arrays = [np.load(os.path.join(directory, f'{name}.npy')) for name in Dataset.ARRAYS]
+        return Dataset(*arrays, joblib.load(os.path.join(directory, 'scaler.pkl')),
+                       joblib.load(os.path.join(directory, 'label_encoders.pkl')),
+                       key, from_cache=True)
+
+    *arrays, scaler, label_encoders = preprocess(pd.read_csv(csv_path), test_size, random_state)
+
+    # Scrittura atomica: prima in una directory temporanea, poi rename
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = f'{directory}.tmp-{os.getpid()}'
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name, array in zip(Dataset.ARRAYS, arrays):
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), array)
+    joblib.dump(scaler, os.path.join(tmp_dir, 'scaler.pkl'))
+    joblib.dump(label_encoders, os.path.join(tmp_dir, 'label_encoders.pkl'))
+    try:
+        os.rename(tmp_dir, directory)
+    except OSError:
+        # Un altro processo ha già scritto la stessa chiave
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return Dataset(*arrays, scaler, label_encoders, key)
+
+
+def expected_calibration_error(proba, y, n_bins=10):
+    """ECE sulla classe predetta: scarto medio tra confidenza e accuratezza per fascia"""
+    confidence = proba.max(axis=1)
+    correct = proba.argmax(axis=1) == y
+    bins = np.minimum((confidence * n_bins).astype(int), n_bins - 1)
+    ece = 0.0
+    for b in range(n_bins):
+        mask = bins == b
+        if mask.any():
+            ece += mask.mean() * abs(correct[mask].mean() - confidence[mask].mean())
+    return float(ece)
+
+
+def probability_metrics(proba, y, n_classes):
+    """Accuratezza, calibrazione (Brier, ECE, log loss) e distribuzione delle confidenze"""
+    one_hot = np.eye(n_classes)[y]
+    confidence = proba.max(axis=1)
+    return {
+        'accuracy': float(accuracy_score(y, proba.argmax(axis=1))),
+        'brier': float(np.mean(np.sum((proba - one_hot) ** 2, axis=1))),
+        'ece': expected_calibration_error(proba, y),
+        'log_loss': float(log_loss(y, proba, labels=list(range(n_classes)))),
+        'confidence_mean': float(confidence.mean()),
+        'confidence_max': float(confidence.max()),
+        'n_confidence_over_95': int(np.sum(confidence > 0.95)),
+        'n_confidence_100': int(np.sum(confidence == 1.0)),
+    }
+
+
+def single_threaded(estimator):
+    """n_jobs=1 dove esiste: il parallelismo è già sui task della pipeline"""
+    params = {name: 1 for name in estimator.get_params() if name.endswith('n_jobs')}
+    return estimator.set_params(**params) if params else estimator
+
+
+def _fit_task(name, estimator, X, y, fold, train_idx, eval_idx, n_classes):
+    """Un task: un fold della CV (fold >= 0) o l'addestramento finale (fold = -1)"""
+    start = time.perf_counter()
+    model = single_threaded(clone(estimator))
+    model.fit(X[train_idx], y[train_idx])
+    fit_s = time.perf_counter() - start
+    if fold < 0:
+        return name, fold, model, {'fit_s': fit_s}
+    proba = model.predict_proba(X[eval_idx])
+    return name, fold, None, {'fit_s': fit_s, **probability_metrics(proba, y[eval_idx], n_classes)}
+
+
+def train_candidates(dataset, candidates, n_folds=5, n_jobs=-1, random_state=42):
+    """Addestra candidati e fold della CV in parallelo (un task per coppia)"""
+    X, y = dataset.X_train, dataset.y_train
+    n_classes = len(dataset.classes)
+    folds = list(StratifiedKFold(n_folds, shuffle=True, random_state=random_state).split(X, y))
+    all_idx = np.arange(len(y))
+
+    # Prima gli addestramenti finali (i task più lunghi), poi tutti i fold
+    tasks = [delayed(_fit_task)(name, estimator, X, y, -1, all_idx, None, n_classes)
+             for name, estimator in candidates.items()]
+    for name, estimator in candidates.items():
+        for fold, (train_idx, eval_idx) in enumerate(folds):
+            tasks.append(delayed(_fit_task)(name, estimator, X, y, fold, train_idx, eval_idx,
+                                            n_classes))
+    outputs = Parallel(n_jobs=n_jobs)(tasks)
+
+    models, results = {}, {}
+    for name, fold, model, metrics in outputs:
+        entry = results.setdefault(name, {'cv_folds': []})
+        if fold < 0:
+            models[name] = model
+            entry['fit_s'] = metrics['fit_s']
+        else:
+            entry['cv_folds'].append(metrics)
+
+    for name, entry in results.items():
+        folds_metrics = entry.pop('cv_folds')
+        for metric in ('accuracy', 'brier', 'ece'):
+            values = np.array([m[metric] for m in folds_metrics])
+            entry[f'cv_{metric}_mean'] = float(values.mean())
+            entry[f'cv_{metric}_std'] = float(values.std())
+        entry['test'] = probability_metrics(models[name].predict_proba(dataset.X_test),
+                                            dataset.y_test, n_classes)
+    return models, results
+
+
+def save_version(directory, model, scaler, label_encoders, metrics):
+    """Salva una versione nel formato del registro (model/scaler/label_encoders + metriche)"""
+    tmp_dir = f'{directory}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    joblib.dump(model, os.path.join(tmp_dir, 'model.pkl'))
+    joblib.dump(scaler, os.path.join(tmp_dir, 'scaler.pkl'))
+    joblib.dump(label_encoders, os.path.join(tmp_dir, 'label_encoders.pkl'))
+    with open(os.path.join(tmp_dir, 'metrics.json'), 'w') as f:
+        json.dump(metrics, f, indent=2)
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    os.rename(tmp_dir, directory)
+
+
+def run_pipeline(csv_path, version, output_dir='models', candidates=None, n_folds=5,
+                 n_jobs=-1, cache_dir='.cache/datasets'):
+    start = time.perf_counter()
+    dataset = load_dataset(csv_path, cache_dir)
+    preprocess_s = time.perf_counter() - start
+    source = 'cache' if dataset.from_cache else 'CSV'
+    print(f"📦 Dataset {dataset.key} da {source}: {len(dataset.y_train)} train, "
+          f"{len(dataset.y_test)} test ({preprocess_s:.2f} s)")
+
+    available = candidate_models()
+    selected = {name: available[name] for name in (candidates or available)}
+    start = time.perf_counter()
+    models, results = train_candidates(dataset, selected, n_folds=n_folds, n_jobs=n_jobs)
+    train_s = time.perf_counter() - start
+
+    summary = {
+        'version': version,
+        'dataset_key': dataset.key,
+        'dataset_from_cache': dataset.from_cache,
+        'n_train': int(len(dataset.y_train)),
+        'n_test': int(len(dataset.y_test)),
+        'classes': dataset.classes,
+        'preprocess_s': preprocess_s,
+        'train_s': train_s,
+        'candidates': {},
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    for name in selected:
+        version_name = f'{version}-{name}'
+        metrics = {'candidate': name, 'dataset_key': dataset.key, **results[name]}
+        save_version(os.path.join(output_dir, version_name), models[name],
+                     dataset.scaler, dataset.label_encoders, metrics)
+        summary['candidates'][name] = {'registry_version': version_name, **results[name]}
+        test = results[name]['test']
+        print(f"   {name:<20} acc {test['accuracy']:.3f}  brier {test['brier']:.3f}  "
+              f"ece {test['ece']:.3f}  conf.max {test['confidence_max']:.3f}  "
+              f"(cv {results[name]['cv_accuracy_mean']:.3f}, fit {results[name]['fit_s']:.1f} s)")
+
+    summary_path = os.path.join(output_dir, f'training-{version}.json')
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(f"✅ {len(selected)} modelli addestrati in {train_s:.1f} s, riepilogo in '{summary_path}'")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Addestramento parallelo dei modelli candidati con dataset in cache'
+    )
+    parser.add_argument('--csv', default='student_pe_performance.csv')
+    parser.add_argument('--version', default=time.strftime('%Y%m%d-%H%M%S'),
+                        help='prefisso delle versioni nel registro (default: data e ora)')
+    parser.add_argument('--output-dir', default=os.environ.get('MODEL_REGISTRY_DIR', 'models'))
+    parser.add_argument('--candidates', nargs='+', choices=list(candidate_models()))
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--jobs', type=int, default=-1, help='processi paralleli (-1 = tutti i core)')
+    parser.add_argument('--cache-dir', default='.cache/datasets')
+    args = parser.parse_args()
+
+    run_pipeline(args.csv, args.version, args.output_dir, args.candidates,
+                 n_folds=args.folds, n_jobs=args.jobs, cache_dir=args.cache_dir)
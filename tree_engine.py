@@ -0,0 +1,666 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+# Array dei nodi salvati da save_compiled (un file .npy ciascuno)
+NODE_ARRAYS = ('feature', 'threshold', 'left', 'right', 'proba', 'roots')
+
+
+class CompiledForest:
+    """Foresta di alberi decisionali compilata in array NumPy contigui.
+
+    Tutti i nodi di tutti gli alberi stanno in un unico insieme di array
+    (feature, threshold, left, right, proba); `roots` contiene l'indice del
+    nodo radice di ogni albero. Le foglie puntano a se stesse. La visita
+    avanza tutti gli alberi e tutte le righe insieme, un livello per volta,
+    e a ogni livello scarta le coppie (albero, riga) già arrivate a una foglia.
+
+    Il vantaggio su scikit-learn è la latenza di una riga o di piccoli batch
+    (nessun overhead per chiamata). Sui batch grandi il ciclo in C di
+    scikit-learn resta più veloce: ModelRuntime passa quei batch
+    all'estimatore originale quando è caricato (vedi benchmark.py).
+
+    La semantica è quella di scikit-learn: l'input viene convertito in float32
+    prima del confronto con le soglie (float64) e la probabilità di un albero
+    è la distribuzione normalizzata delle classi nella foglia raggiunta.
+    Con `raw_input=True` (vedi fold_scaler) le soglie sono in unità originali
+    e l'input, non standardizzato, viene confrontato in float64.
+    """
+
+    def __init__(self, feature, threshold, left, right, proba, roots, max_depth, classes,
+                 raw_input=False):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.proba = proba
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes_ = classes
+        self.n_trees = len(roots)
+        self.n_classes = proba.shape[1]
+        self.raw_input = bool(raw_input)
+        self.children, self.internal = _children(left, right)
+
+    @classmethod
+    def from_sklearn(cls, forest):
+        """Compila un RandomForestClassifier (o un ensemble di alberi equivalente)"""
+        features, thresholds, lefts, rights, probas, roots = [], [], [], [], [], []
+        max_depth = 0
+        offset = 0
+        n_classes = len(forest.classes_)
+
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            left = tree.children_left.astype(np.int64)
+            right = tree.children_right.astype(np.int64)
+            is_leaf = left == -1
+            own_index = np.arange(n_nodes, dtype=np.int64)
+
+            # Le foglie puntano a se stesse; gli indici diventano globali
+            left = np.where(is_leaf, own_index, left) + offset
+            right = np.where(is_leaf, own_index, right) + offset
+            feature = np.where(is_leaf, 0, tree.feature).astype(np.int64)
+
+            # Stessa normalizzazione di DecisionTreeClassifier.predict_proba
+            value = tree.value[:, 0, :n_classes].astype(np.float64)
+            normalizer = value.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+
+            features.append(feature)
+            thresholds.append(tree.threshold.astype(np.float64))
+            lefts.append(left)
+            rights.append(right)
+            probas.append(value / normalizer)
+            roots.append(offset)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n_nodes
+
+        return cls(
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts),
+            right=np.concatenate(rights),
+            proba=np.concatenate(probas),
+            roots=np.asarray(roots, dtype=np.int64),
+            max_depth=max_depth,
+            classes=np.asarray(forest.classes_),
+        )
+
+    @classmethod
+    def concatenate(cls, forests, classes=None):
+        """Unisce più foreste compilate in una sola (alberi in sequenza)"""
+        if len({f.raw_input for f in forests}) > 1:
+            raise ValueError('Impossibile unire foreste con soglie standardizzate e non')
+        offsets = np.cumsum([0] + [f.n_nodes for f in forests[:-1]])
+        return cls(
+            feature=np.concatenate([f.feature for f in forests]),
+            threshold=np.concatenate([f.threshold for f in forests]),
+            left=np.concatenate([f.left + o for f, o in zip(forests, offsets)]),
+            right=np.concatenate([f.right + o for f, o in zip(forests, offsets)]),
+            proba=np.concatenate([f.proba for f in forests]),
+            roots=np.concatenate([f.roots + o for f, o in zip(forests, offsets)]),
+            max_depth=max(f.max_depth for f in forests),
+            classes=forests[0].classes_ if classes is None else classes,
+            raw_input=forests[0].raw_input,
+        )
+
+    def fold_scaler(self, mean, scale):
+        """Riporta le soglie in unità originali incorporando lo StandardScaler.
+
+        Con x_scaled = (x - mean) / scale (scale > 0) lo split
+        x_scaled <= t equivale a x <= t * scale + mean: la foresta risultante
+        accetta direttamente l'input non standardizzato (categorie già
+        codificate come interi). Il taglio non è t * scale + mean ma il
+        valore esatto di _float32_cutoffs: scikit-learn confronta l'input
+        standardizzato convertito in float32, e con soglie che cadono su un
+        valore dei dati (es. una categoria) l'arrotondamento sceglierebbe a
+        volte l'altro ramo.
+        """
+        if self.raw_input:
+            raise ValueError('Le soglie sono già in unità originali')
+        mean = np.asarray(mean, dtype=np.float64)
+        scale = np.asarray(scale, dtype=np.float64)
+        internal = self.left != np.arange(self.n_nodes)
+        used = self.feature[internal]
+        threshold = self.threshold.astype(np.float64)
+        threshold[internal] = _float32_cutoffs(threshold[internal], mean[used], scale[used])
+        return CompiledForest(
+            self.feature, threshold, self.left, self.right, self.proba, self.roots,
+            self.max_depth, self.classes_, raw_input=True,
+        )
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @property
+    def nbytes(self):
+        """Memoria occupata dagli array dei nodi"""
+        return sum(a.nbytes for a in (
+            self.feature, self.threshold, self.left, self.right, self.proba, self.roots
+        ))
+
+    def _prepare(self, X):
+        # scikit-learn confronta l'input convertito in float32 con soglie float64
+        X = np.asarray(X, dtype=np.float64 if self.raw_input else np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        return X
+
+    def apply(self, X):
+        """Indici (globali) delle foglie raggiunte: array (n_samples, n_trees)"""
+        return self.apply_by_tree(X).T
+
+    def apply_by_tree(self, X):
+        """Come apply, ma con un albero per riga: array (n_trees, n_samples)"""
+        return _traverse(self._prepare(X), self.feature, self.threshold, self.children,
+                         self.internal, self.roots, self.max_depth)
+
+    def predict_proba(self, X):
+        """Media delle probabilità delle foglie su tutti gli alberi"""
+        return _mean_leaf_proba(self.proba, self.apply_by_tree(X))
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+
+def _children(left, right):
+    """Figli di ogni nodo alternati (destro, sinistro) e maschera dei nodi
+    interni: il successore di un nodo è children[2 * nodo + va_a_sinistra]"""
+    children = np.empty(2 * len(left), dtype=np.int64)
+    children[0::2] = right
+    children[1::2] = left
+    return children, left != np.arange(len(left))
+
+
+def _traverse(X, feature, threshold, children, internal, roots, max_depth):
+    """Foglie raggiunte da ogni riga di X in ogni albero: array (n_trees, n_samples).
+
+    Le coppie (albero, riga) sono in ordine albero per albero e a ogni
+    livello restano solo quelle non ancora arrivate a una foglia: la visita
+    costa quanto i cammini effettivi, non n_trees * n_samples * max_depth.
+    """
+    n_samples, n_features = X.shape
+    if n_samples == 1:
+        # Una sola riga (/api/predict): conviene decidere tutti i nodi con
+        # un solo confronto, poi la visita è una lettura per livello
+        successor = children[2 * np.arange(len(feature)) + (X[0, feature] <= threshold)]
+        nodes = roots
+        for _ in range(max_depth):
+            nodes = successor[nodes]
+        return nodes[:, np.newaxis]
+    values = np.ascontiguousarray(X).ravel()
+    leaves = np.repeat(roots, n_samples)
+    # Posizione in `values` dell'inizio della riga di ogni coppia
+    offsets = np.tile(np.arange(0, n_samples * n_features, n_features), len(roots))
+    position = np.arange(leaves.size)
+    nodes = leaves
+    while nodes.size:
+        go_left = values[offsets + feature[nodes]] <= threshold[nodes]
+        nodes = children[2 * nodes + go_left]
+        leaves[position] = nodes
+        pending = internal[nodes]
+        position, nodes, offsets = position[pending], nodes[pending], offsets[pending]
+    return leaves.reshape(len(roots), n_samples)
+
+
+def _mean_leaf_proba(proba, leaves):
+    """Media sugli alberi delle probabilità delle foglie (n_trees, n_samples).
+
+    Una classe alla volta, sommando gli alberi nell'ordine di scikit-learn,
+    senza materializzare l'array (n_samples, n_trees, n_classes).
+    """
+    mean = np.empty((leaves.shape[1], proba.shape[1]))
+    for k in range(proba.shape[1]):
+        mean[:, k] = proba[:, k].take(leaves).sum(axis=0)
+    return mean / leaves.shape[0]
+
+
+def _float32_cutoffs(threshold, mean, scale):
+    """Massimo x float64 con float32((x - mean) / scale) <= threshold.
+
+    È lo split di scikit-learn su input standardizzato riportato in unità
+    originali senza arrotondamenti: la condizione è monotona in x (scale > 0),
+    quindi il taglio esatto si trova per bisezione sui float64.
+    """
+    def holds(x):
+        return ((x - mean) / scale).astype(np.float32) <= threshold
+
+    guess = threshold * scale + mean
+    step = (np.abs(guess) + scale) * 1e-6
+    lo, hi = guess - step, guess + step
+    for _ in range(64):
+        low_bad, high_bad = ~holds(lo), holds(hi)
+        if not (low_bad.any() or high_bad.any()):
+            break
+        step = np.where(low_bad | high_bad, step * 2, step)
+        lo = np.where(low_bad, guess - step, lo)
+        hi = np.where(high_bad, guess + step, hi)
+
+    # Bisezione finché lo e hi sono float64 consecutivi
+    while True:
+        mid = lo + (hi - lo) / 2
+        done = (mid <= lo) | (mid >= hi)
+        if done.all():
+            break
+        ok = holds(mid)
+        lo = np.where(ok & ~done, mid, lo)
+        hi = np.where(~ok & ~done, mid, hi)
+    return lo
+
+
+class QuantizedForest:
+    """Foresta compilata che confronta indici di bin uint8 invece di float.
+
+    Per ogni feature i tagli sono le soglie effettivamente usate dagli split,
+    ordinate e senza duplicati. Il bin di un valore x è il numero di tagli
+    minori di x, quindi x <= taglio_k equivale a bin <= k: ogni nodo confronta
+    il bin con l'indice del proprio taglio e le predizioni coincidono
+    esattamente con quelle della foresta float. La matrice in ingresso
+    occupa un byte per valore invece di otto (uint16 se una feature ha più
+    di 255 tagli).
+
+    Con `mean`/`scale` la standardizzazione è incorporata nei tagli in modo
+    esatto (vedi _float32_cutoffs): l'input è grezzo come con fold_scaler.
+    """
+
+    # Fino a quante righe calcolare i bin con la matrice dei tagli
+    SMALL_BATCH = 64
+
+    def __init__(self, feature, bin_threshold, left, right, proba, roots, max_depth, classes,
+                 edges, input_dtype, raw_input):
+        self.feature = feature
+        self.bin_threshold = bin_threshold
+        self.left = left
+        self.right = right
+        self.proba = proba
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes_ = classes
+        self.edges = edges
+        self.input_dtype = np.dtype(input_dtype)
+        self.raw_input = bool(raw_input)
+        self.bin_dtype = bin_threshold.dtype
+        self.n_trees = len(roots)
+        self.n_classes = proba.shape[1]
+        self.children, self.internal = _children(left, right)
+
+        # Tagli in una matrice (n_features, max tagli) completata con +inf:
+        # per poche righe un solo confronto vettorizzato costa meno di una
+        # searchsorted per feature
+        self.edge_matrix = np.full((len(edges), max(len(e) for e in edges)), np.inf)
+        for j, feature_edges in enumerate(edges):
+            self.edge_matrix[j, :len(feature_edges)] = feature_edges
+
+    @classmethod
+    def from_forest(cls, forest, mean=None, scale=None):
+        if mean is not None and forest.raw_input:
+            raise ValueError('Le soglie sono già in unità originali')
+        internal = forest.left != np.arange(forest.n_nodes)
+        cutoffs = forest.threshold.astype(np.float64)
+        if mean is not None:
+            mean = np.asarray(mean, dtype=np.float64)
+            scale = np.asarray(scale, dtype=np.float64)
+            used = forest.feature[internal]
+            cutoffs[internal] = _float32_cutoffs(cutoffs[internal], mean[used], scale[used])
+            n_features = len(mean)
+        else:
+            n_features = int(forest.feature.max()) + 1
+
+        edges = []
+        bin_index = np.zeros(forest.n_nodes, dtype=np.int64)
+        for j in range(n_features):
+            mask = internal & (forest.feature == j)
+            feature_edges = np.unique(cutoffs[mask])
+            bin_index[mask] = np.searchsorted(feature_edges, cutoffs[mask])
+            edges.append(feature_edges)
+        max_edges = max(len(e) for e in edges)
+        bin_dtype = np.uint8 if max_edges <= np.iinfo(np.uint8).max else np.uint16
+
+        # Input confrontato come nella foresta di partenza (float32 se standardizzato)
+        raw_input = mean is not None or forest.raw_input
+        return cls(
+            forest.feature, bin_index.astype(bin_dtype), forest.left, forest.right,
+            forest.proba, forest.roots, forest.max_depth, forest.classes_, edges,
+            np.float64 if raw_input else np.float32, raw_input,
+        )
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @property
+    def nbytes(self):
+        """Memoria occupata dagli array dei nodi e dai tagli"""
+        return sum(a.nbytes for a in (
+            self.feature, self.bin_threshold, self.left, self.right, self.proba, self.roots
+        )) + sum(e.nbytes for e in self.edges)
+
+    def transform(self, X):
+        """Matrice dei bin (n_samples, n_features) in bin_dtype"""
+        X = np.asarray(X, dtype=self.input_dtype)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[0] <= self.SMALL_BATCH:
+            below = self.edge_matrix < X[:, :len(self.edges), np.newaxis]
+            return below.sum(axis=2, dtype=self.bin_dtype)
+        bins = np.empty((X.shape[0], len(self.edges)), dtype=self.bin_dtype)
+        for j, feature_edges in enumerate(self.edges):
+            bins[:, j] = np.searchsorted(feature_edges, X[:, j], side='left')
+        return bins
+
+    def apply_binned(self, bins):
+        """Come CompiledForest.apply, su una matrice di bin già calcolata"""
+        return self.apply_binned_by_tree(bins).T
+
+    def apply_binned_by_tree(self, bins):
+        return _traverse(bins, self.feature, self.bin_threshold, self.children,
+                         self.internal, self.roots, self.max_depth)
+
+    def apply(self, X):
+        return self.apply_binned(self.transform(X))
+
+    def apply_by_tree(self, X):
+        return self.apply_binned_by_tree(self.transform(X))
+
+    def predict_proba_binned(self, bins):
+        return _mean_leaf_proba(self.proba, self.apply_binned_by_tree(bins))
+
+    def predict_proba(self, X):
+        return self.predict_proba_binned(self.transform(X))
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+
+class CompiledCalibratedForest:
+    """CalibratedClassifierCV compilato: foreste interne + calibratori one-vs-rest.
+
+    Gli alberi di tutte le foreste interne sono fusi in un'unica
+    CompiledForest, così una sola visita calcola le foglie per tutti i
+    membri; `bounds` indica quali alberi appartengono a ciascun membro.
+    Ogni calibratore (isotonico o sigmoide) è ridotto ai suoi parametri.
+    """
+
+    def __init__(self, forest, bounds, calibrators, class_indices, classes):
+        self.forest = forest
+        self.bounds = bounds
+        self.calibrators = calibrators
+        self.class_indices = class_indices
+        self.classes_ = classes
+        self.n_classes = len(classes)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        forests, bounds, calibrators, class_indices = [], [], [], []
+        start = 0
+        for member in model.calibrated_classifiers_:
+            if member.method not in ('isotonic', 'sigmoid'):
+                raise TypeError(f'Metodo di calibrazione non supportato: {member.method}')
+            forest = CompiledForest.from_sklearn(member.estimator)
+            forests.append(forest)
+            bounds.append((start, start + forest.n_trees))
+            start += forest.n_trees
+
+            # Colonna della probabilità calibrata per ogni classe della foresta
+            positions = {c: i for i, c in enumerate(member.classes)}
+            class_indices.append(np.asarray(
+                [positions[c] for c in member.estimator.classes_], dtype=np.int64
+            ))
+            calibrators.append([CompiledCalibrator.from_sklearn(c) for c in member.calibrators])
+
+        merged = CompiledForest.concatenate(forests, classes=np.asarray(model.classes_))
+        return cls(merged, bounds, calibrators, class_indices, np.asarray(model.classes_))
+
+    @property
+    def nbytes(self):
+        return self.forest.nbytes
+
+    @property
+    def raw_input(self):
+        return self.forest.raw_input
+
+    def fold_scaler(self, mean, scale):
+        """Come CompiledForest.fold_scaler (i calibratori lavorano sulle probabilità)"""
+        return CompiledCalibratedForest(
+            self.forest.fold_scaler(mean, scale), self.bounds, self.calibrators,
+            self.class_indices, self.classes_,
+        )
+
+    def predict_proba(self, X):
+        leaves = self.forest.apply_by_tree(X)
+        n_samples = leaves.shape[1]
+        mean_proba = np.zeros((n_samples, self.n_classes))
+
+        for (start, stop), calibrators, class_indices in zip(
+            self.bounds, self.calibrators, self.class_indices
+        ):
+            # Probabilità non calibrate della foresta interna
+            raw = _mean_leaf_proba(self.forest.proba, leaves[start:stop])
+
+            proba = np.zeros((n_samples, self.n_classes))
+            for class_idx, column, calibrator in zip(class_indices, raw.T, calibrators):
+                proba[:, class_idx] = calibrator(column)
+
+            if self.n_classes == 2:
+                proba[:, 0] = 1.0 - proba[:, 1]
+            else:
+                # Normalizzazione; distribuzione uniforme se tutte le classi sono a zero
+                denominator = proba.sum(axis=1)[:, np.newaxis]
+                uniform = np.full_like(proba, 1 / self.n_classes)
+                proba = np.divide(proba, denominator, out=uniform, where=denominator != 0)
+            proba[(1.0 < proba) & (proba <= 1.0 + 1e-5)] = 1.0
+            mean_proba += proba
+
+        mean_proba /= len(self.bounds)
+        return mean_proba
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+
+class CompiledCalibrator:
+    """Calibratore one-vs-rest ridotto ai suoi parametri (isotonico o sigmoide)"""
+
+    def __init__(self, kind, params):
+        self.kind = kind
+        self.params = params
+
+    @classmethod
+    def from_sklearn(cls, calibrator):
+        if hasattr(calibrator, 'X_thresholds_'):
+            return cls('isotonic', {
+                'x': np.asarray(calibrator.X_thresholds_, dtype=np.float64),
+                'y': np.asarray(calibrator.y_thresholds_, dtype=np.float64),
+                'bounds': np.asarray([calibrator.X_min_, calibrator.X_max_], dtype=np.float64),
+                'clip': calibrator.out_of_bounds == 'clip',
+            })
+        if hasattr(calibrator, 'a_'):
+            return cls('sigmoid', {'a': float(calibrator.a_), 'b': float(calibrator.b_)})
+        raise TypeError(f'Calibratore non supportato: {type(calibrator).__name__}')
+
+    def __call__(self, T):
+        p = self.params
+        if self.kind == 'sigmoid':
+            return 1.0 / (1.0 + np.exp(p['a'] * T + p['b']))
+        if p['clip']:
+            T = np.clip(T, p['bounds'][0], p['bounds'][1])
+        if len(p['x']) == 1:
+            return np.full(T.shape, p['y'][0])
+        return np.interp(T, p['x'], p['y'], left=np.nan, right=np.nan)
+
+
+def compile_model(model):
+    """Compila un modello scikit-learn nel motore ad array.
+
+    Supporta RandomForestClassifier (e gli ensemble con `estimators_` di
+    alberi di classificazione) e CalibratedClassifierCV costruito su di essi.
+    """
+    if hasattr(model, 'calibrated_classifiers_'):
+        return CompiledCalibratedForest.from_sklearn(model)
+    if hasattr(model, 'estimators_') and all(
+        hasattr(e, 'tree_') for e in model.estimators_
+    ):
+        return CompiledForest.from_sklearn(model)
+    raise TypeError(f'Modello non supportato dal motore compilato: {type(model).__name__}')
+
+
+def is_tree_model(model):
+    """Vero se il modello è compilato o compilabile (foresta di alberi, o
+    calibrato su foreste), senza compilarlo"""
+    if hasattr(model, 'roots') or hasattr(model, 'forest'):
+        return True
+    members = getattr(model, 'calibrated_classifiers_', None)
+    if members is not None:
+        return all(m.method in ('isotonic', 'sigmoid') and is_tree_model(m.estimator)
+                   for m in members)
+    return hasattr(model, 'estimators_') and all(hasattr(e, 'tree_') for e in model.estimators_)
+
+
+def forest_weights(model):
+    """(foresta, pesi) di un modello compilato, a bin o scikit-learn: la
+    foresta con tutti gli alberi e il peso di ogni albero nella media delle
+    probabilità (per un calibrato, la media delle foreste interne)"""
+    if not hasattr(model, 'roots') and not hasattr(model, 'forest'):
+        model = compile_model(model)
+    forest = getattr(model, 'forest', model)
+    bounds = getattr(model, 'bounds', [(0, forest.n_trees)])
+    weights = np.zeros(forest.n_trees)
+    for start, stop in bounds:
+        weights[start:stop] = 1.0 / (len(bounds) * (stop - start))
+    return forest, weights
+
+
+def fold_scaler(model, scaler):
+    """Incorpora uno StandardScaler salvato nelle soglie di un modello compilato"""
+    n_features = len(scaler.scale_)
+    mean = scaler.mean_ if scaler.with_mean else np.zeros(n_features)
+    scale = scaler.scale_ if scaler.with_std else np.ones(n_features)
+    return model.fold_scaler(mean, scale)
+
+
+def quantize(model, scaler=None):
+    """Versione a bin di un modello compilato (foresta o calibrato).
+
+    Con uno StandardScaler la standardizzazione viene incorporata nei tagli:
+    il modello risultante accetta l'input grezzo e predice esattamente come
+    scikit-learn sull'input standardizzato.
+    """
+    forest = getattr(model, 'forest', model)
+    mean = scale = None
+    if scaler is not None:
+        n_features = len(scaler.scale_)
+        mean = scaler.mean_ if scaler.with_mean else np.zeros(n_features)
+        scale = scaler.scale_ if scaler.with_std else np.ones(n_features)
+    quantized = QuantizedForest.from_forest(forest, mean, scale)
+    if isinstance(model, CompiledCalibratedForest):
+        return CompiledCalibratedForest(quantized, model.bounds, model.calibrators,
+                                        model.class_indices, model.classes_)
+    return quantized
+
+
+def save_compiled(model, directory, overwrite=True, source=None):
+    """Esporta un modello compilato come file .npy piatti + meta.json.
+
+    I file vengono scritti in una directory temporanea e poi rinominati,
+    così chi carica (anche più worker in parallelo) non vede mai
+    un'esportazione a metà. Con overwrite=False una directory già presente
+    viene lasciata com'è. `source` (es. dimensione e data dei .pkl di
+    partenza) finisce in meta.json, per riconoscere un'esportazione vecchia.
+    """
+    directory = os.path.normpath(directory)
+    if not overwrite and os.path.isdir(directory):
+        return
+    tmp_dir = f'{directory}.tmp-{os.getpid()}'
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    forest = getattr(model, 'forest', model)
+    for name in NODE_ARRAYS:
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), np.ascontiguousarray(getattr(forest, name)))
+
+    meta = {
+        'format': 1,
+        'kind': 'calibrated' if isinstance(model, CompiledCalibratedForest) else 'forest',
+        'max_depth': forest.max_depth,
+        'classes': np.asarray(model.classes_).tolist(),
+        'raw_input': forest.raw_input,
+        'source': source,
+    }
+    if isinstance(model, CompiledCalibratedForest):
+        meta['bounds'] = [list(b) for b in model.bounds]
+        meta['class_indices'] = [c.tolist() for c in model.class_indices]
+        meta['calibrators'] = [
+            [{'kind': c.kind, 'params': {
+                k: v.tolist() if isinstance(v, np.ndarray) else v for k, v in c.params.items()
+            }} for c in member]
+            for member in model.calibrators
+        ]
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    old_dir = f'{directory}.old-{os.getpid()}'
+    if overwrite and os.path.isdir(directory):
+        # Spostata e non cancellata: la directory resta assente solo tra due
+        # rename, e chi ha già mappato i vecchi file continua a leggerli
+        try:
+            os.rename(directory, old_dir)
+        except FileNotFoundError:
+            pass
+    try:
+        os.rename(tmp_dir, directory)
+    except OSError:
+        # Un altro processo ha esportato nel frattempo: si usa la sua copia
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(directory):
+            raise
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def compiled_metadata(directory):
+    """meta.json di un'esportazione, o None se la directory non ne contiene una"""
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def load_compiled(directory, mmap_mode=None):
+    """Carica un modello esportato con save_compiled.
+
+    Con mmap_mode='r' gli array dei nodi restano mappati in memoria in sola
+    lettura: i worker che caricano la stessa directory condividono le
+    stesse pagine fisiche invece di averne ciascuno una copia privata.
+    """
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    arrays = {
+        name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+        for name in NODE_ARRAYS
+    }
+    classes = np.asarray(meta['classes'])
+    forest = CompiledForest(
+        **arrays, max_depth=meta['max_depth'], classes=classes, raw_input=meta['raw_input']
+    )
+    if meta['kind'] == 'forest':
+        return forest
+
+    calibrators = [
+        [CompiledCalibrator(c['kind'], {
+            k: np.asarray(v, dtype=np.float64) if isinstance(v, list) else v
+            for k, v in c['params'].items()
+        }) for c in member]
+        for member in meta['calibrators']
+    ]
+    return CompiledCalibratedForest(
+        forest,
+        [tuple(b) for b in meta['bounds']],
+        calibrators,
+        [np.asarray(c, dtype=np.int64) for c in meta['class_indices']],
+        classes,
+    )
+
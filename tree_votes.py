@@ -0,0 +1,94 @@
+import numpy as np
+
+from tree_engine import forest_weights
+
+
+class VoteAnalyzer:
+    """Consenso tra gli alberi della foresta, per batch interi.
+
+    Per ogni foglia sono precalcolati il voto dell'albero (la classe più
+    probabile, come tree.predict), la probabilità delle classi e il suo
+    quadrato: una sola visita della foresta (apply) e una lettura per albero
+    danno istogramma dei voti, entropia dei voti e dispersione delle
+    probabilità tra gli alberi, senza cicli Python sugli alberi.
+    """
+
+    # Elementi (righe x alberi x colonne della tabella) letti per blocco
+    BLOCK_ELEMENTS = 1 << 20
+
+    def __init__(self, forest, tree_weights):
+        self.forest = forest
+        self.tree_weights = np.asarray(tree_weights, dtype=np.float64)
+        self.n_classes = forest.n_classes
+
+        # Tabella per foglia: [voto one-hot | proba | proba^2]
+        n_nodes = len(forest.feature)
+        leaves = np.flatnonzero(forest.left == np.arange(n_nodes))
+        self.leaf_row = np.full(n_nodes, -1, dtype=np.int64)
+        self.leaf_row[leaves] = np.arange(len(leaves))
+        proba = forest.proba[leaves]
+        votes = np.eye(self.n_classes)[proba.argmax(axis=1)]
+        self.leaf_table = np.ascontiguousarray(np.hstack((votes, proba, proba ** 2)))
+
+    @classmethod
+    def from_model(cls, model):
+        """Analizzatore di un modello compilato (foresta, a bin o calibrato) o
+        scikit-learn. Per un modello calibrato i voti sono quelli degli alberi
+        di tutte le foreste interne, prima della calibrazione."""
+        forest, weights = forest_weights(model)
+        return cls(forest, weights)
+
+    @property
+    def nbytes(self):
+        return self.leaf_table.nbytes + self.leaf_row.nbytes
+
+    def analyze(self, X):
+        """Statistiche dei voti per riga, come dizionario di array:
+
+        - votes: alberi che votano ogni classe (n_samples, n_classes)
+        - vote_share: quota pesata dei voti (somma 1 per riga)
+        - vote_entropy: entropia di vote_share normalizzata in [0, 1]
+        - agreement: quota della classe più votata
+        - tree_proba_mean / tree_proba_std: media e deviazione standard
+          (pesate) delle probabilità delle classi tra gli alberi
+        """
+        leaves = self.leaf_row[self.forest.apply(X)]
+        n_samples, n_trees = leaves.shape
+        C = self.n_classes
+        counts = np.empty((n_samples, C))
+        weighted = np.empty((n_samples, 3 * C))
+        block = max(1, self.BLOCK_ELEMENTS // (n_trees * 3 * C))
+        for start in range(0, n_samples, block):
+            stop = start + block
+            gathered = self.leaf_table[leaves[start:stop]]
+            counts[start:stop] = gathered[:, :, :C].sum(axis=1)
+            weighted[start:stop] = np.einsum('rtk,t->rk', gathered, self.tree_weights)
+
+        total = self.tree_weights.sum()
+        share = weighted[:, :C] / total
+        mean = weighted[:, C:2 * C] / total
+        variance = np.maximum(weighted[:, 2 * C:] / total - mean ** 2, 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            entropy = -np.where(share > 0, share * np.log(share), 0.0).sum(axis=1)
+        return {
+            'votes': counts.round().astype(np.int64),
+            'vote_share': share,
+            'vote_entropy': entropy / np.log(C) if C > 1 else np.zeros(n_samples),
+            'agreement': share.max(axis=1),
+            'tree_proba_mean': mean,
+            'tree_proba_std': np.sqrt(variance),
+        }
+
+
+def format_uncertainty(stats, i, classes, min_agreement):
+    """Statistiche della riga i per la risposta JSON"""
+    return {
+        'votes': {c: int(stats['votes'][i, k]) for k, c in enumerate(classes)},
+        'vote_share': {c: float(stats['vote_share'][i, k]) for k, c in enumerate(classes)},
+        'majority_vote': classes[int(stats['vote_share'][i].argmax())],
+        'agreement': float(stats['agreement'][i]),
+        'vote_entropy': float(stats['vote_entropy'][i]),
+        'tree_proba_std': {c: float(stats['tree_proba_std'][i, k]) for k, c in enumerate(classes)},
+        'needs_review': bool(stats['agreement'][i] < min_agreement),
+    }
+
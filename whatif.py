@@ -0,0 +1,128 @@
+import math
+
+import numpy as np
+
+# Feature che si possono far variare insieme in una sola richiesta
+MAX_SWEEP_FEATURES = 2
+
+# Punti di default di un intervallo numerico senza "steps"
+DEFAULT_STEPS = 11
+
+
+class Axis:
+    """Una feature da far variare: valori mostrati e valori codificati per il modello"""
+
+    def __init__(self, feature, column, values, encoded, categorical):
+        self.feature = feature
+        self.column = column
+        self.values = values
+        self.encoded = encoded
+        self.categorical = categorical
+
+    def describe(self):
+        return {'feature': self.feature, 'values': self.values}
+
+
+def _number(value, name):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'"{name}" deve essere un numero, non {value!r}')
+    if not math.isfinite(number):
+        raise ValueError(f'"{name}" deve essere un numero finito')
+    return number
+
+
+def parse_axis(preprocessor, spec, max_points):
+    """Valida la descrizione di una feature da far variare e ne calcola i valori.
+
+    Numeriche: {"feature", "start", "stop", "steps"} (estremi inclusi) oppure
+    {"feature", "values": [...]}. Categoriche: {"feature", "values": [...]},
+    oppure solo {"feature"} per tutte le categorie note.
+    """
+    if not isinstance(spec, dict) or 'feature' not in spec:
+        raise ValueError('Ogni variazione deve indicare "feature"')
+    feature = spec['feature']
+    if feature not in preprocessor.feature_columns:
+        raise ValueError(f'Feature sconosciuta: {feature!r}')
+    column = preprocessor.feature_columns.index(feature)
+    codes = preprocessor.category_codes.get(feature)
+
+    if codes is not None:
+        values = spec.get('values', list(codes))
+        if not isinstance(values, list) or not values:
+            raise ValueError(f'"values" di {feature} deve essere una lista non vuota')
+        unknown = [v for v in values if not isinstance(v, (str, int, float)) or v not in codes]
+        if unknown:
+            raise ValueError(f'Categorie sconosciute per {feature}: {unknown}')
+        encoded = np.array([codes[v] for v in values], dtype=np.float64)
+    elif 'values' in spec:
+        values = spec['values']
+        if not isinstance(values, list) or not values:
+            raise ValueError(f'"values" di {feature} deve essere una lista non vuota')
+        encoded = np.array([_number(v, 'values') for v in values])
+        values = encoded.tolist()
+    else:
+        start, stop = _number(spec.get('start'), 'start'), _number(spec.get('stop'), 'stop')
+        steps = spec.get('steps', DEFAULT_STEPS)
+        if not isinstance(steps, int) or isinstance(steps, bool) or steps < 1:
+            raise ValueError(f'"steps" di {feature} deve essere un intero positivo')
+        if steps > max_points:
+            raise ValueError(f'Troppi punti per {feature}: massimo {max_points}')
+        encoded = np.linspace(start, stop, steps)
+        values = encoded.tolist()
+    return Axis(feature, column, values, encoded, categorical=codes is not None)
+
+
+def build_grid(base_row, axes):
+    """Matrice (n_punti, n_feature): la riga base ripetuta, con le colonne
+    variate su tutte le combinazioni (prima feature più esterna)"""
+    shape = tuple(len(axis.encoded) for axis in axes)
+    grid = np.repeat(base_row.reshape(1, -1), math.prod(shape), axis=0)
+    mesh = np.meshgrid(*(axis.encoded for axis in axes), indexing='ij')
+    for axis, values in zip(axes, mesh):
+        grid[:, axis.column] = values.ravel()
+    return grid, shape
+
+
+def closest_point(axes, shape, mask, base_row):
+    """Indice del punto della griglia (tra quelli in mask) più vicino allo
+    studente, o None. La distanza somma, per ogni asse, la variazione in
+    frazioni dell'intervallo (numeriche) o 1 se la categoria cambia."""
+    if not mask.any():
+        return None
+    mesh = np.meshgrid(*(axis.encoded for axis in axes), indexing='ij')
+    distance = np.zeros(shape)
+    for axis, values in zip(axes, mesh):
+        change = np.abs(values - base_row[axis.column])
+        if axis.categorical:
+            distance += change > 0
+        else:
+            distance += change / (np.ptp(axis.encoded) or 1.0)
+    distance = np.where(mask.reshape(shape), distance, np.inf)
+    return np.unravel_index(int(np.argmin(distance)), shape)
+
+
+def sensitivity(runtime, student, sweeps, max_points):
+    """Superficie di probabilità di uno studente al variare di una o due feature.
+
+    Tutta la griglia viene costruita come un'unica matrice e predetta con
+    una sola chiamata al modello, insieme allo studente così com'è.
+    Restituisce (riga codificata dello studente, assi, forma della griglia,
+    proba dello studente, proba dei punti della griglia).
+    """
+    preprocessor = runtime.preprocessor
+    if not isinstance(sweeps, list) or not 1 <= len(sweeps) <= MAX_SWEEP_FEATURES:
+        raise ValueError(f'"sweep" deve contenere da 1 a {MAX_SWEEP_FEATURES} feature')
+    axes = [parse_axis(preprocessor, spec, max_points) for spec in sweeps]
+    if len({axis.feature for axis in axes}) < len(axes):
+        raise ValueError('Ogni feature può comparire una sola volta in "sweep"')
+    n_points = math.prod(len(axis.encoded) for axis in axes)
+    if n_points > max_points:
+        raise ValueError(f'Griglia troppo grande: {n_points} punti, massimo {max_points}')
+
+    base_row = preprocessor.encode_one(student)[0].copy()
+    grid, shape = build_grid(base_row, axes)
+    X = preprocessor.scale_inplace(np.vstack((base_row, grid)))
+    proba = runtime.predict_proba(X)
+    return base_row, axes, shape, proba[0], proba[1:]